@@ -22,9 +22,16 @@ import SmartConnect from 'wslink/src/SmartConnect';
 
 import AMSControlPanel from './AMSControlPanel';
 
-// Create a SmartConnect object.
-const config = { sessionURL: 'ws://localhost:1234/ws' };
+// Create a SmartConnect object.  With '?launcher=http://host:9000/paraview'
+// in the page URL, the session comes from the launcher's pool of
+// pre-warmed servers (python/AMSLauncher.py) instead of the one server
+// on port 1234.
+const launcherURL = new URLSearchParams(window.location.search).get('launcher');
+const config = launcherURL
+  ? { sessionManagerURL: launcherURL, application: 'ams' }
+  : { sessionURL: 'ws://localhost:1234/ws' };
 const smartConnect = SmartConnect.newInstance({ config });
+const sessionRequested = Date.now();
 
 const model = {};
 let connectionReady = false;
@@ -111,7 +118,7 @@ const amsProtocols = {
 
       executePlot: (value) => {
         session.call('amsprotocol.execute.plot', [ value ])
-          .then((result) => console.log('result: ' + result));
+          .then((result) => console.log('execute.plot job: ', result.job));
         console.log("******* execute plot ------>", value, "<<<");
       },
 
@@ -133,9 +140,13 @@ const amsProtocols = {
         console.log("******* testbutton ------>", testValue);
       },
 
-      heartbeatUpdate: () => {
-        session.call('amsprotocol.heartbeat.update');
-      },
+      heartbeatUpdate: () => session.call('amsprotocol.heartbeat.update'),
+
+      pingImageLink: () => session.call('amsprotocol.image.link.ping', []),
+
+      probeImageLink: (size) => session.call('amsprotocol.image.link.probe', [ size ]),
+
+      reportImageLink: (link) => session.call('amsprotocol.image.link.report', [ link ]),
     };
   },
 };
@@ -153,6 +164,28 @@ smartConnect.onConnectionReady((connection) => {
                                      'VtkImageDelivery',
                                    ],
                                    amsProtocols);
+  // The plot requests run as jobs on the server, which tells us how they
+  // are doing on this topic.
+  connection.getSession().subscribe('amsprotocol.job.event', ([job]) => {
+    console.log('job', job.id, job.name, job.state, job.progress, job.message);
+    if (job.imageReady && job.message === 'preview') {
+      console.log('first image after', job.firstImage, 's');
+    }
+  });
+
+  // The server pushes a frame when the scene changes, and tells us why.
+  connection.getSession().subscribe('amsprotocol.scene.event', ([scene]) => {
+    model.sceneVersion = scene.version;
+    console.log('scene', scene.version, scene.reasons);
+  });
+
+  // Cases that were still being indexed come without their ranges; the
+  // server says when they are ready, and the catalog is fetched again.
+  connection.getSession().subscribe('amsprotocol.catalog.event', ([event]) => {
+    console.log('catalog ready', event.ready);
+    model.pvwClient.amsService.getDataCatalog();
+  });
+
   // Create a vtk renderer.
   const renderer = VtkRenderer.newInstance({ client: model.pvwClient });
 
@@ -161,6 +194,20 @@ smartConnect.onConnectionReady((connection) => {
   // renderer.onImageReady(() => {
   //   console.log('image ready (for next command)');
   // });
+
+  // Tell the launcher how long it took from asking for a session to
+  // the first image, for its stats.
+  if (launcherURL) {
+    const subscription = renderer.onImageReady(() => {
+      subscription.unsubscribe();
+      const sessionId = smartConnect.getConfig().id;
+      fetch(`${launcherURL}/${sessionId}/metrics`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ firstImage: (Date.now() - sessionRequested) / 1000 }),
+      });
+    });
+  }
   window.renderer = renderer;
   SizeHelper.onSizeChange(() => {
     renderer.resize();
@@ -168,12 +215,47 @@ smartConnect.onConnectionReady((connection) => {
   SizeHelper.startListening();
   connectionReady = true;
 
+  // The server fits the quality of the frames sent during interaction
+  // to the link, so tell it how the link is doing: once now, then when
+  // the user starts interacting, at most every LINK_MEASURE_INTERVAL.
+  // An idle session sends nothing.
+  measureImageLink();
+  ['mousedown', 'wheel', 'touchstart'].forEach((type) => {
+    divRenderer.addEventListener(type, measureImageLinkIfOld, { passive: true });
+  });
+
   // Now that the connection is ready, retrieve the data catalog and the
   // starter version of the viz catalog.
   model.pvwClient.amsService.getDataCatalog();
 
 });
 
+// Times a round trip and a small download, and reports them to the
+// server (see python/AMSImageDelivery.py).
+const PROBE_BYTES = 64 * 1024;
+const LINK_MEASURE_INTERVAL = 5000;
+let linkMeasured = 0;
+
+function measureImageLinkIfOld() {
+  if (performance.now() - linkMeasured >= LINK_MEASURE_INTERVAL) {
+    measureImageLink();
+  }
+}
+
+function measureImageLink() {
+  const service = model.pvwClient.amsService;
+  linkMeasured = performance.now();
+  const pingStart = performance.now();
+  service.pingImageLink().then(() => {
+    const rtt = (performance.now() - pingStart) / 1000;
+    const probeStart = performance.now();
+    return service.probeImageLink(PROBE_BYTES).then(() => {
+      const transfer = Math.max((performance.now() - probeStart) / 1000 - rtt, 0.001);
+      return service.reportImageLink({ rtt, bytesPerSecond: PROBE_BYTES / transfer });
+    });
+  });
+}
+
 function onDrawCommand(drawCommand) {
   console.log("onDrawCommand is to execute:", drawCommand);
   model.pvwClient.amsService.executePlot(drawCommand);
@@ -219,13 +301,18 @@ function next() {
 // find out.
 setInterval(next, 5000);
 
-// This function's purpose is to make the visualization canvas update when a
-// parameter has been changed or the visualization changes.
+// Check that the server is still there.  The canvas no longer depends on
+// this: the server pushes a frame when the scene changes.
 setInterval(function() {
   if (connectionReady) {
-    model.pvwClient.amsService.heartbeatUpdate();
+    model.pvwClient.amsService.heartbeatUpdate().then((beat) => {
+      if (model.sceneVersion !== undefined && beat.version !== model.sceneVersion) {
+        console.log('missed scene events up to version', beat.version);
+        model.sceneVersion = beat.version;
+      }
+    });
   };
-},1000);
+},10000);
 
 next();
 
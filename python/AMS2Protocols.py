@@ -1,6 +1,8 @@
 import os, sys, logging, types, inspect, traceback, logging, re, json, base64
 import time
 import threading
+import collections
+import multiprocessing.pool
 
 # import RPC annotation
 from wslink import register as exportRPC
@@ -25,6 +27,16 @@ from vtk.vtkPVServerManagerCore import vtkSMProxyManager
 #    vtkDataObject
 from vtk.vtkCommonDataModel import vtkDataObject
 
+import AMSEnSight
+import AMSSpanSpace
+import AMSPyramid
+import AMSStore
+import AMSHostCache
+import AMSSpatialIndex
+import AMSStreamlines
+import AMSMetrics
+import AMSDifference
+
 # =============================================================================
 #
 # Viewport Size
@@ -109,54 +121,653 @@ def ColorBy(rep=None, value=None):
       rep.SetScalarColoring(arrayname, servermanager.GetAssociationFromString(association), component)
     # rep.RescaleTransferFunctionToDataRange()
 
+def makeTrivialProducer(dataObject):
+    """
+    Wraps a VTK data object we built ourselves in a source proxy, so it
+    can be the input of regular ParaView filters and representations.
+    """
+    producer = simple.PVTrivialProducer()
+    producer.GetClientSideObject().SetOutput(dataObject)
+    producer.UpdatePipeline()
+    return producer
+
+class AMSPipeline(object):
+    """
+    The filters that draw one kind of plot of one dataset, and their
+    displays.  A new recipe for the same plot only changes properties on
+    these instead of building a new chain.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.filters = []       # (role, proxy), upstream first
+        self.displays = {}      # role -> display proxy
+
+    def addFilter(self, role, proxy, display=None):
+        self.filters.append((role, proxy))
+        if display is not None:
+            self.displays[role] = display
+        return proxy
+
+    def getFilter(self, role):
+        return dict(self.filters)[role]
+
+    def hasFilter(self, role):
+        return role in dict(self.filters)
+
+    def getDisplay(self, role):
+        return self.displays[role]
+
+    def setDisplay(self, role, display):
+        self.displays[role] = display
+
+    def delete(self):
+        """
+        Deletes the filters (and with them their displays), downstream
+        first.
+        """
+        for role, proxy in reversed(self.filters):
+            simple.Delete(proxy)
+        self.filters = []
+        self.displays = {}
+
+
+def proxyKey(proxy):
+    try:
+        return proxy.GetGlobalIDAsString()
+    except AttributeError:
+        return id(proxy)
+
+
+def plainValue(value):
+    """
+    A property value as nested lists, for comparing.
+    """
+    if isinstance(value, (str, bytes)) or not hasattr(value, '__len__'):
+        return value
+    return [plainValue(v) for v in value]
+
+
+class AMSTransactionStats(object):
+    """
+    What the transactions did, and what they saved: the updates, renders
+    and camera resets that were asked for but merged into the one done at
+    commit, and the property changes dropped because a later one replaced
+    them or the property had the value already.
+    """
+    def __init__(self):
+        self.transactions = 0
+        self.propertiesStaged = 0
+        self.propertiesApplied = 0
+        self.propertiesReplaced = 0
+        self.propertiesUnchanged = 0
+        self.updatesRequested = 0
+        self.updates = 0
+        self.rendersRequested = 0
+        self.renders = 0
+        self.cameraResetsRequested = 0
+        self.cameraResets = 0
+
+    def getStats(self):
+        return {
+            "transactions": self.transactions,
+            "propertiesStaged": self.propertiesStaged,
+            "propertiesApplied": self.propertiesApplied,
+            "propertiesAvoided": self.propertiesReplaced + self.propertiesUnchanged,
+            "updates": self.updates,
+            "updatesAvoided": self.updatesRequested - self.updates,
+            "renders": self.renders,
+            "rendersAvoided": self.rendersRequested - self.renders,
+            "cameraResets": self.cameraResets,
+            "cameraResetsAvoided": self.cameraResetsRequested - self.cameraResets,
+        }
+
+
+class AMSTransaction(object):
+    """
+    Filter and display changes for a view, staged and applied together.
+
+    Setting a property, showing a filter or updating the view each make
+    ParaView do some work, and doing them one by one does some of it
+    several times: a stream tracer shown with its default seeds and then
+    given the recipe's traces twice.  A transaction keeps the changes
+    until commit(), which applies the last value staged for each
+    property (skipping the ones that have it already), shows and hides
+    filters, updates the view once, runs what needed the updated data
+    (coloring by a data range), resets the camera if asked, and renders
+    once.  The counts go to an AMSTransactionStats.
+    """
+    def __init__(self, view, stats=None):
+        self.view = view
+        self.stats = stats if stats is not None else AMSTransactionStats()
+        self.properties = collections.OrderedDict()    # (proxy, name) key -> (proxy, name, value)
+        self.shows = []             # (proxy, onShow)
+        self.hides = []
+        self.beforeUpdates = []
+        self.afterUpdates = []
+        self.updateRequests = 0
+        self.renderRequests = 0
+        self.cameraResetRequests = 0
+        self.committed = False
+
+    def set(self, proxy, name, value):
+        """
+        Stages a property change.
+        """
+        key = (proxyKey(proxy), name)
+        if key in self.properties:
+            self.stats.propertiesReplaced += 1
+            del self.properties[key]
+        self.properties[key] = (proxy, name, value)
+        self.stats.propertiesStaged += 1
+
+    def setProperties(self, proxy, **properties):
+        for name in sorted(properties.keys()):
+            self.set(proxy, name, properties[name])
+
+    def show(self, proxy, onShow=None):
+        """
+        Shows the filter at commit, after its properties are set.
+        'onShow' is called with the display, and may stage changes to it.
+        """
+        self.shows.append((proxy, onShow))
+
+    def hide(self, proxy):
+        self.hides.append(proxy)
+
+    def beforeUpdate(self, function):
+        """
+        Runs 'function' at commit, once the properties are set and before
+        the filters are shown and the view updated: to update some
+        filters by themselves, to time them.
+        """
+        self.beforeUpdates.append(function)
+
+    def afterUpdate(self, function):
+        """
+        Runs 'function' at commit, once the view has been updated.
+        """
+        self.afterUpdates.append(function)
+
+    # What used to be done on the spot is asked for, and done once at
+    # commit.  Commit updates and renders whether asked or not.
+
+    def update(self):
+        self.updateRequests += 1
+
+    def resetCamera(self):
+        self.cameraResetRequests += 1
+
+    def render(self):
+        self.renderRequests += 1
+
+    def applyProperties(self):
+        properties = list(self.properties.values())
+        self.properties.clear()
+        for proxy, name, value in properties:
+            try:
+                unchanged = plainValue(proxy.GetPropertyValue(name)) == plainValue(value)
+            except Exception:
+                unchanged = False
+            if unchanged:
+                self.stats.propertiesUnchanged += 1
+            else:
+                setattr(proxy, name, value)
+                self.stats.propertiesApplied += 1
+
+    def commit(self):
+        """
+        Applies the staged changes with one update and one render.
+        """
+        if self.committed:
+            return
+        self.committed = True
+        self.stats.transactions += 1
+        self.stats.updatesRequested += max(self.updateRequests, 1)
+        self.stats.rendersRequested += max(self.renderRequests, 1)
+        self.stats.cameraResetsRequested += self.cameraResetRequests
+        self.applyProperties()
+
+        for function in self.beforeUpdates:
+            function()
+        for proxy, onShow in self.shows:
+            display = simple.Show(proxy, self.view)
+            if onShow is not None:
+                onShow(display)
+        for proxy in self.hides:
+            simple.Hide(proxy, self.view)
+        self.applyProperties()
+
+        with AMSMetrics.timeStage("view update"):
+            self.view.Update()
+        self.stats.updates += 1
+
+        for function in self.afterUpdates:
+            function()
+        self.applyProperties()
+
+        if self.cameraResetRequests:
+            self.view.ResetCamera()
+            self.stats.cameraResets += 1
+        with AMSMetrics.timeStage("render"):
+            simple.Render(self.view)
+        self.stats.renders += 1
+
+
+class AMSPipelineCache(object):
+    """
+    The pipelines we have built, keyed by (dataset name, plot type), in
+    least-recently-used order.  When there are more than 'maxPipelines',
+    the one used longest ago is deleted.
+    """
+    def __init__(self, maxPipelines=4):
+        self.pipelines = collections.OrderedDict()
+        self.maxPipelines = maxPipelines
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        pipeline = self.pipelines.pop(key, None)
+        if pipeline is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pipelines[key] = pipeline
+        return pipeline
+
+    def add(self, pipeline):
+        self.pipelines[pipeline.key] = pipeline
+        while len(self.pipelines) > self.maxPipelines:
+            key, oldest = self.pipelines.popitem(last=False)
+            oldest.delete()
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Deletes all the cached pipelines.
+        """
+        while self.pipelines:
+            key, pipeline = self.pipelines.popitem()
+            pipeline.delete()
+
+    def getStats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.pipelines),
+            "maxEntries": self.maxPipelines,
+        }
+
+    def __len__(self):
+        return len(self.pipelines)
+
+
+def copyDataObject(dataObject):
+    """
+    Returns a deep copy of a VTK data object, e.g. a filter output we
+    want to keep after the filter runs again.
+    """
+    copy = dataObject.NewInstance()
+    copy.DeepCopy(dataObject)
+    return copy
+
+def arrayBytes(obj):
+    """
+    Bytes in the NumPy arrays an object keeps in its attributes (and in
+    lists of them).
+    """
+    total = 0
+    for value in vars(obj).values():
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            total += getattr(item, "nbytes", 0) if hasattr(item, "dtype") else 0
+    return total
+
+
+def dataObjectBytes(dataObject):
+    """
+    Bytes of a VTK data object (0 for None).
+    """
+    return dataObject.GetActualMemorySize() * 1024 if dataObject is not None else 0
+
+
+def hasPointArray(dataObject, name):
+    """
+    True if the (possibly composite) data object has a point array with
+    the given name in every non-empty leaf.
+    """
+    if not dataObject.IsA('vtkCompositeDataSet'):
+        return dataObject.GetNumberOfPoints() == 0 or dataObject.GetPointData().HasArray(name) == 1
+    iterator = dataObject.NewIterator()
+    iterator.InitTraversal()
+    while not iterator.IsDoneWithTraversal():
+        leaf = iterator.GetCurrentDataObject()
+        if leaf.GetNumberOfPoints() > 0 and leaf.GetPointData().HasArray(name) != 1:
+            return False
+        iterator.GoToNextItem()
+    return True
+
+
+class AMSSurfaceCache(object):
+    """
+    Extracted isosurfaces, keyed by (case file, contour variable,
+    isovalues, point merge method), so that going back to a contour we
+    have already computed doesn't run the filter over the whole mesh
+    again.  The cache holds at most 'maxBytes' of surfaces; the ones used
+    longest ago are evicted first.
+    """
+    def __init__(self, maxBytes=256 * 1024 * 1024):
+        self.surfaces = collections.OrderedDict()   # key -> (data object, bytes)
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.surfaces.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.surfaces[key] = entry
+        return entry[0]
+
+    def add(self, key, surface):
+        size = surface.GetActualMemorySize() * 1024
+        if size > self.maxBytes:
+            return
+        old = self.surfaces.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.surfaces[key] = (surface, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes:
+            oldestKey, (oldest, oldestSize) = self.surfaces.popitem(last=False)
+            self.bytes -= oldestSize
+            self.evictions += 1
+
+    def contains(self, key):
+        return key in self.surfaces
+
+    def discard(self, key):
+        entry = self.surfaces.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def discardData(self, dataFile):
+        """
+        Drops the surfaces of one case, whose values changed.
+        """
+        for key in list(self.surfaces.keys()):
+            if key[0] == dataFile:
+                self.discard(key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.bytes = 0
+
+    def getStats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.surfaces),
+            "bytes": self.bytes,
+            "maxBytes": self.maxBytes,
+        }
+
+    def __len__(self):
+        return len(self.surfaces)
+
+
 class AMSPlot(object):
     """
     Contains data and a plot recipe.  The view is executed with the
     execute() method.
+
+    If a pipeline cache is given, the filters are taken from it when
+    the same plot type was drawn for the same dataset before.  If a
+    surface cache is given, contours we computed before are taken from
+    it instead of running the contour filter again.
+
+    The changes a recipe makes to the filters and displays go through
+    an AMSTransaction, so the view is updated and rendered once for the
+    plot (and once for its preview).  Their counts go to 'transactions',
+    an AMSTransactionStats, if given.
     """
-    def __init__(self, dataObject, plotRecipe):
+    def __init__(self, dataObject, plotRecipe, pipelines=None, dataName=None, surfaces=None,
+                 transactions=None):
         self.dataObject = dataObject
         self.plotRecipe = plotRecipe
+        self.pipelines = pipelines
+        self.dataName = dataName
+        self.surfaces = surfaces
+        self.transactions = transactions
+
+        # Set by setIsovalues() when the surface slider overrides the
+        # recipe's contour value.
+        self.isovalues = None
+
+        # The pyramid level the plot is drawn from (None for the full
+        # resolution case), chosen in drawSteps().
+        self.level = None
+
+    def getRequiredArrays(self):
+        """
+        Returns the names of the point arrays this plot reads.
+        """
+        arrays = [self.plotRecipe.get('EnumColorVariable')]
+        if self.plotRecipe.get('EnumPlotType') == 'contour':
+            arrays.append(self.getContourVariable())
+        else:
+            arrays.append('velocity')
+        return arrays
+
+    def getContourVariable(self):
+        return self.plotRecipe.get('EnumContourVariable', 'uds_0_scalar')
+
+    def getIsovalues(self):
+        if self.isovalues is not None:
+            return self.isovalues
+        values = self.plotRecipe.get('DoubleContourValue')
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        return [float(v) for v in values]
+
+    def setIsovalues(self, isovalues):
+        self.isovalues = [float(v) for v in isovalues]
+
+    def getContourEngine(self):
+        """
+        'filter' runs ParaView's Contour over the whole mesh; 'spanspace'
+        uses the data object's span-space index to contour only the cells
+        that straddle the isovalue.  The index numbers the cells as the
+        native reader lays them out, which ParaView's EnSight reader need
+        not, so other data objects get 'filter'.
+        """
+        engine = self.plotRecipe.get('EnumContourEngine', 'filter')
+        if engine == 'spanspace' and self.dataObject.reader != 'native':
+            return 'filter'
+        return engine
+
+    def getStreamEngine(self):
+        """
+        'tracer' runs ParaView's StreamTracer; 'numpy' traces all the
+        seeds at once with AMSStreamlines, on the full resolution mesh.
+        """
+        return self.plotRecipe.get('EnumStreamEngine', 'tracer')
+
+    def getPointMergeMethod(self):
+        return self.plotRecipe.get('EnumPointMergeMethod', 'Uniform Binning')
+
+    def getLevel(self):
+        """
+        Picks the pyramid level to draw from, by the recipe's quality
+        setting (0 to 1) or time budget (seconds), if it has either.
+        """
+        if self.getPlotType() != 'contour' and self.getStreamEngine() == 'numpy':
+            return None
+        return self.dataObject.selectLevel(self.plotRecipe.get('DoubleQuality', None),
+                                           self.plotRecipe.get('DoubleTimeBudget', None),
+                                           self.getRequiredArrays())
+
+    def getInput(self):
+        return self.dataObject.getData(self.level)
+
+    def getPlotType(self):
+        if self.plotRecipe is None:
+            return None
+        return self.plotRecipe.get('EnumPlotType')
 
     def draw(self):
+        """
+        Draws the plot in one go.
+        """
+        for step in self.drawSteps():
+            pass
+
+    def isProgressive(self):
+        """
+        Whether jobs should draw this plot progressively: a quick preview
+        first, then the full-resolution result.
+        """
+        return self.plotRecipe.get('BoolProgressive', True)
+
+    def drawSteps(self, progressive=False):
+        """
+        Draws the plot, yielding (progress, message) between the expensive
+        stages, so that it can run as a job (see AMSJobs).  If progressive,
+        a quick preview is drawn first, and yielded as (progress,
+        message, True) to say there is an image worth showing.
+        """
+
+        # Make sure the reader provides the arrays we need (and gets to
+        # drop the ones nobody has used for a while).
+        self.dataObject.useArrays(self.getRequiredArrays())
+        self.level = self.getLevel()
 
         if self.plotRecipe.get('EnumPlotType') == 'contour':
-            self.makeContour()
+            steps = self.makeContour(progressive)
+        elif self.getStreamEngine() == 'numpy':
+            steps = self.makeArrayStream(progressive)
         else:
-            self.makeStream()
+            steps = self.makeStream(progressive)
+
+        # Time only the work, not the turns of the event loop in between,
+        # so the data object can estimate what the levels cost.  The
+        # steps commit their own transactions, which render.
+        busy = 0.0
+        start = time.time()
+        for step in steps:
+            busy += time.time() - start
+            yield step
+            start = time.time()
+
+        busy += time.time() - start
+        self.dataObject.recordDrawTime(self.level, busy)
+        yield 1.0, "rendered"
+
+    def beginTransaction(self):
+        return AMSTransaction(self.dataObject.renderView, self.transactions)
+
+    def showDisplay(self, transaction, pipeline, role, display):
+        """
+        Records a filter's display in its pipeline when it's shown, and
+        sets the defaults of a new one.
+        """
+        pipeline.setDisplay(role, display)
+        transaction.set(display, 'Representation', 'Surface')
 
-        simple.Render()
+    def getPipeline(self, plotType):
+        """
+        Returns the cached pipeline for this dataset and plot type, or
+        None if it has to be built.
+        """
+        if self.pipelines is None:
+            return None
+        return self.pipelines.get(self.getPipelineKey(plotType))
+
+    def getPipelineKey(self, plotType):
+        if self.level is None:
+            return (self.dataName, plotType)
+        return (self.dataName, plotType, self.level)
+
+    def addPipeline(self, pipeline):
+        if self.pipelines is not None:
+            self.pipelines.add(pipeline)
+        return pipeline
 
     def clearFilters(self):
+        if self.pipelines is not None:
+            self.pipelines.clear()
         for f in simple.GetSources().values():
             if f.GetProperty("Input") is not None:
                 simple.Delete(f)
 
     def clearAll(self):
+        if self.pipelines is not None:
+            self.pipelines.clear()
         for f in simple.GetSources().values():
             simple.Delete(f)
             
             
-    def makeContour(self):
+    def makeContour(self, progressive=False):
 
         # get color transfer function/color map for the data to color with.
         dataLUT = simple.GetColorTransferFunction(self.plotRecipe.get('EnumColorVariable'))
 
-        # create a new 'Contour'
-        contour = simple.Contour(Input=self.dataObject.getData())
+        pipeline = self.getPipeline('contour')
+        if pipeline is None:
+            pipeline = AMSPipeline(self.getPipelineKey('contour'))
+
+            # create a new 'Contour'.  It is never shown itself: what we
+            # show is a copy of its output, so that the same surface can
+            # be shown again later from the surface cache.
+            contour = simple.Contour(Input=self.getInput())
+            surface = simple.PVTrivialProducer()
+
+            pipeline.addFilter('contour', contour)
+            pipeline.addFilter('surface', surface)
+
+            # The points of a pyramid level outside the mesh are 0, and
+            # marked invalid; the triangles that touch them would show
+            # up as walls, as in the preview.
+            if self.level is not None:
+                contour.ComputeScalars = 1
+                valid = simple.Threshold(Input=contour)
+                valid.Scalars = ['POINTS', 'vtkValidPointMask']
+                valid.ThresholdRange = [1.0, 1.0]
+                pipeline.addFilter('valid', valid)
+            self.addPipeline(pipeline)
+        else:
+            contour = pipeline.getFilter('contour')
+            surface = pipeline.getFilter('surface')
+        valid = pipeline.getFilter('valid') if pipeline.hasFilter('valid') else None
+
+        transaction = self.beginTransaction()
+        transaction.show(surface, lambda display: self.showDisplay(transaction, pipeline, 'surface', display))
+        colorContour = lambda: self.colorContour(pipeline.getDisplay('surface'), dataLUT)
 
-        #print "DoubleContourValue", self.plotRecipe.get('DoubleContourValue')
-        #print "EnumContourVariable", self.plotRecipe.get('EnumContourVariable')
-        # Properties modified on contour
-        #contour.ContourBy = ['POINTS', self.plotRecipe.get('enum.contour.variable')]
-        contour.ContourBy = ['POINTS', 'uds_0_scalar']
-        contour.Isosurfaces = self.plotRecipe.get('DoubleContourValue')
+        # A surface we have in the cache is quicker than any preview, and
+        # a coarse level is a preview already.
+        if progressive and self.level is None and not self.hasCachedSurface():
+            self.setOutput(surface, self.makePreviewSurface(pipeline))
+            transaction.afterUpdate(colorContour)
+            transaction.commit()
+            yield 0.3, "preview", True
+            transaction = self.beginTransaction()
 
+        self.setSurface(contour, surface, valid)
+        yield 0.7, "isosurface extracted"
 
-        # show data in view
-        contourDisplay = simple.Show(contour, self.dataObject.renderView)
-        # trace defaults for the display properties.
-        contourDisplay.Representation = 'Surface'
+        transaction.afterUpdate(colorContour)
+
+        # reset view to fit data
+        transaction.resetCamera()
+        transaction.commit()
+
+    def colorContour(self, contourDisplay, dataLUT):
 
         # show color bar/color legend
         contourDisplay.SetScalarBarVisibility(self.dataObject.renderView, True)
@@ -171,56 +782,231 @@ class AMSPlot(object):
         # rescale color and/or opacity maps used to include current data range
         contourDisplay.RescaleTransferFunctionToDataRange(True, False)
 
-        # reset view to fit data
-        self.dataObject.renderView.ResetCamera()
+    def getSurfaceKey(self):
+        return (self.dataObject.getDataFile(), self.level, self.getContourVariable(),
+                tuple(self.getIsovalues()), self.getPointMergeMethod())
 
-        self.dataObject.renderView.Update()
+    def hasCachedSurface(self):
+        return self.surfaces is not None and self.surfaces.contains(self.getSurfaceKey())
 
-    def makeStream(self):
+    def makePreviewSurface(self, pipeline):
+        """
+        Returns a quick, coarse version of the isosurface: the contour of
+        the coarsest level of the data object's pyramid, or if it has none,
+        of the data resampled onto a small image (through the spatial index
+        if the case has one).  Resampled points outside
+        the mesh are marked invalid, and the triangles that touch them are
+        thresholded away so they don't show up as walls.
+        """
+        if not pipeline.hasFilter('previewContour'):
+            source = self.dataObject.getPreviewData(self.getRequiredArrays())
+            if source is None and self.dataObject.hasSpatialIndex():
+                source = simple.PVTrivialProducer()
+                pipeline.addFilter('previewImage', source)
+            elif source is None:
+                source = simple.ResampleToImage(Input=self.dataObject.getData())
+                pipeline.addFilter('previewResample', source)
+            previewContour = simple.Contour(Input=source)
+            previewContour.ComputeScalars = 1
+            valid = simple.Threshold(Input=previewContour)
+            valid.Scalars = ['POINTS', 'vtkValidPointMask']
+            valid.ThresholdRange = [1.0, 1.0]
+            pipeline.addFilter('previewContour', previewContour)
+            pipeline.addFilter('previewValid', valid)
+
+        resolution = self.plotRecipe.get('IntegerPreviewResolution', 64)
+        if pipeline.hasFilter('previewImage'):
+            self.setOutput(pipeline.getFilter('previewImage'),
+                           self.dataObject.getResampledImage(resolution, self.getRequiredArrays()))
+        if pipeline.hasFilter('previewResample'):
+            resample = pipeline.getFilter('previewResample')
+            resample.SamplingDimensions = [resolution, resolution, resolution]
+        previewContour = pipeline.getFilter('previewContour')
+        previewContour.ContourBy = ['POINTS', self.getContourVariable()]
+        previewContour.Isosurfaces = self.getIsovalues()
+        valid = pipeline.getFilter('previewValid')
+        valid.UpdatePipeline()
+        return copyDataObject(valid.GetClientSideObject().GetOutputDataObject(0))
+
+    def setOutput(self, producer, output):
+        producer.GetClientSideObject().SetOutput(output)
+        producer.MarkModified(producer)
+        producer.UpdatePipeline()
+
+    def setSurface(self, contour, surface, valid=None):
+        """
+        Puts the isosurface for the current recipe into the 'surface'
+        producer, from the cache if we can, else by running the contour
+        (and 'valid', the threshold that drops what is outside the mesh,
+        if there is one).
+        """
+        key = self.getSurfaceKey()
+        colorVariable = self.plotRecipe.get('EnumColorVariable')
+
+        output = None
+        if self.surfaces is not None:
+            output = self.surfaces.get(key)
+            # A surface computed before the color array was loaded
+            # doesn't have it, and has to be computed again.
+            if output is not None and not hasPointArray(output, colorVariable):
+                self.surfaces.discard(key)
+                output = None
+
+        # The span-space index is over the full resolution mesh.
+        if output is None and self.level is None and self.getContourEngine() == 'spanspace':
+            variable = self.getContourVariable()
+            index = self.dataObject.getSpanSpaceIndex(variable)
+            with AMSMetrics.timeStage("contour", engine="spanspace"):
+                output = AMSSpanSpace.extractIsosurface(self.dataObject.getDataSet(), index,
+                                                        variable, self.getIsovalues())
+            if self.surfaces is not None:
+                self.surfaces.add(key, output)
+
+        if output is None:
+            # Properties modified on contour
+            contour.ContourBy = ['POINTS', self.getContourVariable()]
+            contour.Isosurfaces = self.getIsovalues()
+            contour.PointMergeMethod = self.getPointMergeMethod()
+            if valid is None:
+                valid = contour
+            with AMSMetrics.timeStage("contour", engine="vtk"):
+                valid.UpdatePipeline()
+            output = copyDataObject(valid.GetClientSideObject().GetOutputDataObject(0))
+            if self.surfaces is not None:
+                self.surfaces.add(key, output)
+
+        self.setOutput(surface, output)
+
+    def makeStream(self, progressive=False):
 
         # get color transfer function/color map for the data to color with.
         dataLUT = simple.GetColorTransferFunction(self.plotRecipe.get('EnumColorVariable'))
 
-        # create a new 'Stream Tracer'
-        streamTracer = simple.StreamTracer(Input=self.dataObject.getData(),
-                                           SeedType='High Resolution Line Source')
-
-        # Properties modified on streamTracer.SeedType
-        streamTracer.SeedType.Resolution = 450
-
-        # Properties modified on streamTracer
-        streamTracer.MaximumSteps = 600
-
-        # show data in view
-        streamTracerDisplay = simple.Show(streamTracer, self.dataObject.renderView)
-        # trace defaults for the display properties.
-        streamTracerDisplay.Representation = 'Surface'
-
-        # show color bar/color legend
-        streamTracerDisplay.SetScalarBarVisibility(self.dataObject.renderView, False)
-
-        # update the view to ensure updated data information
-        self.dataObject.renderView.Update()
-
-        # create a new 'Ribbon'
-        ribbon = simple.Ribbon(Input=streamTracer)
+        pipeline = self.getPipeline('streamlines')
+        if pipeline is None:
+            pipeline = AMSPipeline(self.getPipelineKey('streamlines'))
 
-        # Properties modified on ribbon
-        ribbon.Scalars = ['POINTS', self.plotRecipe.get('EnumColorVariable')]
+            # create a new 'Stream Tracer'.  It is not shown itself, only
+            # its ribbons, so nothing is traced until the recipe's seeds
+            # are set and the ribbons are shown at commit.
+            streamTracer = simple.StreamTracer(Input=self.getInput(),
+                                               SeedType='High Resolution Line Source')
 
-        # show data in view
-        ribbonDisplay = simple.Show(ribbon, self.dataObject.renderView)
-        # trace defaults for the display properties.
-        ribbonDisplay.Representation = 'Surface'
+            # create a new 'Ribbon'
+            ribbon = simple.Ribbon(Input=streamTracer)
+            ribbon.Width = 0.003
 
-        # hide data in view
-        simple.Hide(streamTracer, self.dataObject.renderView)
+            pipeline.addFilter('streamTracer', streamTracer)
+            pipeline.addFilter('ribbon', ribbon)
+            self.addPipeline(pipeline)
+        else:
+            streamTracer = pipeline.getFilter('streamTracer')
+            ribbon = pipeline.getFilter('ribbon')
+
+        def updateStages():
+            # The view update would run both; done here they are timed
+            # apart.
+            with AMSMetrics.timeStage("streamTracer", engine="vtk"):
+                streamTracer.UpdatePipeline()
+            with AMSMetrics.timeStage("ribbon"):
+                ribbon.UpdatePipeline()
+
+        transaction = self.beginTransaction()
+        transaction.set(ribbon, 'Scalars', ['POINTS', self.plotRecipe.get('EnumColorVariable')])
+        transaction.show(ribbon, lambda display: self.showDisplay(transaction, pipeline, 'ribbon', display))
+        transaction.beforeUpdate(updateStages)
+        colorRibbon = lambda: self.colorRibbon(pipeline.getDisplay('ribbon'), dataLUT)
+
+        if progressive:
+            # A few dozen short streamlines first, to have something to
+            # look at while the real ones are traced.
+            transaction.set(streamTracer.SeedType, 'Resolution',
+                            self.plotRecipe.get('IntegerPreviewSeedResolution', 30))
+            transaction.set(streamTracer, 'MaximumSteps',
+                            self.plotRecipe.get('IntegerPreviewMaximumSteps', 200))
+            transaction.afterUpdate(colorRibbon)
+            transaction.commit()
+            yield 0.3, "preview", True
+            transaction = self.beginTransaction()
+            transaction.beforeUpdate(updateStages)
+
+        transaction.set(streamTracer.SeedType, 'Resolution', self.plotRecipe.get('IntegerSeedResolution', 200))
+        transaction.set(streamTracer, 'MaximumSteps', self.plotRecipe.get('IntegerMaximumSteps', 600))
+        transaction.afterUpdate(colorRibbon)
+        transaction.resetCamera()
+        yield 0.5, "seeds set"
+
+        # The tracing happens here, in the update.
+        transaction.commit()
+        simple.SetActiveSource(streamTracer)
+        yield 0.9, "streamlines updated"
 
-        # show color bar/color legend
-        ribbonDisplay.SetScalarBarVisibility(self.dataObject.renderView, True)
+    def traceStreamlines(self, resolution, maxSteps):
+        """
+        Traces streamlines from StreamTracer's default line of seeds with
+        the data object's tracer, and returns them with the color
+        variable on them.
+        """
+        tracer = self.dataObject.getStreamlineTracer()
+        colorVariable = self.plotRecipe.get('EnumColorVariable')
+        seeds = AMSStreamlines.lineSeeds(tracer.index.getBounds(), resolution)
+        with AMSMetrics.timeStage("streamTracer", engine="numpy"):
+            lines = tracer.trace(seeds, maxSteps=maxSteps,
+                                 integrator=self.plotRecipe.get('EnumIntegrator', 'rk45'))
+        case = self.dataObject.getEnSightCase()
+        return lines.makeVTKPolyData({colorVariable: case.getPointArray(colorVariable)})
+
+    def makeArrayStream(self, progressive=False):
+        """
+        Like makeStream(), with the streamlines traced by AMSStreamlines
+        instead of StreamTracer.
+        """
+        dataLUT = simple.GetColorTransferFunction(self.plotRecipe.get('EnumColorVariable'))
 
-        # update the view to ensure updated data information
-        self.dataObject.renderView.Update()
+        pipeline = self.getPipeline('arrayStreamlines')
+        if pipeline is None:
+            pipeline = AMSPipeline(self.getPipelineKey('arrayStreamlines'))
+            streamlines = simple.PVTrivialProducer()
+            ribbon = simple.Ribbon(Input=streamlines)
+            ribbon.Width = 0.003
+            pipeline.addFilter('streamlines', streamlines)
+            pipeline.addFilter('ribbon', ribbon)
+            self.addPipeline(pipeline)
+        else:
+            streamlines = pipeline.getFilter('streamlines')
+            ribbon = pipeline.getFilter('ribbon')
+
+        transaction = self.beginTransaction()
+        transaction.set(ribbon, 'Scalars', ['POINTS', self.plotRecipe.get('EnumColorVariable')])
+        transaction.show(ribbon, lambda display: self.showDisplay(transaction, pipeline, 'ribbon', display))
+        colorRibbon = lambda: self.colorRibbon(pipeline.getDisplay('ribbon'), dataLUT)
+
+        if progressive:
+            self.setOutput(streamlines, self.traceStreamlines(
+                self.plotRecipe.get('IntegerPreviewSeedResolution', 30),
+                self.plotRecipe.get('IntegerPreviewMaximumSteps', 200)))
+            transaction.afterUpdate(colorRibbon)
+            transaction.commit()
+            yield 0.3, "preview", True
+            transaction = self.beginTransaction()
+
+        self.setOutput(streamlines, self.traceStreamlines(
+            self.plotRecipe.get('IntegerSeedResolution', 200),
+            self.plotRecipe.get('IntegerMaximumSteps', 600)))
+        yield 0.8, "streamlines traced"
+
+        transaction.beforeUpdate(lambda: self.updateRibbon(ribbon))
+        transaction.afterUpdate(colorRibbon)
+        transaction.resetCamera()
+        transaction.commit()
+        simple.SetActiveSource(streamlines)
+        yield 0.9, "streamlines updated"
+
+    def updateRibbon(self, ribbon):
+        with AMSMetrics.timeStage("ribbon"):
+            ribbon.UpdatePipeline()
+
+    def colorRibbon(self, ribbonDisplay, dataLUT):
 
         # set scalar coloring
         ColorBy(ribbonDisplay, ('POINTS', self.plotRecipe.get('EnumColorVariable')))
@@ -235,43 +1021,120 @@ class AMSPlot(object):
         # show color bar/color legend
         ribbonDisplay.SetScalarBarVisibility(self.dataObject.renderView, True)
 
-        # get color transfer function/color map for 'uds_0_scalar'
-        colorLUT = simple.GetColorTransferFunction(self.plotRecipe.get('EnumColorVariable'))
 
-        # Properties modified on ribbon
-        ribbon.Width = 0.003
-
-        self.dataObject.renderView.ResetCamera()
     
-        # update the view to ensure updated data information
-        self.dataObject.renderView.Update()
-
-        # set active source
-        simple.SetActiveSource(streamTracer)
+def openCase(fileName, caseFiles=None):
+    """
+    Opens the case of a catalog entry: its file, or for a difference, the
+    difference of its two cases' files (see AMSDifference).
+    """
+    if caseFiles:
+        return AMSDifference.AMSDifferenceCase(*caseFiles)
+    return AMSStore.openCase(fileName)
 
-        # Properties modified on streamTracer.SeedType
-        streamTracer.SeedType.Resolution = 200
 
-        # update the view to ensure updated data information
-        self.dataObject.renderView.Update()
+class AMSDataLoad(object):
+    """
+    The part of opening a data object that doesn't touch any proxies, so
+    it can run on a worker thread: parsing the case, reading the geometry
+    and the initial arrays (or, for ParaView's reader, pulling their
+    files into the page cache).  AMSDataObject picks up the result.
+    AMSDataObjectCollection uses this to prefetch cases.
+    """
+    def __init__(self, dataCatalogEntry):
+        self.fileName = dataCatalogEntry["fileName"]
+        self.caseFiles = dataCatalogEntry.get("caseFiles")
+        self.reader = dataCatalogEntry.get("reader", "paraview")
+        if AMSStore.isStore(self.fileName) or self.caseFiles:
+            self.reader = "native"
+        self.pointArrays = sorted(dataCatalogEntry.get("pointArrays", []))
+        self.case = None
+        self.dataset = None
+        self.elapsed = None
+
+    def run(self):
+        start = time.time()
+        self.case = openCase(self.fileName, self.caseFiles)
+        geometry = self.case.getGeometry()
+        if self.reader == "native":
+            self.dataset = AMSHostCache.makeVTKDataSet(self.case, self.pointArrays)
+        else:
+            files = [geometry.fileName]
+            files += [self.case.resolveFileName(self.case.getVariableInfo(name)["fileName"])
+                      for name in self.pointArrays]
+            AMSEnSight.prefetchFiles(files)
+        self.elapsed = time.time() - start
+        return self
 
 
-    
 class AMSDataObject(object):
     """
     Contains a data file name and some descriptive material about it.
+
+    The catalog entry may say "reader": "native" to read the case with
+    our own EnSight reader (see AMSEnSight) instead of ParaView's.  The
+    native reader maps each variable file only when it is used, and hands
+    the scalars to VTK without copying them.  If the server runs with a
+    host cache (see AMSHostCache), the native reader's grids and arrays
+    live there, shared with the other server processes.
+
+    Either way, the reader starts out with only the point arrays listed
+    in the entry's "pointArrays" (none by default, and always kept), and
+    the plots ask for what they need with useArrays().  Arrays that
+    haven't been used by the last "arrayIdlePlots" plots are dropped
+    again.
+
+    The file may also be a case store (see AMSStore), which is always
+    read natively.  So is a difference of two cases (see AMSDifference;
+    the entry's "caseFiles" are A and B), which is drawn on A's mesh
+    and computed again when the files of either case change (see
+    refresh()).
+
+    If the case has a pyramid (see AMSPyramid), plots can be drawn from
+    one of its coarser levels instead; selectLevel() picks one.
+
+    If the reading was already done by an AMSDataLoad (see
+    AMSDataObjectCollection.prefetch()), pass it as 'load' and only the
+    proxies get made here.
     """
-    def __init__(self, dataCatalogEntry):
+    def __init__(self, dataCatalogEntry, load=None):
 
         self.debug = True
         
         self.dataFile = dataCatalogEntry["fileName"]
         self.description = dataCatalogEntry["description"]
+        self.reader = dataCatalogEntry.get("reader", "paraview")
+        self.caseFiles = dataCatalogEntry.get("caseFiles")
+        if AMSStore.isStore(self.dataFile) or self.caseFiles:
+            # ParaView has no reader for our stores or differences.
+            self.reader = "native"
+
+        # The case whose mesh we draw on, for the spatial index: a
+        # difference's is A's.
+        self.meshFile = self.caseFiles[0] if self.caseFiles else self.dataFile
+        self.ensightCase = load.case if load is not None else None
+
+        # The working set of point arrays: name -> the plot count when it
+        # was last used.  Arrays in 'pinnedArrays' are never dropped.
+        self.arrays = dict((name, 0) for name in dataCatalogEntry.get("pointArrays", []))
+        self.pinnedArrays = set(self.arrays.keys())
+        self.arrayIdlePlots = dataCatalogEntry.get("arrayIdlePlots", 5)
+        self.plotCount = 0
         
         self.renderView = simple.GetActiveViewOrCreate('RenderView')
 
-        # create a new 'EnSight Reader'
-        self.caseData = simple.EnSightReader(CaseFileName=self.dataFile)
+        if self.reader == "native":
+            case = self.getEnSightCase()
+            self.loadedArrays = set(self.arrays.keys())
+            if load is not None and load.dataset is not None:
+                self.dataset = load.dataset
+            else:
+                self.dataset = AMSHostCache.makeVTKDataSet(case, sorted(self.loadedArrays))
+            self.caseData = makeTrivialProducer(self.dataset)
+        else:
+            # create a new 'EnSight Reader'
+            self.caseData = simple.EnSightReader(CaseFileName=self.dataFile)
+            self.caseData.PointArrays = sorted(self.arrays.keys())
 
         # show data in view
         self.caseDataDisplay = simple.Show(self.caseData, self.renderView)
@@ -294,6 +1157,26 @@ class AMSDataObject(object):
         self.tankGeometryShown = False
         self.tankGeometryInit = False
 
+        # Where the transactions of toggleTankGeometry() are counted; the
+        # collection shares its own.
+        self.transactions = None
+
+        # Span-space indices for the span-space contour engine, by
+        # variable name.  They are built the first time they are used.
+        self.spanSpace = {}
+
+        # The pyramid of the case, if one was built, and readers for the
+        # levels we've used.
+        self.pyramid = AMSPyramid.loadPyramid(self.dataFile)
+        self.levelData = {}
+
+        # The spatial index of the mesh (see AMSSpatialIndex), and the
+        # NumPy streamline tracer over it, loaded or built the first time
+        # they are used.
+        self.spatialIndex = None
+        self.streamlineTracer = None
+        self.resampledImages = collections.OrderedDict()
+
     def getName(self):
         return self.dataFile
         
@@ -304,8 +1187,152 @@ class AMSDataObject(object):
             functionName = traceback.extract_stack(None, 2)[0][2]
             print("calling " + functionName + " for " + self.dataFile)
 
-    def getData(self):
-        return self.caseData
+    def getData(self, level=None):
+        """
+        Returns the source proxy for the case, or for one level of its
+        pyramid.
+        """
+        if level is None:
+            return self.caseData
+        if level not in self.levelData:
+            self.levelData[level] = simple.XMLImageDataReader(FileName=[self.pyramid.getLevelFile(level)])
+        return self.levelData[level]
+
+    def hasPyramid(self, arrays=()):
+        """
+        Whether the case has a pyramid whose levels carry the given arrays.
+        """
+        if self.pyramid is None or self.pyramid.getNumberOfLevels() == 0:
+            return False
+        return set(arrays) <= set(self.pyramid.getPointArrays())
+
+    def getPreviewData(self, arrays=()):
+        """
+        Returns the coarsest level of the pyramid, or None if there is no
+        pyramid with the given arrays.
+        """
+        if not self.hasPyramid(arrays):
+            return None
+        return self.getData(0)
+
+    def selectLevel(self, quality=None, timeBudget=None, arrays=()):
+        """
+        Returns the pyramid level to draw a plot that reads the given
+        arrays from, or None for the full resolution case.  See
+        AMSPyramid.selectLevel().
+        """
+        if not self.hasPyramid(arrays):
+            return None
+        return self.pyramid.selectLevel(quality, timeBudget)
+
+    def recordDrawTime(self, level, seconds):
+        if self.pyramid is not None:
+            self.pyramid.recordTime(level, seconds)
+
+    def getDataSet(self):
+        """
+        Returns the VTK data object the reader produces (one unstructured
+        grid per part).
+        """
+        self.caseData.UpdatePipeline()
+        return self.caseData.GetClientSideObject().GetOutputDataObject(0)
+
+    def getSpanSpaceIndex(self, variable):
+        """
+        Returns the span-space index of a point variable, building it if
+        this is the first time it's asked for.
+        """
+        if variable not in self.spanSpace:
+            case = self.getEnSightCase()
+            self.spanSpace[variable] = AMSSpanSpace.buildIndex(case, variable)
+            # The index doesn't need the values any more, but the native
+            # reader's pipeline might.
+            if not (self.reader == "native" and variable in self.loadedArrays):
+                case.release(variable)
+        return self.spanSpace[variable]
+
+    def getSpatialIndex(self):
+        """
+        Returns the spatial index of the case's mesh: the one saved next to
+        the case if it is up to date, else a new one (which is saved).
+        """
+        if self.spatialIndex is None:
+            self.spatialIndex = AMSSpatialIndex.getSpatialIndex(self.meshFile, self.getEnSightCase())
+        return self.spatialIndex
+
+    def hasSpatialIndex(self):
+        """
+        Whether the spatial index is at hand without building it.
+        """
+        if self.spatialIndex is None:
+            self.spatialIndex = AMSSpatialIndex.loadSpatialIndex(self.meshFile)
+        return self.spatialIndex is not None
+
+    def getResampledImage(self, resolution, arrays):
+        """
+        Returns the given point arrays resampled onto an image through the
+        spatial index.  The last few images are kept.
+        """
+        key = (resolution, tuple(sorted(arrays)))
+        if key not in self.resampledImages:
+            case = self.getEnSightCase()
+            self.resampledImages[key] = AMSSpatialIndex.resampleToImage(
+                self.getSpatialIndex(), dict((name, case.getPointArray(name)) for name in arrays), resolution)
+            while len(self.resampledImages) > 4:
+                self.resampledImages.popitem(last=False)
+        return self.resampledImages[key]
+
+    def getStreamlineTracer(self):
+        """
+        Returns the AMSStreamlines tracer over the spatial index and the
+        case's velocity, building it if this is the first time it's asked
+        for.
+        """
+        if self.streamlineTracer is None:
+            case = self.getEnSightCase()
+            self.streamlineTracer = AMSStreamlines.AMSStreamlineTracer(self.getSpatialIndex(),
+                                                                       case.getPointArray('velocity'))
+        return self.streamlineTracer
+
+    def getMemoryUsage(self):
+        """
+        Returns the bytes the data object holds, by what holds them.  The
+        spatial index is memory mapped, so its bytes are only resident
+        as far as they have been used.
+        """
+        output = lambda proxy: proxy.GetClientSideObject().GetOutputDataObject(0)
+        return {
+            "dataset": dataObjectBytes(output(self.caseData)),
+            "levels": sum(dataObjectBytes(output(reader)) for reader in self.levelData.values()),
+            "spanSpace": sum(arrayBytes(index) for index in self.spanSpace.values()),
+            "spatialIndex": sum(array.nbytes for array in self.spatialIndex.getArrays().values())
+                            if self.spatialIndex is not None else 0,
+            "resampledImages": sum(dataObjectBytes(image) for image in self.resampledImages.values()),
+            "differences": self.ensightCase.getBytes() if self.caseFiles and self.ensightCase else 0,
+        }
+
+    def refresh(self):
+        """
+        Called before each plot.  If this is a difference and the files of
+        either case changed since it was computed, starts over: the
+        dataset is rebuilt with the arrays in use, and what was derived
+        from the old values is dropped.  Returns whether it did.
+        """
+        if not self.caseFiles:
+            return False
+        case = self.getEnSightCase()
+        if not case.isStale():
+            return False
+        print("the cases of " + self.dataFile + " changed; computing it again")
+        case.reopen()
+        self.dataset = AMSHostCache.makeVTKDataSet(case, sorted(self.loadedArrays))
+        self.caseData.GetClientSideObject().SetOutput(self.dataset)
+        self.caseData.MarkModified(self.caseData)
+        self.spanSpace = {}
+        self.spatialIndex = None
+        self.streamlineTracer = None
+        self.resampledImages.clear()
+        return True
 
     def getDataDisplay(self):
         return self.caseDataDisplay
@@ -318,7 +1345,73 @@ class AMSDataObject(object):
     
     def getVariables(self):
         return self.variables
-    
+
+    def getEnSightCase(self):
+        """
+        Returns the native view of the case (or store).  Parsing the .case
+        file is cheap and nothing else is read until it is asked for, so
+        we can use this for metadata whichever reader feeds the pipeline.
+        """
+        if self.ensightCase is None:
+            self.ensightCase = openCase(self.dataFile, self.caseFiles)
+        return self.ensightCase
+
+    def getNodeVariableNames(self):
+        case = self.getEnSightCase()
+        return [name for name in case.getVariableNames()
+                if case.getVariableInfo(name)["location"] == "node"]
+
+    def getArrays(self):
+        """
+        Returns the names of the point arrays the reader currently loads.
+        """
+        return sorted(self.arrays.keys())
+
+    def useArrays(self, names, pin=False):
+        """
+        Called once per plot with the arrays the plot needs.  Adds the
+        missing ones to the reader and drops the ones that no plot has
+        asked for in the last 'arrayIdlePlots' plots.
+        """
+        self.plotCount += 1
+        for name in names:
+            self.arrays[name] = self.plotCount
+            if pin:
+                self.pinnedArrays.add(name)
+
+        for name in list(self.arrays.keys()):
+            if name in self.pinnedArrays:
+                continue
+            if self.plotCount - self.arrays[name] >= self.arrayIdlePlots:
+                del self.arrays[name]
+
+        self.updateArraySelection()
+
+    def updateArraySelection(self):
+        """
+        Makes the reader load exactly the arrays in the working set.
+        """
+        if self.reader == "native":
+            wanted = set(self.arrays.keys())
+            if self.loadedArrays == wanted:
+                return
+            case = self.getEnSightCase()
+            for name in self.loadedArrays - wanted:
+                AMSEnSight.removeVTKArray(self.dataset, name)
+                case.release(name)
+            with AMSMetrics.timeStage("reader update", reader="native"):
+                for name in wanted - self.loadedArrays:
+                    AMSHostCache.addVTKArray(self.dataset, case, name)
+            self.loadedArrays = wanted
+            self.caseData.MarkModified(self.caseData)
+        else:
+            arrays = self.getArrays()
+            if list(self.caseData.PointArrays) != arrays:
+                self.caseData.PointArrays = arrays
+                # The filters would pull this anyway; here it's timed.
+                with AMSMetrics.timeStage("reader update", reader="paraview"):
+                    self.caseData.UpdatePipeline()
+        
     def setIsoSurfaces(self, isoSurfaces):
         self.isoSurfaces = isoSurfaces
 
@@ -326,70 +1419,48 @@ class AMSDataObject(object):
     def toggleTankGeometry(self):
         self.printDebug()
 
+        transaction = AMSTransaction(self.renderView, self.transactions)
         if not self.tankGeometryInit:
 
+            # The tank outline is a contour of the wall shear, and stays
+            # around once it has been made.
+            self.useArrays(['wall_shear'], pin=True)
+
             # create a new 'Contour'
             self.contour2 = simple.Contour(Input=self.caseData)
-            self.contour2.PointMergeMethod = 'Uniform Binning'
-
-            # Properties modified on self.contour2
-            self.contour2.ContourBy = ['POINTS', 'wall_shear']
-            self.contour2.Isosurfaces = [0.0002]
-
-            # show data in view
-            self.contour2Display = simple.Show(self.contour2, self.renderView)
-
-            # trace defaults for the display properties.
-            self.contour2Display.Representation = 'Surface'
-            self.contour2Display.ColorArrayName = [None, '']
-            self.contour2Display.OSPRayScaleFunction = 'PiecewiseFunction'
-            self.contour2Display.SelectOrientationVectors = 'None'
-            self.contour2Display.ScaleFactor = -2.0000000000000002e+298
-            self.contour2Display.SelectScaleArray = 'None'
-            self.contour2Display.GlyphType = 'Arrow'
-            self.contour2Display.GlyphTableIndexArray = 'None'
-            self.contour2Display.GaussianRadius = -1.0000000000000001e+298
-            self.contour2Display.SetScaleArray = [None, '']
-            self.contour2Display.ScaleTransferFunction = 'PiecewiseFunction'
-            self.contour2Display.OpacityArray = [None, '']
-            self.contour2Display.OpacityTransferFunction = 'PiecewiseFunction'
-            self.contour2Display.DataAxesGrid = 'GridAxesRepresentation'
-            self.contour2Display.SelectionCellLabelFontFile = ''
-            self.contour2Display.SelectionPointLabelFontFile = ''
-            self.contour2Display.PolarAxes = 'PolarAxesRepresentation'
-
-            # init the 'GridAxesRepresentation' selected for 'DataAxesGrid'
-            self.contour2Display.DataAxesGrid.XTitleFontFile = ''
-            self.contour2Display.DataAxesGrid.YTitleFontFile = ''
-            self.contour2Display.DataAxesGrid.ZTitleFontFile = ''
-            self.contour2Display.DataAxesGrid.XLabelFontFile = ''
-            self.contour2Display.DataAxesGrid.YLabelFontFile = ''
-            self.contour2Display.DataAxesGrid.ZLabelFontFile = ''
-
-            # init the 'PolarAxesRepresentation' selected for 'PolarAxes'
-            self.contour2Display.PolarAxes.PolarAxisTitleFontFile = ''
-            self.contour2Display.PolarAxes.PolarAxisLabelFontFile = ''
-            self.contour2Display.PolarAxes.LastRadialAxisTextFontFile = ''
-            self.contour2Display.PolarAxes.SecondaryRadialAxesTextFontFile = ''
-
-            # Properties modified on contour2Display
-            self.contour2Display.Opacity = 0.1
-
-            # change solid color
-            self.contour2Display.DiffuseColor = [0.0, 0.5, 0.5]
+            transaction.setProperties(self.contour2,
+                                      PointMergeMethod='Uniform Binning',
+                                      ContourBy=['POINTS', 'wall_shear'],
+                                      Isosurfaces=[0.0002])
+            transaction.show(self.contour2, lambda display: self.showTankGeometry(transaction, display))
 
             self.tankGeometryInit = True
             self.tankGeometryShown = True
 
         else:
             if self.tankGeometryShown:
-                self.contour2Display = simple.Hide(self.contour2, self.renderView)
+                transaction.hide(self.contour2)
                 self.tankGeometryShown = False
             else:
-                self.contour2Display = simple.Show(self.contour2, self.renderView)
+                transaction.show(self.contour2)
                 self.tankGeometryShown = True
 
-        self.renderView.Update()
+        transaction.update()
+        transaction.commit()
+
+    def showTankGeometry(self, transaction, display):
+        """
+        Sets up the display of the tank outline when it's first shown.
+        The trace this came from also set some thirty other properties,
+        font files and glyph settings, to their defaults; only what
+        differs from the defaults is set here.
+        """
+        self.contour2Display = display
+        transaction.setProperties(display,
+                                  Representation='Surface',
+                                  ColorArrayName=[None, ''],
+                                  Opacity=0.1,
+                                  DiffuseColor=[0.0, 0.5, 0.5])
 
     def hide(self):
         return
@@ -409,33 +1480,220 @@ class AMSDataObject(object):
 
 
         
+class AMSDataPlaceholder(object):
+    """
+    Stands in for a data object that hasn't been opened yet.  It knows
+    only what the catalog entry says.
+    """
+    def __init__(self, dataCatalogEntry):
+        self.dataCatalogEntry = dataCatalogEntry
+        self.dataFile = dataCatalogEntry["fileName"]
+        self.description = dataCatalogEntry["description"]
+
+    def getName(self):
+        return self.dataFile
+
+    def getDataFile(self):
+        return self.dataFile
+
+    def getDescription(self):
+        return self.description
+
+    def getVariables(self):
+        return {}
+
+
 class AMSDataObjectCollection(object):
     """
     A whole slew of data objects, organized by name.
+
+    Entries start out as placeholders (see addEntry()), and are opened
+    the first time somebody asks for the data object.  An entry may also
+    be the difference of two others (see addDifference()).  Meanwhile the
+    collection can read the case that is likely to be asked for next on
+    a worker thread ('workers' of them; 0 turns prefetching off), so
+    opening it only has to make the proxies.
     """
-    def __init__(self):
-        self.index = dict()
+    def __init__(self, maxPipelines=4, maxSurfaceBytes=256 * 1024 * 1024,
+                 workers=1, onMaterialize=None):
+        self.index = collections.OrderedDict()
         self.shown = None
 
+        # name -> AsyncResult of an AMSDataLoad, for the prefetched cases
+        # that haven't been opened yet.
+        self.loads = {}
+        self.workers = workers
+        self.pool = None
+
+        # Called with (name, data object) when a placeholder is opened.
+        self.onMaterialize = onMaterialize
+
+        # Filter chains that plotData() hands to the plots, so a new
+        # recipe for a dataset and plot type reuses the old filters.
+        self.pipelines = AMSPipelineCache(maxPipelines)
+
+        # Contour results, so going back to an isovalue is free.
+        self.surfaces = AMSSurfaceCache(maxSurfaceBytes)
+
+        # What the plots' (and data objects') transactions saved.
+        self.transactions = AMSTransactionStats()
+
     def __getitem__(self, i):
         if isinstance(i, (int, long)):
             if len(self.index) > i:
-                return self.index[self.index.keys()[i]]
+                return self.materialize(list(self.index.keys())[i])
             else:
                 return None
         else:
-            return self.index[i]
+            return self.materialize(i)
 
         
+    def __iter__(self):
+        """
+        Iterates over the data objects that have been opened.
+        """
+        return iter([obj for obj in self.index.values() if isinstance(obj, AMSDataObject)])
+
     def addObject(self, name, dataObject):
         self.index[name] = dataObject
 
+    def addEntry(self, name, dataCatalogEntry):
+        """
+        Adds a catalog entry without opening it.  An entry with a
+        "difference" instead of a "fileName" is a difference; see
+        addDifference().
+        """
+        if "difference" in dataCatalogEntry:
+            nameA, nameB = dataCatalogEntry["difference"]
+            dataCatalogEntry = dict(dataCatalogEntry, fileName=AMSDifference.getDifferenceName(nameA, nameB))
+            dataCatalogEntry.setdefault("description", dataCatalogEntry["fileName"])
+        self.index[name] = AMSDataPlaceholder(dataCatalogEntry)
+
+    def addDifference(self, name, nameA, nameB, description=None):
+        """
+        Adds an entry for the difference of two others, A minus B, for
+        every per-node variable they have in common (see AMSDifference).
+        It is plotted like any other entry.  A and B are looked up when
+        it is opened, so they may be added after it.
+        """
+        entry = {"difference": [nameA, nameB]}
+        if description is not None:
+            entry["description"] = description
+        self.addEntry(name, entry)
+
+    def isDifference(self, name):
+        entry = self.index[name]
+        if isinstance(entry, AMSDataPlaceholder):
+            return "difference" in entry.dataCatalogEntry
+        return bool(getattr(entry, "caseFiles", None))
+
+    def getCaseEntry(self, name):
+        """
+        Returns the catalog entry to open a placeholder with; for a
+        difference, with the files of its two cases as "caseFiles".
+        """
+        entry = self.index[name].dataCatalogEntry
+        if "difference" not in entry:
+            return entry
+        caseFiles = []
+        for caseName in entry["difference"]:
+            if caseName not in self.index:
+                raise KeyError("%s: no entry named %s" % (name, caseName))
+            if self.isDifference(caseName):
+                raise ValueError("%s: %s is a difference itself" % (name, caseName))
+            caseFiles.append(self.index[caseName].getDataFile())
+        return dict(entry, caseFiles=caseFiles)
+
+    def getCaseFiles(self, name):
+        """
+        Returns the files of a difference's two cases, or None if the entry
+        isn't a difference.
+        """
+        if not self.isDifference(name):
+            return None
+        if isinstance(self.index[name], AMSDataPlaceholder):
+            return self.getCaseEntry(name)["caseFiles"]
+        return self.index[name].caseFiles
+
     def getObject(self, name):
+        return self.materialize(name)
+
+    def getEntry(self, name):
+        """
+        Returns the data object if it is open, else its placeholder.
+        Either one answers getDataFile(), getDescription() and
+        getVariables().
+        """
         return self.index[name]
 
+    def isMaterialized(self, name):
+        return not isinstance(self.index[name], AMSDataPlaceholder)
+
+    def materialize(self, name):
+        """
+        Returns the data object, opening it first if all we have is its
+        placeholder.  A prefetched read is used if there is one (and
+        waited for, if it is still going on).
+        """
+        placeholder = self.index[name]
+        if not isinstance(placeholder, AMSDataPlaceholder):
+            return placeholder
+
+        start = time.time()
+        load = None
+        if name in self.loads:
+            try:
+                load = self.loads.pop(name).get()
+            except Exception:
+                # Read it again here, so the error is reported where
+                # somebody is waiting for the data.
+                traceback.print_exc()
+        with AMSMetrics.timeStage("open", prefetched=load is not None):
+            dataObject = AMSDataObject(self.getCaseEntry(name), load)
+        dataObject.transactions = self.transactions
+        self.index[name] = dataObject
+        print("opened %s in %.2f s%s" % (name, time.time() - start,
+                                          " (prefetched)" if load is not None else ""))
+
+        if self.onMaterialize is not None:
+            self.onMaterialize(name, dataObject)
+        self.prefetch(self.getNextLikely(name))
+        return dataObject
+
+    def getNextLikely(self, name=None):
+        """
+        Guesses which entry will be opened next: the first one still
+        unopened after 'name' in catalog order (wrapping around).
+        """
+        names = list(self.index.keys())
+        if not names:
+            return None
+        start = names.index(name) + 1 if name in names else 0
+        for candidate in names[start:] + names[:start]:
+            if not self.isMaterialized(candidate):
+                return candidate
+        return None
+
+    def prefetch(self, name):
+        """
+        Starts reading an entry's case on a worker thread, unless it is
+        open, being read already, or prefetching is off.
+        """
+        if name is None or self.workers <= 0 or self.isMaterialized(name) or name in self.loads:
+            return
+        try:
+            entry = self.getCaseEntry(name)
+        except (KeyError, ValueError):
+            # A difference of entries we don't have: that is reported
+            # when it is opened.
+            return
+        if self.pool is None:
+            self.pool = multiprocessing.pool.ThreadPool(self.workers)
+        self.loads[name] = self.pool.apply_async(AMSDataLoad(entry).run)
+
     def getFirst(self):
         if len(self.index) > 0:
-            return self.index[self.index.keys()[0]]
+            return self[0]
         else:
             return None
 
@@ -446,7 +1704,18 @@ class AMSDataObjectCollection(object):
         """
         Returns the data object currently being shown in the view.
         """
-        return self.shown
+        if self.shown is None:
+            return None
+        return self.materialize(self.shown)
+
+    def refreshData(self, dataObject):
+        """
+        Brings a data object up to date before it is plotted (see
+        AMSDataObject.refresh()).
+        """
+        if dataObject.refresh():
+            # The contours of the old values are no good any more.
+            self.surfaces.discardData(dataObject.getDataFile())
 
     def plotData(self, name, recipeName, cookBook):
         """
@@ -454,7 +1723,11 @@ class AMSDataObjectCollection(object):
         recipe.  Note that you have to execute the 'draw()' method of the plot
         object to see anything.
         """
-        return AMSPlot(self.index[name], cookBook.getRecipe(recipeName))
+        self.shown = name
+        dataObject = self.materialize(name)
+        self.refreshData(dataObject)
+        return AMSPlot(dataObject, cookBook.getRecipe(recipeName),
+                       self.pipelines, name, self.surfaces, self.transactions)
 
         
 class AMSPlotRecipe(object):
@@ -470,10 +1743,13 @@ class AMSPlotRecipe(object):
     def getName(self):
         return self.plotRecipe['CellPlotName']
         
-    def get(self, item):
+    def get(self, item, *default):
         """
-        Return one of the items in a plot recipe.
+        Return one of the items in a plot recipe, or the default if one is
+        given and the recipe doesn't have the item.
         """
+        if default:
+            return self.plotRecipe.get(item, default[0])
         return self.plotRecipe[item]
 
     def printRecipe(self):
@@ -0,0 +1,359 @@
+r"""
+Offscreen batch rendering: a list of (dataset, recipe, camera) jobs
+rendered to image files, without a client.
+
+    $ pvpython AMSBatch.py --dataConfigFile files.json --jobs batch.json \
+          --output images/ [--workers 2] [--size 1280x800]
+
+The jobs file either lists the jobs or asks for a matrix of every data
+set with every recipe (and every camera):
+
+    {
+      "recipes": {"contour400": {"EnumPlotType": "contour", ...},
+                  "streams": {"EnumPlotType": "streamlines", ...}},
+      "data": ["m100rpm", "m250rpm"],
+      "cameras": {"standard": "standard",
+                  "top": {"position": [0, 0, 3], "focalPoint": [0, 0, 0], "viewUp": [0, 1, 0]}}
+    }
+
+    {
+      "recipes": {...},
+      "jobs": [{"data": "m100rpm", "recipe": "contour400", "camera": "reset",
+                "file": "m100rpm-contour.png"}, ...]
+    }
+
+A camera is "standard" (the view the server starts with), "reset" (fit
+the plot) or a dict of position, focalPoint, viewUp and optionally
+viewAngle.  Images are named <data>-<recipe>-<camera>.png unless the
+job says otherwise.
+
+The jobs are sorted so that each worker opens a data set once and
+draws its plots one after the other, reusing the reader and the filter
+pipelines of the plot types as the server does between requests.
+Different data sets are independent, so they are spread over a pool
+of worker processes.  Each worker writes a line of timings per job as
+it goes; the summary has them all, and the throughput in images per
+minute.
+
+The server runs the same thing from the amsprotocol.batch.render RPC
+(see AMSProtocols), in worker processes so that its own view is left
+alone.
+"""
+
+import os, sys, json, time, shutil, tempfile, subprocess
+
+DEFAULT_SIZE = (1280, 800)
+
+# =============================================================================
+#
+# Jobs
+#
+# =============================================================================
+
+def expandJobs(spec):
+    """
+    Returns the list of jobs of a batch spec, each a dict with data,
+    recipe, camera, cameraName and file.
+    """
+    cameras = spec.get("cameras", {"standard": "standard"})
+    if "jobs" in spec:
+        jobs = [dict(job) for job in spec["jobs"]]
+    else:
+        jobs = [{"data": data, "recipe": recipe, "camera": cameraName}
+                for data in spec["data"]
+                for recipe in sorted(spec["recipes"].keys())
+                for cameraName in sorted(cameras.keys())]
+
+    for job in jobs:
+        camera = job.get("camera", "standard")
+        if isinstance(camera, dict):
+            job["cameraName"] = job.get("cameraName", "camera")
+        else:
+            job["cameraName"] = camera
+            job["camera"] = cameras.get(camera, camera)
+        if job["recipe"] not in spec["recipes"]:
+            raise ValueError("No recipe named " + job["recipe"])
+        job.setdefault("file", "%s-%s-%s.png" % (job["data"], job["recipe"], job["cameraName"]))
+    return jobs
+
+
+def resolvePath(root, path):
+    """
+    Returns where 'path' is under the directory 'root'.  Raises a
+    ValueError if it is absolute or leads out of 'root'.
+    """
+    if os.path.isabs(path):
+        raise ValueError("%s is not a relative path" % path)
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved != root and not resolved.startswith(os.path.join(root, "")):
+        raise ValueError("%s is outside %s" % (path, root))
+    return resolved
+
+
+def partitionJobs(jobs, recipes, workers):
+    """
+    Splits the jobs over at most 'workers' workers.  Jobs on the same data
+    set stay together where that keeps the workers about equally busy,
+    and within a worker the jobs on a data set are sorted by plot type so
+    the filters carry over from one to the next.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["data"], []).append(job)
+
+    # Break up data sets that are more than a worker's share.
+    share = max(1, -(-len(jobs) // max(1, workers)))
+    pieces = []
+    for data in sorted(groups.keys()):
+        group = sorted(groups[data], key=lambda job: (recipes[job["recipe"]].get("EnumPlotType"), job["recipe"]))
+        pieces.extend(group[i:i + share] for i in range(0, len(group), share))
+
+    # Biggest pieces first, each to the least loaded worker.
+    partitions = [[] for i in range(min(workers, len(pieces)))]
+    for piece in sorted(pieces, key=len, reverse=True):
+        min(partitions, key=len).extend(piece)
+    return [partition for partition in partitions if partition]
+
+
+def summarize(results, elapsed):
+    """
+    Returns the summary of a batch: per-job results, totals and images per
+    minute.
+    """
+    rendered = [result for result in results if result.get("error") is None]
+    return {
+        "jobs": results,
+        "images": len(rendered),
+        "failed": len(results) - len(rendered),
+        "elapsed": elapsed,
+        "imagesPerMinute": 60.0 * len(rendered) / elapsed if elapsed > 0 else 0.0,
+        "busy": sum(result.get("total", 0.0) for result in results),
+    }
+
+
+# =============================================================================
+#
+# Rendering, in a worker
+#
+# =============================================================================
+
+class AMSBatchRenderer(object):
+    """
+    Draws batch jobs in this process's render view and saves them.  Keeps
+    the data objects and the plot pipelines between jobs.
+    """
+    def __init__(self, dataCatalog, recipes, size=DEFAULT_SIZE):
+        # ParaView is only needed where the rendering happens.
+        global simple, AMS2Protocols
+        from paraview import simple
+        import AMS2Protocols
+
+        self.recipes = recipes
+        self.size = list(size)
+
+        # A pipeline per data set and plot type, so that consecutive jobs
+        # only change filter properties.
+        plotTypes = set(recipe.get("EnumPlotType") for recipe in recipes.values())
+        self.dataObjects = AMS2Protocols.AMSDataObjectCollection(
+            maxPipelines=max(4, len(dataCatalog) * len(plotTypes)), workers=0)
+        for name in dataCatalog.keys():
+            self.dataObjects.addEntry(name, dataCatalog[name])
+
+        self.cookBook = AMS2Protocols.AMSCookBook()
+        for name, recipe in recipes.items():
+            self.cookBook.addRecipe(name, recipe)
+
+        self.view = simple.GetActiveViewOrCreate('RenderView')
+        self.view.ViewSize = self.size
+        self.view.OrientationAxesVisibility = 0
+
+    def setCamera(self, dataObject, camera):
+        if camera == "standard":
+            dataObject.takeStandardView()
+        elif camera == "reset":
+            self.view.ResetCamera()
+        else:
+            self.view.CameraPosition = camera["position"]
+            self.view.CameraFocalPoint = camera["focalPoint"]
+            self.view.CameraViewUp = camera.get("viewUp", [0, 0, 1])
+            if "viewAngle" in camera:
+                self.view.CameraViewAngle = camera["viewAngle"]
+
+    def render(self, job, outputDir):
+        """
+        Draws one job and writes its image.  Returns the job's timings:
+        load (opening the data set, if this job did), plot, save and total.
+        """
+        result = {"data": job["data"], "recipe": job["recipe"], "camera": job["cameraName"],
+                  "file": os.path.join(outputDir, job["file"]), "error": None}
+        start = time.time()
+        try:
+            wasOpen = self.dataObjects.isMaterialized(job["data"])
+            dataObject = self.dataObjects.materialize(job["data"])
+            loaded = time.time()
+
+            # Only this job's plot is to be seen.
+            for representation in self.view.Representations:
+                representation.Visibility = 0
+            plot = self.dataObjects.plotData(job["data"], job["recipe"], self.cookBook)
+            plot.draw()
+            plotted = time.time()
+
+            self.setCamera(dataObject, job["camera"])
+            simple.SaveScreenshot(result["file"], self.view, ImageResolution=self.size)
+            saved = time.time()
+
+            result.update({
+                "load": 0.0 if wasOpen else loaded - start,
+                "plot": plotted - loaded,
+                "save": saved - plotted,
+            })
+        except Exception as e:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+        result["total"] = time.time() - start
+        return result
+
+
+def runWorker(jobsFile, resultsFile):
+    """
+    Renders the jobs of one worker, appending a JSON line of results per
+    job to 'resultsFile' as it goes.
+    """
+    with open(jobsFile) as fp:
+        work = json.load(fp)
+    renderer = AMSBatchRenderer(work["dataCatalog"], work["recipes"], work["size"])
+    with open(resultsFile, "a") as fp:
+        for job in work["jobs"]:
+            result = renderer.render(job, work["output"])
+            fp.write(json.dumps(result) + "\n")
+            fp.flush()
+
+
+# =============================================================================
+#
+# The pool
+#
+# =============================================================================
+
+class AMSBatchRun(object):
+    """
+    A batch spread over worker processes.  Doesn't block: poll() tells
+    how far along it is, and wait() waits for the end.
+    """
+    def __init__(self, spec, dataCatalog, outputDir, workers=1, size=DEFAULT_SIZE, python=None):
+        self.jobs = expandJobs(spec)
+        self.outputDir = os.path.abspath(outputDir)
+        # The images stay in the output directory.
+        for job in self.jobs:
+            resolvePath(self.outputDir, job["file"])
+        if not os.path.isdir(self.outputDir):
+            os.makedirs(self.outputDir)
+        self.workDir = tempfile.mkdtemp(prefix="amsbatch")
+        self.started = time.time()
+        self.finished = None
+        # The final status, once the batch is done and its work
+        # directory is gone.
+        self.status = None
+
+        self.processes = []
+        self.resultFiles = []
+        for i, partition in enumerate(partitionJobs(self.jobs, spec["recipes"], max(1, workers))):
+            jobsFile = os.path.join(self.workDir, "jobs-%d.json" % i)
+            resultsFile = os.path.join(self.workDir, "results-%d.jsonl" % i)
+            with open(jobsFile, "w") as fp:
+                json.dump({"dataCatalog": dataCatalog, "recipes": spec["recipes"], "jobs": partition,
+                           "output": self.outputDir, "size": list(size)}, fp)
+            self.processes.append(subprocess.Popen([python or sys.executable, os.path.abspath(__file__),
+                                                    "--worker", jobsFile, resultsFile]))
+            self.resultFiles.append(resultsFile)
+
+    def getResults(self):
+        results = []
+        for fileName in self.resultFiles:
+            if os.path.exists(fileName):
+                with open(fileName) as fp:
+                    results.extend(json.loads(line) for line in fp if line.strip())
+        return results
+
+    def isDone(self):
+        return all(process.poll() is not None for process in self.processes)
+
+    def poll(self):
+        """
+        Returns the state of the batch, with the summary once it is done.
+        """
+        if self.status is not None:
+            return self.status
+        done = self.isDone()
+        if done and self.finished is None:
+            self.finished = time.time()
+        results = self.getResults()
+        status = {
+            "state": "done" if done else "running",
+            "total": len(self.jobs),
+            "completed": len(results),
+            "workers": len(self.processes),
+            "elapsed": (self.finished or time.time()) - self.started,
+        }
+        if done:
+            # A worker that died leaves its remaining jobs without results.
+            status["crashedWorkers"] = sum(1 for process in self.processes if process.returncode != 0)
+            status.update(summarize(results, status["elapsed"]))
+            # The workers have written all their results, which are in
+            # the status now.
+            self.status = status
+            shutil.rmtree(self.workDir, ignore_errors=True)
+        return status
+
+    def wait(self):
+        for process in self.processes:
+            process.wait()
+        return self.poll()
+
+
+def printSummary(status):
+    rows = [[result["data"], result["recipe"], result["camera"]] +
+            (["%.2f" % result.get(key, 0.0) for key in ("load", "plot", "save", "total")]
+             if result["error"] is None else ["-", "-", "-", result["error"]])
+            for result in status["jobs"]]
+    header = ["data", "recipe", "camera", "load (s)", "plot (s)", "save (s)", "total (s)"]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+    print("%d images in %.1f s with %d workers: %.1f images per minute%s" % (
+        status["images"], status["elapsed"], status["workers"], status["imagesPerMinute"],
+        "" if not status["failed"] else " (%d failed)" % status["failed"]))
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        runWorker(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render (data set, recipe, camera) jobs to image files")
+    parser.add_argument("--dataConfigFile", required=True, help="Path to a data config file")
+    parser.add_argument("--jobs", required=True, help="Batch file: recipes and jobs, or data and cameras")
+    parser.add_argument("--output", default="images", help="Directory for the images")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--size", default="%dx%d" % DEFAULT_SIZE, help="Image size, WIDTHxHEIGHT")
+    parser.add_argument("--summary", default=None, help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    with open(args.dataConfigFile) as fp:
+        dataCatalog = json.load(fp)["dataCatalog"]
+    with open(args.jobs) as fp:
+        spec = json.load(fp)
+
+    size = [int(n) for n in args.size.lower().split("x")]
+    status = AMSBatchRun(spec, dataCatalog, args.output, args.workers, size).wait()
+    printSummary(status)
+    if args.summary:
+        with open(args.summary, "w") as fp:
+            json.dump(status, fp, indent=1)
@@ -0,0 +1,201 @@
+r"""
+A persistent index of per-case metadata: variable ranges and component
+counts, point and cell counts, and the list of parts.
+
+Computing the ranges means reading every variable file of a case, so we
+do it once and keep the result in a sidecar file next to the case
+(<case file>.catalog.json).  The sidecar records the size and mtime of
+every file the case reads, and is rebuilt when any of them change.
+Rebuilds run on a background thread; until a rebuild is done, lookups
+return the stale entry rather than waiting for it.
+
+    >>> index = AMSCatalogIndex()
+    >>> index.warm(["/path/to/case.case"])     # at startup
+    >>> index.get("/path/to/case.case")["variables"]["pressure"]
+    {'range': [-152.6, 144.7], 'components': 1}
+"""
+
+import os, json, time, threading, traceback
+
+import AMSStore
+
+# Bump this when the layout of the sidecar changes.
+INDEX_VERSION = 1
+
+SIDECAR_SUFFIX = ".catalog.json"
+
+# =============================================================================
+
+def fileSignature(fileNames):
+    """
+    Returns {file name: [size, mtime]} for the given files.  Missing files
+    get None, so that their appearance also counts as a change.
+    """
+    signature = {}
+    for fileName in fileNames:
+        try:
+            st = os.stat(fileName)
+            signature[fileName] = [st.st_size, st.st_mtime]
+        except OSError:
+            signature[fileName] = None
+    return signature
+
+
+def computeMetadata(caseFile):
+    """
+    Reads a case (or case store) with the native reader and returns its
+    metadata entry.  Variables are mapped one at a time and let go again.
+    """
+    case = AMSStore.openCase(caseFile)
+    try:
+        geometry = case.getGeometry()
+        entry = {
+            "version": INDEX_VERSION,
+            "signature": fileSignature(case.getFiles()),
+            "numberOfPoints": geometry.getNumberOfPoints(),
+            "numberOfCells": geometry.getNumberOfCells(),
+            "parts": [{"id": part.partId,
+                       "description": part.description,
+                       "numberOfNodes": part.numberOfNodes,
+                       "numberOfElements": part.getNumberOfElements()}
+                      for part in geometry.parts],
+            "timeValues": case.getTimeValues(),
+            "variables": {},
+        }
+
+        for name in case.getVariableNames():
+            info = case.getVariableInfo(name)
+            low, high = case.getRange(name, -1)
+            entry["variables"][name] = {
+                "range": [low, high] if low <= high else None,
+                "components": info["components"],
+                "location": info["location"],
+            }
+            if info["components"] > 1:
+                entry["variables"][name]["componentRanges"] = [
+                    list(case.getRange(name, i)) for i in range(info["components"])]
+            case.release(name)
+        return entry
+    finally:
+        case.close()
+
+
+class AMSCatalogIndex(object):
+    """
+    The metadata for a set of cases, backed by one sidecar file per case.
+    """
+    def __init__(self, checkInterval=5.0):
+        self.entries = {}           # case file -> metadata entry
+        self.lastChecked = {}       # case file -> time of the last staleness check
+        self.rebuilds = {}          # case file -> running rebuild thread
+        self.lock = threading.Lock()
+
+        # How often (seconds) get() looks at the files to see whether an
+        # entry went stale.  In between, a lookup is just a lookup.
+        self.checkInterval = checkInterval
+
+    @staticmethod
+    def getSidecarFile(caseFile):
+        return caseFile + SIDECAR_SUFFIX
+
+    def isFresh(self, entry):
+        if entry is None or entry.get("version") != INDEX_VERSION:
+            return False
+        return fileSignature(entry["signature"].keys()) == entry["signature"]
+
+    def loadSidecar(self, caseFile):
+        """
+        Returns the metadata stored next to the case, fresh or not, or
+        None if there is no readable sidecar.
+        """
+        try:
+            with open(self.getSidecarFile(caseFile)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def saveSidecar(self, caseFile, entry):
+        """
+        Writes the sidecar atomically, so a reader never sees half a file.
+        A read-only data directory just means we keep it in memory.
+        """
+        sidecarFile = self.getSidecarFile(caseFile)
+        temporaryFile = sidecarFile + ".%d.tmp" % os.getpid()
+        try:
+            with open(temporaryFile, "w") as fp:
+                json.dump(entry, fp)
+            os.rename(temporaryFile, sidecarFile)
+        except (IOError, OSError) as e:
+            print("could not write catalog sidecar " + sidecarFile + ": " + str(e))
+
+    def warm(self, caseFiles):
+        """
+        Loads the sidecars of the given cases and starts background
+        rebuilds for the ones that are missing or stale.
+        """
+        for caseFile in caseFiles:
+            entry = self.loadSidecar(caseFile)
+            with self.lock:
+                if entry is not None:
+                    self.entries[caseFile] = entry
+                self.lastChecked[caseFile] = time.time()
+            if not self.isFresh(entry):
+                self.rebuild(caseFile)
+
+    def rebuild(self, caseFile):
+        """
+        Recomputes a case's metadata on a background thread, unless that
+        is already happening.  Returns the thread.
+        """
+        with self.lock:
+            thread = self.rebuilds.get(caseFile)
+            if thread is not None and thread.is_alive():
+                return thread
+            thread = threading.Thread(target=self.rebuildNow, args=(caseFile,),
+                                      name="catalog " + os.path.basename(caseFile))
+            thread.daemon = True
+            self.rebuilds[caseFile] = thread
+        thread.start()
+        return thread
+
+    def rebuildNow(self, caseFile):
+        try:
+            entry = computeMetadata(caseFile)
+        except Exception:
+            print("could not index " + caseFile)
+            traceback.print_exc()
+            return
+        self.saveSidecar(caseFile, entry)
+        with self.lock:
+            self.entries[caseFile] = entry
+            self.lastChecked[caseFile] = time.time()
+
+    def get(self, caseFile, wait=True):
+        """
+        Returns the metadata of a case.  A stale entry is returned as it is
+        while a rebuild runs in the background; only a case we have never
+        seen makes the caller wait (unless wait is False, in which case
+        the answer is None).
+        """
+        with self.lock:
+            entry = self.entries.get(caseFile)
+            due = time.time() - self.lastChecked.get(caseFile, 0) > self.checkInterval
+            if due:
+                self.lastChecked[caseFile] = time.time()
+
+        if entry is None:
+            thread = self.rebuild(caseFile)
+            if not wait:
+                return None
+            thread.join()
+            with self.lock:
+                return self.entries.get(caseFile)
+
+        if due and not self.isFresh(entry):
+            self.rebuild(caseFile)
+        return entry
+
+    def isRebuilding(self, caseFile):
+        with self.lock:
+            thread = self.rebuilds.get(caseFile)
+            return thread is not None and thread.is_alive()
@@ -0,0 +1,347 @@
+r"""
+The difference of two cases, field by field: how the 250 rpm run
+differs from the 100 rpm one.
+
+AMSDifferenceCase reads like a case (the AMSEnSightCase interface), so
+the native reader's dataset, the span space, the spatial index and the
+NumPy streamlines all work on it unchanged.  Its geometry is the first
+case's, and each per-node variable the two cases have in common is A
+minus B there:
+
+    >>> case = AMSDifferenceCase("250rpm.case", "100rpm.case")
+    >>> case.getPartArray("uds_0_scalar", partId)
+    >>> dataset = AMSHostCache.makeVTKDataSet(case, ["uds_0_scalar"])
+
+If both cases have the same mesh (the same parts and node coordinates,
+as two runs of one export usually do), the values are subtracted node
+by node.  Otherwise B is interpolated at A's nodes through B's spatial
+index (see AMSSpatialIndex); A's nodes that are outside B's mesh take
+the value of B's closest node.  Where the nodes fall in B's mesh is
+worked out once per time step, so each variable after the first costs
+a gather and a subtraction.
+
+A difference is computed the first time it is asked for, and kept
+until it is released.  isStale() tells whether the files of either
+case changed since they were opened, and reopen() starts over.
+
+In a data config file, a difference names two other entries:
+
+    "250-minus-100": {"difference": ["m250rpm", "m100rpm"],
+                      "description": "250 rpm minus 100 rpm"}
+
+and AMSDataObjectCollection opens it like any other case, so recipes
+can plot it.
+
+    $ python AMSDifference.py 250rpm.case 100rpm.case [--variables pressure uds_0_scalar]
+
+prints the ranges of the differences, and how long they took.
+"""
+
+import os, time
+
+import numpy
+
+import AMSCatalog
+import AMSSpatialIndex
+import AMSStore
+
+
+def getDifferenceName(nameA, nameB):
+    return nameA + " - " + nameB
+
+
+def geometriesMatch(geometryA, geometryB):
+    """
+    Whether two geometries have the same parts with the same nodes, so
+    their per-node values can be subtracted as they are.
+    """
+    if [(part.partId, part.numberOfNodes) for part in geometryA.parts] != \
+       [(part.partId, part.numberOfNodes) for part in geometryB.parts]:
+        return False
+    for partA, partB in zip(geometryA.parts, geometryB.parts):
+        if not numpy.array_equal(partA.getCoordinates(), partB.getCoordinates()):
+            return False
+    return True
+
+
+def getValueRange(values, components, component=-1):
+    """
+    Returns (min, max) of some per-node values, like
+    AMSEnSightVariable.getRange(), skipping the NaNs.
+    """
+    if components == 1:
+        v = values
+    elif component < 0:
+        v = numpy.sqrt(numpy.einsum("ij,ij->i", values, values, dtype=numpy.float64))
+    else:
+        v = values[:, component]
+    v = v[numpy.isfinite(v)]
+    if len(v) == 0:
+        return (numpy.inf, -numpy.inf)
+    return (float(v.min()), float(v.max()))
+
+
+class AMSDifferenceCase(object):
+    """
+    A minus B, read through the same interface as AMSEnSightCase.
+    """
+    def __init__(self, fileA, fileB):
+        self.fileA = fileA
+        self.fileB = fileB
+        # Names the host cache's entries (see AMSHostCache).
+        self.caseFile = os.path.abspath(fileA) + "-minus-" + os.path.basename(fileB)
+        self.open()
+
+    def open(self):
+        self.caseA = AMSStore.openCase(self.fileA)
+        self.caseB = AMSStore.openCase(self.fileB)
+
+        # The per-node variables both cases have, with the same number of
+        # components.
+        self.variableNames = []
+        namesB = set(self.caseB.getVariableNames())
+        for name in self.caseA.getVariableNames():
+            info = self.caseA.getVariableInfo(name)
+            if info["location"] != "node" or name not in namesB:
+                continue
+            infoB = self.caseB.getVariableInfo(name)
+            if infoB["location"] == "node" and infoB["components"] == info["components"]:
+                self.variableNames.append(name)
+
+        self.values = {}            # (name, time step) -> {part id: A - B}
+        self.matching = {}          # time step -> whether the meshes match
+        self.mappings = {}          # time step -> where A's nodes are in B's mesh
+        self.indices = {}           # time step -> B's spatial index
+
+        # The files as they were when we opened them, for isStale().
+        self.signature = AMSCatalog.fileSignature(self.getFiles())
+
+    def reopen(self):
+        """
+        Starts over with the cases as they are on disk now.
+        """
+        self.close()
+        self.open()
+
+    def isStale(self):
+        """
+        Whether the files of either case changed since they were opened.
+        """
+        return AMSCatalog.fileSignature(self.signature.keys()) != self.signature
+
+    def getFiles(self, timeStep=0):
+        files = self.caseA.getFiles(timeStep)
+        return files + [fileName for fileName in self.caseB.getFiles(timeStep) if fileName not in files]
+
+    def getVariableNames(self):
+        return list(self.variableNames)
+
+    def getVariableInfo(self, name):
+        return self.caseA.getVariableInfo(name)
+
+    def getNumberOfComponents(self, name):
+        return self.caseA.getVariableInfo(name)["components"]
+
+    def getTimeValues(self):
+        return self.caseA.getTimeValues()
+
+    def getGeometry(self, timeStep=0):
+        return self.caseA.getGeometry(timeStep)
+
+    def meshesMatch(self, timeStep=0):
+        if timeStep not in self.matching:
+            self.matching[timeStep] = geometriesMatch(self.caseA.getGeometry(timeStep),
+                                                      self.caseB.getGeometry(timeStep))
+        return self.matching[timeStep]
+
+    def getSpatialIndexB(self, timeStep=0):
+        """
+        Returns B's spatial index: the one saved next to B for its first
+        geometry, or one of our own for a geometry that moves.
+        """
+        if timeStep not in self.indices:
+            geometry = self.caseB.getGeometry(timeStep)
+            if geometry is self.caseB.getGeometry():
+                self.indices[timeStep] = AMSSpatialIndex.getSpatialIndex(self.fileB, self.caseB)
+            else:
+                self.indices[timeStep] = AMSSpatialIndex.buildSpatialIndex(geometry)
+        return self.indices[timeStep]
+
+    def getMapping(self, timeStep=0):
+        """
+        Returns (tets, weights, outside, nearest): the tets of B's mesh
+        holding A's nodes (all parts, in geometry order) with their
+        barycentric weights, and for the nodes outside B's mesh, B's
+        closest nodes.
+        """
+        if timeStep not in self.mappings:
+            index = self.getSpatialIndexB(timeStep)
+            points = numpy.concatenate([numpy.asarray(part.getCoordinates(), dtype=numpy.float64)
+                                        for part in self.caseA.getGeometry(timeStep).parts])
+            start = time.time()
+            tets, weights = index.locate(points)
+            outside = numpy.flatnonzero(tets < 0)
+            nearest, distances = index.findClosestPoints(points[outside])
+            print("placed %d nodes of %s in %s in %.1f s (%d outside)"
+                  % (len(points), self.fileA, self.fileB, time.time() - start, len(outside)))
+            self.mappings[timeStep] = (numpy.maximum(tets, 0), weights, outside, nearest)
+        return self.mappings[timeStep]
+
+    def interpolateB(self, name, timeStep=0):
+        """
+        Returns B's values of a variable at A's nodes (all parts, in
+        geometry order).
+        """
+        tets, weights, outside, nearest = self.getMapping(timeStep)
+        mesh = self.getSpatialIndexB(timeStep).mesh
+        values = self.caseB.getPointArray(name, timeStep)
+        result = mesh.interpolate(mesh.extendField(values), tets, weights)
+        result[outside] = values[nearest]
+        return result
+
+    def computeDifference(self, name, timeStep=0):
+        """
+        Returns {part id: A - B} for a variable, as float32, leaving out
+        the parts where A has no values (or, with matching meshes, B).
+        """
+        if name not in self.variableNames:
+            raise KeyError("No variable named " + name + " in both " + self.fileA + " and " + self.fileB)
+        start = time.time()
+        parts = self.caseA.getGeometry(timeStep).parts
+        difference = {}
+        if self.meshesMatch(timeStep):
+            for part in parts:
+                a = self.caseA.getPartArray(name, part.partId, timeStep)
+                b = self.caseB.getPartArray(name, part.partId, timeStep)
+                if a is not None and b is not None:
+                    difference[part.partId] = numpy.subtract(a, b, dtype=numpy.float32)
+        else:
+            b = self.interpolateB(name, timeStep)
+            offset = 0
+            for part in parts:
+                a = self.caseA.getPartArray(name, part.partId, timeStep)
+                if a is not None:
+                    difference[part.partId] = numpy.subtract(a, b[offset:offset + part.numberOfNodes],
+                                                             dtype=numpy.float32)
+                offset += part.numberOfNodes
+        # The difference is all we keep.
+        self.caseA.release(name)
+        self.caseB.release(name)
+        print("computed %s of %s in %.2f s (%s)" % (name, self.caseFile, time.time() - start,
+                                                     "same mesh" if self.meshesMatch(timeStep) else "interpolated"))
+        return difference
+
+    def getDifference(self, name, timeStep=0):
+        key = (name, timeStep)
+        if key not in self.values:
+            self.values[key] = self.computeDifference(name, timeStep)
+        return self.values[key]
+
+    def getPartArray(self, name, partId, timeStep=0):
+        """
+        Returns A - B on one part, or None if there is no difference
+        there.
+        """
+        return self.getDifference(name, timeStep).get(partId)
+
+    def getPointArray(self, name, timeStep=0):
+        """
+        Returns A - B for all parts, in geometry order, with NaNs where
+        there is no difference.
+        """
+        difference = self.getDifference(name, timeStep)
+        components = self.getNumberOfComponents(name)
+        pieces = []
+        for part in self.getGeometry(timeStep).parts:
+            values = difference.get(part.partId)
+            if values is None:
+                shape = (part.numberOfNodes,) if components == 1 else (part.numberOfNodes, components)
+                values = numpy.full(shape, numpy.nan, dtype=numpy.float32)
+            pieces.append(values)
+        return numpy.concatenate(pieces)
+
+    def getRange(self, name, component=-1, timeStep=0):
+        low, high = numpy.inf, -numpy.inf
+        components = self.getNumberOfComponents(name)
+        for values in self.getDifference(name, timeStep).values():
+            if len(values) == 0:
+                continue
+            partLow, partHigh = getValueRange(values, components, component)
+            low = min(low, partLow)
+            high = max(high, partHigh)
+        return (low, high)
+
+    def isLoaded(self, name, timeStep=0):
+        return (name, timeStep) in self.values
+
+    def getLoadedVariables(self):
+        return sorted(set(name for name, timeStep in self.values.keys()))
+
+    def getBytes(self):
+        return sum(values.nbytes for difference in self.values.values() for values in difference.values())
+
+    def release(self, name=None):
+        """
+        Drops a difference (all of them if no name is given).
+        """
+        for key in list(self.values.keys()):
+            if name is None or key[0] == name:
+                del self.values[key]
+        self.caseA.release(name)
+        self.caseB.release(name)
+
+    def close(self):
+        self.release()
+        self.mappings = {}
+        self.indices = {}
+        self.caseA.close()
+        self.caseB.close()
+
+
+def differenceMetadata(metadataA, metadataB):
+    """
+    Returns catalog metadata (see AMSCatalog.computeMetadata()) for A - B
+    from the metadata of A and B, without computing the difference.  The
+    ranges are bounds: A's low minus B's high to A's high minus B's low,
+    and for vectors, up to the sum of the largest magnitudes.
+    """
+    variables = {}
+    for name, a in metadataA["variables"].items():
+        b = metadataB["variables"].get(name)
+        if b is None or a["location"] != "node" or b["location"] != "node" or a["components"] != b["components"]:
+            continue
+        if a["range"] is None or b["range"] is None:
+            bounds = None
+        elif a["components"] == 1:
+            bounds = [a["range"][0] - b["range"][1], a["range"][1] - b["range"][0]]
+        else:
+            bounds = [0.0, a["range"][1] + b["range"][1]]
+        variables[name] = {"range": bounds, "components": a["components"], "location": "node"}
+
+    metadata = dict(metadataA)
+    metadata["variables"] = variables
+    return metadata
+
+
+# =============================================================================
+# Main: the ranges of the differences of two cases
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compute the difference of two cases, A minus B")
+    parser.add_argument("caseA")
+    parser.add_argument("caseB")
+    parser.add_argument("--variables", nargs="*", default=None, help="Variables to compute (default all)")
+    args = parser.parse_args()
+
+    case = AMSDifferenceCase(args.caseA, args.caseB)
+    print("%s minus %s: %s" % (args.caseA, args.caseB,
+                               "same mesh" if case.meshesMatch() else "interpolated onto A's mesh"))
+    for name in args.variables if args.variables is not None else case.getVariableNames():
+        start = time.time()
+        low, high = case.getRange(name)
+        print("  %-24s %12.6g %12.6g   %.2f s" % (name, low, high, time.time() - start))
+        case.release(name)
+    case.close()
@@ -0,0 +1,759 @@
+r"""
+A native reader for EnSight Gold binary cases.
+
+The ParaView EnSight reader loads every variable listed in the .case
+file when the pipeline updates, which for our exports means all 100
+'scalar per node' files plus the velocity vector.  This module parses the
+.case file and the binary layout of the geometry and variable files
+itself, and maps each variable file with mmap only when it is first asked
+for.  The arrays it hands back are NumPy views into the mapped files, so
+nothing is copied until somebody needs a contiguous or interleaved copy
+(e.g. to build a VTK dataset).
+
+    >>> case = AMSEnSightCase("/path/to/mat-viz-mofTFF-90L-9.1lpm-100rpm.case")
+    >>> case.getVariableNames()[:3]
+    ['pressure', 'pressure_coefficient', 'dynamic_pressure']
+    >>> case.getPartArray("pressure", 3)        # zero-copy float32 view
+    >>> case.getRange("velocity", -1)           # magnitude range
+
+Only the 'C Binary' flavor of EnSight Gold with unstructured
+('coordinates') parts is supported, which is what Fluent writes.
+"""
+
+import os, re, mmap
+
+import numpy
+
+try:
+    from vtk.util import numpy_support
+    from vtk.vtkCommonCore import vtkPoints
+    from vtk.vtkCommonDataModel import vtkMultiBlockDataSet, vtkUnstructuredGrid, vtkCellArray
+except ImportError:
+    # The reader itself only needs NumPy, so it can be used from plain
+    # python (converters, worker pools); only makeVTKDataSet() needs VTK.
+    numpy_support = None
+
+# =============================================================================
+#
+# File format tables
+#
+# =============================================================================
+
+# Every string in an EnSight binary file occupies exactly 80 bytes.
+STRING_LENGTH = 80
+
+# Element type name -> (nodes per element, VTK cell type).  The
+# variable-length types have no fixed node count.
+ELEMENT_TYPES = {
+    "point":     (1,  1),
+    "bar2":      (2,  3),
+    "bar3":      (3,  21),
+    "tria3":     (3,  5),
+    "tria6":     (6,  22),
+    "quad4":     (4,  9),
+    "quad8":     (8,  23),
+    "tetra4":    (4,  10),
+    "tetra10":   (10, 24),
+    "pyramid5":  (5,  14),
+    "pyramid13": (13, 27),
+    "penta6":    (6,  13),
+    "penta15":   (15, 26),
+    "hexa8":     (8,  12),
+    "hexa20":    (20, 25),
+    "nsided":    (None, 7),
+    "nfaced":    (None, 42),
+}
+
+# EnSight and VTK disagree about the winding of wedges.  These are the
+# same permutations the ParaView reader applies.
+NODE_ORDER = {
+    "penta6":  [0, 2, 1, 3, 5, 4],
+    "penta15": [0, 2, 1, 3, 5, 4, 8, 7, 6, 11, 10, 9, 12, 14, 13],
+}
+
+# Number of components for each variable type in the .case file.
+VARIABLE_COMPONENTS = {
+    "scalar": 1,
+    "vector": 3,
+    "tensor symm": 6,
+    "tensor asym": 9,
+}
+
+# =============================================================================
+
+def elementTypeInfo(elementType):
+    """
+    Returns (nodes per element, VTK cell type, ghost flag) for an EnSight
+    element type name, e.g. 'tetra4' or 'g_tria3'.
+    """
+    ghost = elementType.startswith("g_")
+    baseType = elementType[2:] if ghost else elementType
+    if baseType not in ELEMENT_TYPES:
+        raise ValueError("Unknown EnSight element type: " + elementType)
+    nodesPerElement, vtkType = ELEMENT_TYPES[baseType]
+    return nodesPerElement, vtkType, ghost
+
+
+class AMSMappedFile(object):
+    """
+    A read-only view of a binary file through mmap.  The mapping is
+    private (copy-on-write), so the NumPy views we hand out are writable
+    as far as VTK is concerned but the pages are shared with the page
+    cache until somebody actually writes to them.
+    """
+    def __init__(self, fileName, byteOrder="<"):
+        self.fileName = fileName
+        self.byteOrder = byteOrder
+        self.size = os.path.getsize(fileName)
+        with open(fileName, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def readString(self, offset):
+        """
+        Returns the 80-byte string at the offset and the offset past it.
+        """
+        raw = self.buffer[offset:offset + STRING_LENGTH]
+        text = raw.split(b"\0")[0].strip().decode("ascii", "replace")
+        return text, offset + STRING_LENGTH
+
+    def peekString(self, offset):
+        return self.readString(offset)[0]
+
+    def readInts(self, offset, count):
+        """
+        Returns a view of 'count' int32 values and the offset past them.
+        """
+        values = numpy.frombuffer(self.buffer, dtype=self.byteOrder + "i4",
+                                  count=count, offset=offset)
+        return values, offset + 4 * count
+
+    def readInt(self, offset):
+        values, offset = self.readInts(offset, 1)
+        return int(values[0]), offset
+
+    def readFloats(self, offset, count):
+        """
+        Returns a view of 'count' float32 values and the offset past them.
+        """
+        values = numpy.frombuffer(self.buffer, dtype=self.byteOrder + "f4",
+                                  count=count, offset=offset)
+        return values, offset + 4 * count
+
+    def close(self):
+        try:
+            self.buffer.close()
+        except BufferError:
+            # Somebody still holds a view into the mapping.  It will be
+            # unmapped when the last view is garbage collected.
+            pass
+
+
+def prefetchFiles(fileNames, blockSize=1 << 22):
+    """
+    Pulls files into the page cache, so that a reader that comes later
+    (e.g. ParaView's, on the main thread) finds them in memory.  Returns
+    the number of bytes read.
+    """
+    total = 0
+    for fileName in fileNames:
+        with open(fileName, "rb") as fp:
+            while True:
+                block = fp.read(blockSize)
+                if not block:
+                    break
+                total += len(block)
+    return total
+
+
+# =============================================================================
+#
+# Geometry
+#
+# =============================================================================
+
+class AMSEnSightElementBlock(object):
+    """
+    One block of elements of a single type within a part.  The
+    connectivity is kept as a view into the mapped geometry file and
+    converted to zero-based indices only on request.
+    """
+    def __init__(self, elementType, count):
+        self.elementType = elementType
+        self.count = count
+        self.nodesPerElement, self.vtkType, self.ghost = elementTypeInfo(elementType)
+
+        # Raw (one-based) connectivity.  For fixed-size elements this is
+        # an (count, nodesPerElement) view; for nsided it is the flat node
+        # list with 'nodeCounts'; for nfaced there is also 'faceCounts'.
+        self.connectivity = None
+        self.nodeCounts = None
+        self.faceCounts = None
+
+    def getConnectivity(self):
+        """
+        Returns zero-based connectivity in VTK node order.  Only defined
+        for fixed-size element types.
+        """
+        if self.nodesPerElement is None:
+            raise ValueError("No fixed connectivity for " + self.elementType)
+        connectivity = self.connectivity - 1
+        order = NODE_ORDER.get(self.elementType.replace("g_", ""))
+        if order is not None:
+            connectivity = connectivity[:, order]
+        return connectivity
+
+
+class AMSEnSightPart(object):
+    """
+    One part of an EnSight geometry: a set of nodes and some element
+    blocks that refer to them.
+    """
+    def __init__(self, partId, description):
+        self.partId = partId
+        self.description = description
+        self.numberOfNodes = 0
+        self.coordinates = None
+        self.blocks = []
+
+    def getCoordinates(self):
+        """
+        Returns an (n, 3) view of the node coordinates.  EnSight stores
+        all x, then all y, then all z, so this view is not contiguous.
+        """
+        return self.coordinates.T
+
+    def getNumberOfElements(self, includeGhosts=False):
+        return sum(block.count for block in self.blocks
+                   if includeGhosts or not block.ghost)
+
+
+class AMSEnSightGeometry(object):
+    """
+    The parsed geometry file.  Node coordinates and connectivity stay in
+    the mapped file; only the part and block headers are read up front.
+    """
+    def __init__(self, fileName, byteOrder=None):
+        self.fileName = fileName
+        self.parts = []
+        self.partIndex = {}
+        self.extents = None
+
+        self.byteOrder = byteOrder or self.detectByteOrder(fileName)
+        self.file = AMSMappedFile(fileName, self.byteOrder)
+        self.parse()
+
+    @staticmethod
+    def detectByteOrder(fileName):
+        """
+        EnSight doesn't record the byte order, so look at the first part
+        number and see which interpretation is plausible.
+        """
+        with open(fileName, "rb") as fp:
+            header = fp.read(8 * STRING_LENGTH)
+
+        offset = header.find(b"part")
+        if offset < 0:
+            return "<"
+        raw = header[offset + STRING_LENGTH:offset + STRING_LENGTH + 4]
+        little = numpy.frombuffer(raw, dtype="<i4")[0]
+        if 0 < little < 2 ** 20:
+            return "<"
+        return ">"
+
+    def parse(self):
+        f = self.file
+
+        fileType, offset = f.readString(0)
+        if "fortran" in fileType.lower():
+            raise ValueError("Fortran binary EnSight files are not supported: " + self.fileName)
+        if "binary" not in fileType.lower():
+            raise ValueError("Not an EnSight Gold binary geometry file: " + self.fileName)
+
+        self.description = []
+        for i in range(2):
+            text, offset = f.readString(offset)
+            self.description.append(text)
+
+        nodeIdMode, offset = f.readString(offset)
+        elementIdMode, offset = f.readString(offset)
+        nodeIdsPresent = nodeIdMode.split()[-1] in ("given", "ignore")
+        elementIdsPresent = elementIdMode.split()[-1] in ("given", "ignore")
+
+        if f.peekString(offset).startswith("extents"):
+            offset += STRING_LENGTH
+            self.extents, offset = f.readFloats(offset, 6)
+
+        while offset < f.size:
+            keyword, offset = f.readString(offset)
+            if keyword != "part":
+                raise ValueError("Expected 'part' in " + self.fileName + ", found '" + keyword + "'")
+
+            partId, offset = f.readInt(offset)
+            description, offset = f.readString(offset)
+            part = AMSEnSightPart(partId, description)
+
+            keyword, offset = f.readString(offset)
+            if keyword != "coordinates":
+                raise ValueError("Only unstructured parts are supported, part " +
+                                 str(partId) + " is '" + keyword + "'")
+
+            part.numberOfNodes, offset = f.readInt(offset)
+            if nodeIdsPresent:
+                offset += 4 * part.numberOfNodes
+            coordinates, offset = f.readFloats(offset, 3 * part.numberOfNodes)
+            part.coordinates = coordinates.reshape(3, part.numberOfNodes)
+
+            # Element blocks continue until the next part or the end.
+            while offset < f.size and f.peekString(offset) != "part":
+                elementType, offset = f.readString(offset)
+                count, offset = f.readInt(offset)
+                block = AMSEnSightElementBlock(elementType, count)
+                if elementIdsPresent:
+                    offset += 4 * count
+
+                baseType = elementType.replace("g_", "")
+                if baseType == "nsided":
+                    block.nodeCounts, offset = f.readInts(offset, count)
+                    block.connectivity, offset = f.readInts(offset, int(block.nodeCounts.sum()))
+                elif baseType == "nfaced":
+                    block.faceCounts, offset = f.readInts(offset, count)
+                    block.nodeCounts, offset = f.readInts(offset, int(block.faceCounts.sum()))
+                    block.connectivity, offset = f.readInts(offset, int(block.nodeCounts.sum()))
+                else:
+                    connectivity, offset = f.readInts(offset, count * block.nodesPerElement)
+                    block.connectivity = connectivity.reshape(count, block.nodesPerElement)
+
+                part.blocks.append(block)
+
+            self.parts.append(part)
+            self.partIndex[partId] = part
+
+    def getPart(self, partId):
+        return self.partIndex[partId]
+
+    def getPartIds(self):
+        return [part.partId for part in self.parts]
+
+    def getNumberOfPoints(self):
+        return sum(part.numberOfNodes for part in self.parts)
+
+    def getNumberOfCells(self):
+        return sum(part.getNumberOfElements() for part in self.parts)
+
+    def close(self):
+        self.file.close()
+
+
+# =============================================================================
+#
+# Variables
+#
+# =============================================================================
+
+class AMSEnSightVariable(object):
+    """
+    One variable file, mapped into memory.  The values for each part are
+    views into the mapping.  Per-node values are indexed by part id;
+    per-element values by (part id, block index).
+    """
+    def __init__(self, fileName, geometry, components, location):
+        self.fileName = fileName
+        self.components = components
+        self.location = location
+        self.values = {}
+
+        self.file = AMSMappedFile(fileName, geometry.byteOrder)
+        self.description, offset = self.file.readString(0)
+
+        f = self.file
+        while offset < f.size:
+            keyword, offset = f.readString(offset)
+            if keyword != "part":
+                raise ValueError("Expected 'part' in " + fileName + ", found '" + keyword + "'")
+            partId, offset = f.readInt(offset)
+            part = geometry.getPart(partId)
+
+            if location == "node":
+                keyword, offset = f.readString(offset)
+                if keyword != "coordinates":
+                    raise ValueError("Only unstructured parts are supported in " + fileName)
+                self.values[partId], offset = self.readValues(offset, part.numberOfNodes)
+            else:
+                # One section per element block, in the geometry order.
+                # Blocks without values are simply absent.
+                blockIndex = dict((block.elementType, i) for i, block in enumerate(part.blocks))
+                while offset < f.size and f.peekString(offset) != "part":
+                    elementType, offset = f.readString(offset)
+                    if elementType.endswith("undef") or elementType.endswith("partial"):
+                        raise ValueError("Undefined/partial values are not supported in " + fileName)
+                    i = blockIndex[elementType]
+                    self.values[(partId, i)], offset = self.readValues(offset, part.blocks[i].count)
+
+    def readValues(self, offset, count):
+        """
+        Returns the values for 'count' nodes or elements.  Multi-component
+        values are stored component by component, so the (count,
+        components) view we return is transposed, not contiguous.
+        """
+        values, offset = self.file.readFloats(offset, count * self.components)
+        if self.components > 1:
+            values = values.reshape(self.components, count).T
+        return values, offset
+
+    def getRange(self, component=-1):
+        """
+        Returns (min, max) over all parts.  Component -1 means the
+        magnitude for multi-component variables, like GetRange(-1) in
+        ParaView.
+        """
+        low, high = numpy.inf, -numpy.inf
+        for values in self.values.values():
+            if len(values) == 0:
+                continue
+            if self.components == 1:
+                v = values
+            elif component < 0:
+                v = numpy.sqrt(numpy.einsum("ij,ij->i", values, values, dtype=numpy.float64))
+            else:
+                v = values[:, component]
+            low = min(low, float(v.min()))
+            high = max(high, float(v.max()))
+        return (low, high)
+
+    def close(self):
+        self.values = {}
+        self.file.close()
+
+
+# =============================================================================
+#
+# Case file
+#
+# =============================================================================
+
+class AMSEnSightCase(object):
+    """
+    An EnSight Gold case.  Parsing the .case file is cheap; the geometry
+    is parsed the first time it is needed, and each variable file is
+    mapped the first time it is asked for.
+    """
+    def __init__(self, caseFile):
+        self.caseFile = os.path.abspath(caseFile)
+        self.caseDir = os.path.dirname(self.caseFile)
+
+        self.geometryFile = None
+        self.variableInfo = {}      # name -> dict(type, location, components, fileName)
+        self.variableNames = []     # in .case file order
+        self.timeValues = [0.0]
+        self.fileStart = 0
+        self.fileIncrement = 1
+
+        self.geometry = {}          # time step -> AMSEnSightGeometry
+        self.variables = {}         # (name, time step) -> AMSEnSightVariable
+
+        self.parseCaseFile()
+
+    def parseCaseFile(self):
+        section = None
+        timeValues = []
+        with open(self.caseFile) as fp:
+            lines = fp.readlines()
+
+        for line in lines:
+            line = line.split("#")[0].rstrip()
+            if not line.strip():
+                continue
+            if line.strip() in ("FORMAT", "GEOMETRY", "VARIABLE", "TIME", "FILE"):
+                section = line.strip()
+                continue
+
+            if ":" not in line:
+                # Continuation of a 'time values:' list.
+                if section == "TIME":
+                    timeValues.extend(float(v) for v in line.split())
+                continue
+
+            key, value = [s.strip() for s in line.split(":", 1)]
+            tokens = value.split()
+
+            if section == "FORMAT" and key == "type":
+                if "gold" not in value.lower():
+                    raise ValueError("Only EnSight Gold cases are supported: " + self.caseFile)
+
+            elif section == "GEOMETRY" and key == "model":
+                # model: [ts] [fs] filename [change_coords_only]
+                tokens = [t for t in tokens if t != "change_coords_only"]
+                self.geometryFile = tokens[-1]
+
+            elif section == "VARIABLE":
+                match = re.match(r"(scalar|vector|tensor symm|tensor asym) per (node|element)$", key)
+                if match is None:
+                    # Constants and complex variables are not supported.
+                    continue
+                # [ts] [fs] description filename
+                name, fileName = tokens[-2], tokens[-1]
+                if name not in self.variableInfo:
+                    self.variableNames.append(name)
+                self.variableInfo[name] = {
+                    "type": match.group(1),
+                    "location": match.group(2),
+                    "components": VARIABLE_COMPONENTS[match.group(1)],
+                    "fileName": fileName,
+                }
+
+            elif section == "TIME":
+                if key == "filename start number":
+                    self.fileStart = int(tokens[0])
+                elif key == "filename increment":
+                    self.fileIncrement = int(tokens[0])
+                elif key == "time values":
+                    timeValues.extend(float(v) for v in tokens)
+
+        if timeValues:
+            self.timeValues = timeValues
+        if self.geometryFile is None:
+            raise ValueError("No geometry file in " + self.caseFile)
+
+    def resolveFileName(self, fileName, timeStep=0):
+        """
+        Replaces the '*' wildcards in a file name with the (zero-padded)
+        file number for the time step.
+        """
+        match = re.search(r"\*+", fileName)
+        if match:
+            number = self.fileStart + timeStep * self.fileIncrement
+            width = len(match.group(0))
+            fileName = fileName[:match.start()] + str(number).zfill(width) + fileName[match.end():]
+        return os.path.join(self.caseDir, fileName)
+
+    def getFiles(self, timeStep=0):
+        """
+        Returns all the files this case reads for the time step.
+        """
+        files = [self.caseFile, self.resolveFileName(self.geometryFile, timeStep)]
+        for name in self.variableNames:
+            files.append(self.resolveFileName(self.variableInfo[name]["fileName"], timeStep))
+        return files
+
+    def getVariableNames(self):
+        return list(self.variableNames)
+
+    def getVariableInfo(self, name):
+        return self.variableInfo[name]
+
+    def getNumberOfComponents(self, name):
+        return self.variableInfo[name]["components"]
+
+    def getTimeValues(self):
+        return list(self.timeValues)
+
+    def getGeometry(self, timeStep=0):
+        fileName = self.resolveFileName(self.geometryFile, timeStep)
+        # A static geometry is shared by all the time steps.
+        for geometry in self.geometry.values():
+            if geometry.fileName == fileName:
+                self.geometry[timeStep] = geometry
+                return geometry
+        if timeStep not in self.geometry:
+            self.geometry[timeStep] = AMSEnSightGeometry(fileName)
+        return self.geometry[timeStep]
+
+    def getVariable(self, name, timeStep=0):
+        """
+        Returns the variable, mapping its file if this is the first time it
+        was asked for.
+        """
+        key = (name, timeStep)
+        if key not in self.variables:
+            if name not in self.variableInfo:
+                raise KeyError("No variable named " + name + " in " + self.caseFile)
+            info = self.variableInfo[name]
+            self.variables[key] = AMSEnSightVariable(
+                self.resolveFileName(info["fileName"], timeStep),
+                self.getGeometry(timeStep), info["components"], info["location"])
+        return self.variables[key]
+
+    def getPartArray(self, name, partId, timeStep=0):
+        """
+        Returns a zero-copy view of the per-node values of a variable on
+        one part, or None if the variable has no values there.
+        """
+        return self.getVariable(name, timeStep).values.get(partId)
+
+    def getPointArray(self, name, timeStep=0):
+        """
+        Returns the per-node values of a variable for all parts, in
+        geometry order.  Unlike getPartArray() this has to copy.
+        """
+        variable = self.getVariable(name, timeStep)
+        geometry = self.getGeometry(timeStep)
+        pieces = []
+        for part in geometry.parts:
+            values = variable.values.get(part.partId)
+            if values is None:
+                shape = (part.numberOfNodes,) if variable.components == 1 else (part.numberOfNodes, variable.components)
+                values = numpy.full(shape, numpy.nan, dtype=numpy.float32)
+            pieces.append(values)
+        return numpy.concatenate(pieces)
+
+    def getRange(self, name, component=-1, timeStep=0):
+        return self.getVariable(name, timeStep).getRange(component)
+
+    def isLoaded(self, name, timeStep=0):
+        return (name, timeStep) in self.variables
+
+    def getLoadedVariables(self):
+        return sorted(set(name for name, timeStep in self.variables.keys()))
+
+    def release(self, name=None):
+        """
+        Unmaps a variable (all of them if no name is given).
+        """
+        for key in list(self.variables.keys()):
+            if name is None or key[0] == name:
+                self.variables.pop(key).close()
+
+    def close(self):
+        self.release()
+        for geometry in set(self.geometry.values()):
+            geometry.close()
+        self.geometry = {}
+
+
+# =============================================================================
+#
+# Conversion to VTK
+#
+# =============================================================================
+
+def makeVTKCells(part):
+    """
+    Returns the cells of one part as the arrays VTK's legacy cell
+    interface takes: (cells, types, locations), int64/uint8/int64.
+    Ghost elements are left out.
+    """
+    cells = []
+    types = []
+    locations = []
+    position = 0
+    for block in part.blocks:
+        if block.ghost or block.count == 0:
+            continue
+        if block.nodesPerElement is not None:
+            connectivity = block.getConnectivity()
+            counts = numpy.full((block.count, 1), block.nodesPerElement, dtype=numpy.int64)
+            cells.append(numpy.hstack([counts, connectivity.astype(numpy.int64)]).ravel())
+            locations.append(position + (block.nodesPerElement + 1) * numpy.arange(block.count, dtype=numpy.int64))
+        elif block.faceCounts is None:
+            # nsided: each polygon is its node count followed by its nodes.
+            nodeCounts = block.nodeCounts.astype(numpy.int64)
+            starts = numpy.concatenate([[0], numpy.cumsum(nodeCounts + 1)[:-1]])
+            flat = numpy.empty(int(nodeCounts.sum()) + block.count, dtype=numpy.int64)
+            flat[starts] = nodeCounts
+            mask = numpy.ones(len(flat), dtype=bool)
+            mask[starts] = False
+            flat[mask] = block.connectivity.astype(numpy.int64) - 1
+            cells.append(flat)
+            locations.append(position + starts)
+        else:
+            # nfaced: VTK wants the face stream
+            # (nfaces, npts0, ids0..., npts1, ids1...).
+            stream = []
+            face = 0
+            node = 0
+            for faceCount in block.faceCounts:
+                entry = [int(faceCount)]
+                for nodeCount in block.nodeCounts[face:face + faceCount]:
+                    entry.append(int(nodeCount))
+                    entry.extend(int(n) - 1 for n in block.connectivity[node:node + nodeCount])
+                    node += nodeCount
+                face += faceCount
+                stream.append([len(entry)] + entry)
+            cells.append(numpy.array([v for entry in stream for v in entry], dtype=numpy.int64))
+            lengths = numpy.array([len(entry) for entry in stream], dtype=numpy.int64)
+            locations.append(position + numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]]))
+        position += len(cells[-1])
+        types.append(numpy.full(block.count, block.vtkType, dtype=numpy.uint8))
+
+    if not cells:
+        return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.uint8),
+                numpy.zeros(0, dtype=numpy.int64))
+    return numpy.concatenate(cells), numpy.concatenate(types), numpy.concatenate(locations)
+
+
+def makeVTKGrid(points, cells, types, locations, deep=1):
+    """
+    Builds a vtkUnstructuredGrid from (n, 3) float32 points and the
+    arrays makeVTKCells() returns.  With deep=0 the grid uses the NumPy
+    arrays' memory (they must be contiguous, and stay alive).
+    """
+    grid = vtkUnstructuredGrid()
+
+    vtkpoints = vtkPoints()
+    vtkpoints.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(points), deep=deep))
+    grid.SetPoints(vtkpoints)
+
+    if len(types):
+        cellArray = vtkCellArray()
+        cellArray.SetCells(len(types), numpy_support.numpy_to_vtkIdTypeArray(cells, deep=deep))
+        grid.SetCells(numpy_support.numpy_to_vtk(types, deep=deep,
+                                                 array_type=numpy_support.get_vtk_array_type(numpy.uint8)),
+                      numpy_support.numpy_to_vtkIdTypeArray(locations, deep=deep),
+                      cellArray)
+    return grid
+
+
+def makeVTKPart(part):
+    """
+    Builds a vtkUnstructuredGrid holding the nodes and elements of one
+    part.  Ghost elements are left out.
+    """
+    cells, types, locations = makeVTKCells(part)
+    return makeVTKGrid(part.getCoordinates(), cells, types, locations)
+
+
+def addVTKArray(dataset, case, name, timeStep=0):
+    """
+    Adds a per-node variable to every block of a dataset made with
+    makeVTKDataSet().  Scalars are passed to VTK without copying.
+    """
+    geometry = case.getGeometry(timeStep)
+    for i, part in enumerate(geometry.parts):
+        values = case.getPartArray(name, part.partId, timeStep)
+        if values is None:
+            continue
+        array = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(values), deep=0)
+        array.SetName(name)
+        dataset.GetBlock(i).GetPointData().AddArray(array)
+    dataset.Modified()
+
+
+def removeVTKArray(dataset, name):
+    """
+    Removes a point array from every block of a dataset made with
+    makeVTKDataSet().
+    """
+    for i in range(dataset.GetNumberOfBlocks()):
+        dataset.GetBlock(i).GetPointData().RemoveArray(name)
+    dataset.Modified()
+
+
+def makeVTKDataSet(case, pointArrays=(), timeStep=0):
+    """
+    Builds a vtkMultiBlockDataSet with one unstructured grid per part,
+    like the ParaView EnSight reader, holding only the named per-node
+    arrays.
+    """
+    if numpy_support is None:
+        raise ImportError("makeVTKDataSet() requires VTK")
+
+    geometry = case.getGeometry(timeStep)
+    dataset = vtkMultiBlockDataSet()
+    dataset.SetNumberOfBlocks(len(geometry.parts))
+    for i, part in enumerate(geometry.parts):
+        dataset.SetBlock(i, makeVTKPart(part))
+        dataset.GetMetaData(i).Set(vtkMultiBlockDataSet.NAME(), part.description)
+
+    for name in pointArrays:
+        addVTKArray(dataset, case, name, timeStep)
+    return dataset
@@ -0,0 +1,433 @@
+r"""
+A host-wide cache of decoded cases, shared by all the server processes.
+
+Every browser session gets its own pvpython process, and each of them
+would otherwise decode its own copy of the same cases: contiguous point
+coordinates, VTK cell arrays, interleaved vectors.  This cache keeps
+those arrays as .npy files in a directory on a memory file system
+(/dev/shm by default), one subdirectory per case and version of its
+files.  The first process that needs an array writes it; every process
+maps it (copy-on-write), so the pages exist once on the host however
+many sessions look at the case.
+
+Processes register themselves in an entry by a file named after their
+pid in its refs/ directory, and remove it when they let go (or exit).
+collect() removes the refs of processes that no longer exist (crashed
+servers), and then the entries nobody refers to that are stale or idle,
+or that don't fit in the cache's size.  It runs when a process turns
+the cache on, and every few minutes from the server's event loop
+(startCollecting()).
+
+    >>> AMSHostCache.configure("/dev/shm/ams-cache")
+    >>> dataset = AMSHostCache.makeVTKDataSet(case, ["pressure"])
+
+    $ python AMSHostCache.py --status        # what's in the cache
+    $ python AMSHostCache.py --collect       # clean up after crashes
+
+makeVTKDataSet() and addVTKArray() fall back to AMSEnSight's when no
+cache is configured.
+"""
+
+import os, json, time, errno, shutil, hashlib, tempfile, atexit, threading
+
+import numpy
+
+import AMSEnSight
+import AMSCatalog
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): concurrent writers still can't
+    # corrupt anything, since arrays are renamed into place.
+    fcntl = None
+
+CACHE_VERSION = 1
+
+# =============================================================================
+
+def defaultRoot():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "ams-cache")
+
+
+def processStartTime(pid):
+    """
+    When the process started (in clock ticks since boot), so a pid that
+    was reused by a new process isn't taken for the old one.  None where
+    we can't tell.
+    """
+    try:
+        with open("/proc/%d/stat" % pid) as fp:
+            return int(fp.read().rsplit(")", 1)[1].split()[19])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def isAlive(pid, startTime=None):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            return False
+    return startTime is None or processStartTime(pid) in (None, startTime)
+
+
+def directorySize(directory):
+    total = 0
+    for path, dirs, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(path, name))
+            except OSError:
+                pass
+    return total
+
+
+class AMSHostCacheLock(object):
+    """
+    An exclusive advisory lock on a file, as a context manager.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.fp = None
+
+    def __enter__(self):
+        self.fp = open(self.fileName, "a")
+        if fcntl is not None:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+        self.fp.close()
+
+
+class AMSHostCacheEntry(object):
+    """
+    The cached arrays of one case, as seen by one process.
+    """
+    def __init__(self, cache, directory, case):
+        self.cache = cache
+        self.directory = directory
+        self.case = case
+        self.refFile = os.path.join(directory, "refs", str(os.getpid()))
+        self.attached = False
+
+    def attach(self):
+        with self.cache.lock():
+            for name in ("refs", "arrays"):
+                path = os.path.join(self.directory, name)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            infoFile = os.path.join(self.directory, "info.json")
+            if not os.path.exists(infoFile):
+                with open(infoFile, "w") as fp:
+                    json.dump({"version": CACHE_VERSION, "caseFile": self.case.caseFile}, fp)
+            with open(self.refFile, "w") as fp:
+                json.dump({"pid": os.getpid(), "start": processStartTime(os.getpid())}, fp)
+            self.touch()
+        self.attached = True
+
+    def detach(self):
+        if not self.attached:
+            return
+        self.attached = False
+        try:
+            os.remove(self.refFile)
+            self.touch()
+        except OSError:
+            pass
+
+    def touch(self):
+        os.utime(self.directory, None)
+
+    def getArray(self, name, build):
+        """
+        Returns the cached array 'name', mapped copy-on-write.  If it
+        isn't cached yet, build() makes it and we write it first.
+        """
+        fileName = os.path.join(self.directory, "arrays", name + ".npy")
+        if not os.path.exists(fileName):
+            array = numpy.ascontiguousarray(build())
+            temporaryFile = "%s.%d.%d.tmp" % (fileName, os.getpid(), threading.current_thread().ident)
+            with open(temporaryFile, "wb") as fp:
+                numpy.save(fp, array)
+            # Atomic, so other processes see all of it or nothing, and
+            # whoever gets there second just replaces an identical file.
+            os.rename(temporaryFile, fileName)
+            self.cache.built += 1
+        else:
+            self.cache.attachedArrays += 1
+        return numpy.load(fileName, mmap_mode="c")
+
+    def getPartArrays(self, index):
+        """
+        Returns (points, cells, types, locations) of the index'th part.
+        """
+        part = self.case.getGeometry().parts[index]
+        cellArrays = []
+
+        def buildCells(i):
+            if not cellArrays:
+                cellArrays.extend(AMSEnSight.makeVTKCells(part))
+            return cellArrays[i]
+
+        points = self.getArray("part%d.points" % index, lambda: part.getCoordinates().astype(numpy.float32))
+        cells = self.getArray("part%d.cells" % index, lambda: buildCells(0))
+        types = self.getArray("part%d.types" % index, lambda: buildCells(1))
+        locations = self.getArray("part%d.locations" % index, lambda: buildCells(2))
+        return points, cells, types, locations
+
+    def getPointArray(self, name, index):
+        """
+        Returns the values of a per-node variable on the index'th part,
+        contiguous ((n, components) for vectors), or None if the variable
+        has no values there.
+        """
+        part = self.case.getGeometry().parts[index]
+        if self.case.getPartArray(name, part.partId) is None:
+            return None
+        safeName = "".join(c if c.isalnum() or c in "_-" else "_" for c in name)
+        return self.getArray("part%d.%s" % (index, safeName),
+                             lambda: self.case.getPartArray(name, part.partId).astype(numpy.float32))
+
+    def makeVTKDataSet(self, pointArrays=()):
+        """
+        Like AMSEnSight.makeVTKDataSet(), but the grids and arrays use the
+        cached memory instead of their own copies.
+        """
+        from vtk.vtkCommonDataModel import vtkMultiBlockDataSet
+
+        geometry = self.case.getGeometry()
+        dataset = vtkMultiBlockDataSet()
+        dataset.SetNumberOfBlocks(len(geometry.parts))
+        for i, part in enumerate(geometry.parts):
+            dataset.SetBlock(i, AMSEnSight.makeVTKGrid(*self.getPartArrays(i), deep=0))
+            dataset.GetMetaData(i).Set(vtkMultiBlockDataSet.NAME(), part.description)
+        for name in pointArrays:
+            self.addVTKArray(dataset, name)
+        return dataset
+
+    def addVTKArray(self, dataset, name):
+        for i in range(dataset.GetNumberOfBlocks()):
+            values = self.getPointArray(name, i)
+            if values is None:
+                continue
+            array = AMSEnSight.numpy_support.numpy_to_vtk(values, deep=0)
+            array.SetName(name)
+            dataset.GetBlock(i).GetPointData().AddArray(array)
+        dataset.Modified()
+        # The decoded copy lives in the cache now; don't keep the source
+        # mapped as well.
+        self.case.release(name)
+
+
+class AMSHostCache(object):
+    """
+    The cache directory, and this process's entries in it.
+    """
+    def __init__(self, root=None, maxBytes=4 * 1024 ** 3, idleSeconds=600.0):
+        self.root = root or defaultRoot()
+        self.maxBytes = maxBytes
+        self.idleSeconds = idleSeconds
+        self.entries = {}           # entry directory -> AMSHostCacheEntry
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+        # How many arrays this process wrote, and how many it found.
+        self.built = 0
+        self.attachedArrays = 0
+
+    def lock(self):
+        return AMSHostCacheLock(os.path.join(self.root, ".lock"))
+
+    def getEntryName(self, case):
+        """
+        Names the entry after the case file and the size and mtime of all
+        its files, so a changed case gets a new entry.
+        """
+        signature = AMSCatalog.fileSignature(case.getFiles())
+        key = json.dumps([CACHE_VERSION, case.caseFile, sorted(signature.items())])
+        return os.path.basename(case.caseFile) + "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def attach(self, case):
+        """
+        Returns this process's entry for a case, registering the process
+        as one of its users.  A case whose files changed gets a new entry,
+        and the process lets go of the old one.
+        """
+        directory = os.path.join(self.root, self.getEntryName(case))
+        entry = self.entries.get(directory)
+        if entry is None:
+            for oldDirectory, old in list(self.entries.items()):
+                if old.case.caseFile == case.caseFile:
+                    old.detach()
+                    del self.entries[oldDirectory]
+            entry = AMSHostCacheEntry(self, directory, case)
+            entry.attach()
+            self.entries[directory] = entry
+        return entry
+
+    def detachAll(self):
+        for entry in self.entries.values():
+            entry.detach()
+        self.entries = {}
+
+    def getLiveRefs(self, directory, prune=False):
+        """
+        Returns the pids of the live processes using an entry, removing
+        the refs of dead ones if 'prune' is set.
+        """
+        refsDir = os.path.join(directory, "refs")
+        live = []
+        for name in os.listdir(refsDir) if os.path.isdir(refsDir) else []:
+            refFile = os.path.join(refsDir, name)
+            try:
+                with open(refFile) as fp:
+                    ref = json.load(fp)
+            except (IOError, OSError, ValueError):
+                ref = {"pid": int(name) if name.isdigit() else -1, "start": None}
+            if ref["pid"] > 0 and isAlive(ref["pid"], ref.get("start")):
+                live.append(ref["pid"])
+            elif prune:
+                try:
+                    os.remove(refFile)
+                except OSError:
+                    pass
+        return live
+
+    def getStatus(self):
+        """
+        Returns [{name, bytes, refs, idle}] for the entries in the cache.
+        """
+        status = []
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if not os.path.isdir(directory):
+                continue
+            status.append({
+                "name": name,
+                "bytes": directorySize(directory),
+                "refs": self.getLiveRefs(directory),
+                "idle": time.time() - os.path.getmtime(directory),
+            })
+        return status
+
+    def collect(self):
+        """
+        Drops the refs of processes that died, then removes the entries
+        nobody uses that have been idle for 'idleSeconds', and more of
+        the unused ones (least recently used first) while the cache is
+        bigger than 'maxBytes'.  Returns the names of the removed entries.
+        """
+        removed = []
+        with self.lock():
+            unused = []
+            total = 0
+            for name in os.listdir(self.root):
+                directory = os.path.join(self.root, name)
+                if not os.path.isdir(directory):
+                    continue
+                size = directorySize(directory)
+                total += size
+                if not self.getLiveRefs(directory, prune=True):
+                    unused.append((os.path.getmtime(directory), size, name))
+
+            for mtime, size, name in sorted(unused):
+                if time.time() - mtime < self.idleSeconds and total <= self.maxBytes:
+                    continue
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                total -= size
+                removed.append(name)
+        return removed
+
+
+# =============================================================================
+#
+# The cache of this process
+#
+# =============================================================================
+
+defaultCache = None
+
+
+def configure(root=None, maxBytes=4 * 1024 ** 3, idleSeconds=600.0):
+    """
+    Turns the host cache on for this process, cleaning up after crashed
+    processes on the way.  Entries are let go when the process exits.
+    """
+    global defaultCache
+    if defaultCache is not None:
+        defaultCache.detachAll()
+    defaultCache = AMSHostCache(root, maxBytes, idleSeconds)
+    defaultCache.collect()
+    atexit.register(defaultCache.detachAll)
+    return defaultCache
+
+
+def getDefault():
+    return defaultCache
+
+
+def startCollecting(interval=300.0, callLater=None):
+    """
+    Runs collect() on this process's cache every 'interval' seconds,
+    from the event loop, so that the entries let go of while the server
+    runs are removed, and the cache kept under its size, before the next
+    process starts.
+    """
+    if callLater is None:
+        import AMSJobs
+        callLater = AMSJobs.defaultCallLater()
+
+    def collect():
+        if defaultCache is not None:
+            try:
+                defaultCache.collect()
+            except (IOError, OSError) as e:
+                print("could not clean up the host cache: %s" % e)
+        callLater(interval, collect)
+
+    callLater(interval, collect)
+
+
+def makeVTKDataSet(case, pointArrays=()):
+    """
+    Builds the case's VTK dataset from the host cache, if there is one.
+    """
+    if defaultCache is None:
+        return AMSEnSight.makeVTKDataSet(case, pointArrays)
+    return defaultCache.attach(case).makeVTKDataSet(pointArrays)
+
+
+def addVTKArray(dataset, case, name):
+    if defaultCache is None:
+        AMSEnSight.addVTKArray(dataset, case, name)
+    else:
+        defaultCache.attach(case).addVTKArray(dataset, name)
+
+
+# =============================================================================
+# Main: look at the cache, or clean it up
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clean the host-wide case cache")
+    parser.add_argument("--root", default=defaultRoot(), help="Cache directory")
+    parser.add_argument("--collect", action="store_true", help="Remove dead refs and unused entries")
+    parser.add_argument("--idle", type=float, default=600.0, help="Seconds an unused entry is kept")
+    parser.add_argument("--status", action="store_true", help="List the entries")
+    args = parser.parse_args()
+
+    cache = AMSHostCache(args.root, idleSeconds=args.idle)
+    if args.collect:
+        for name in cache.collect():
+            print("removed " + name)
+    if args.status or not args.collect:
+        for entry in cache.getStatus():
+            print("%-60s %8.1f MB  %d users  idle %.0f s" %
+                  (entry["name"], entry["bytes"] / 1048576.0, len(entry["refs"]), entry["idle"]))
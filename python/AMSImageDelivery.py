@@ -0,0 +1,347 @@
+r"""
+Image delivery with quality tiers.
+
+ParaViewWebPublishImageDelivery sends every frame at one JPEG quality
+and the full size of the view, whether the camera is being dragged or
+the image is standing still.  This one renders smaller, more
+compressed frames while the user interacts, and a full-size frame at
+full quality once the view is idle:
+
+    tier                 JPEG quality   size of the view
+    interactive-low           30             35%
+    interactive-medium        50             50%
+    interactive-high          70             75%
+    still                    100            100%
+
+The interactive tier is picked to fit the link: the client measures
+its round trip and bytes per second when the user starts interacting
+(at most every few seconds) and reports them
+(amsprotocol.image.link.*), and the controller keeps track of how many
+bytes a frame of each tier takes.  It picks the best tier whose frames
+arrive within the frame budget (1 / targetFrameRate), allowing for the
+round trip and the render time.  Before the client has reported
+anything, it uses the middle one.
+
+The view is idle once the mouse button is released, or when nothing
+has happened for idleDelay seconds (or two round trips, if that is
+longer), which catches wheel zooms.  Then every view gets a still frame
+pushed to it.
+
+AMSServer registers AMSImageDelivery and AMSMouseHandler in place of
+ParaView's image delivery and mouse handler; --image-quality N turns
+the tiers off and sends every frame at quality N.  See
+bench/benchImageDelivery.py for bandwidth and frame rate over a
+scripted interaction.
+"""
+
+import time
+
+from paraview.web import protocols as pv_protocols
+from wslink import register as exportRPC
+
+import AMSJobs
+import AMSMetrics
+
+# Best last; the last one is used when the view is idle.
+QUALITY_TIERS = [
+    {"name": "interactive-low", "quality": 30, "ratio": 0.35},
+    {"name": "interactive-medium", "quality": 50, "ratio": 0.5},
+    {"name": "interactive-high", "quality": 70, "ratio": 0.75},
+    {"name": "still", "quality": 100, "ratio": 1.0},
+]
+
+# Rough JPEG sizes in bytes per pixel, by quality, until frames of the
+# tier have been measured.
+BYTES_PER_PIXEL = {30: 0.05, 50: 0.08, 70: 0.12, 100: 0.6}
+
+# Weight of a new measurement in the running averages.
+SMOOTHING = 0.3
+
+# Largest probe the client can ask for.
+MAX_PROBE_BYTES = 1024 * 1024
+
+
+def smooth(average, value):
+    return value if average is None else (1 - SMOOTHING) * average + SMOOTHING * value
+
+
+def frameBytes(reply):
+    """
+    Returns the size of the image in a stillRender() reply.
+    """
+    if reply.get("memsize"):
+        return int(reply["memsize"])
+    image = reply.get("image")
+    if not image:
+        return 0
+    if ";base64" in reply.get("format", ""):
+        return len(image) * 3 // 4
+    return len(image)
+
+
+class AMSQualityController(object):
+    """
+    Decides the quality of the next frame from the interaction state and
+    the link, and keeps the numbers it decides from.
+    """
+    def __init__(self, tiers=QUALITY_TIERS, targetFrameRate=20.0, idleDelay=0.3, fixedQuality=None):
+        if fixedQuality is not None:
+            tiers = [{"name": "fixed", "quality": int(fixedQuality), "ratio": 1.0}]
+        self.tiers = tiers
+        self.still = tiers[-1]
+        self.interactiveTiers = tiers[:-1] or tiers
+        self.adaptive = fixedQuality is None
+        self.targetFrameRate = targetFrameRate
+        self.idleDelay = idleDelay
+
+        # Link, as last reported by the client, and the server's side
+        # of a frame.
+        self.rtt = None
+        self.bytesPerSecond = None
+        self.renderTime = None
+        self.bytesPerPixel = dict((tier["name"], BYTES_PER_PIXEL.get(tier["quality"], 0.5))
+                                  for tier in tiers)
+
+        self.interacting = False
+        self.lastInteraction = 0.0
+        self.interactionStart = None
+
+        # For the stats.
+        self.frames = dict((tier["name"], {"frames": 0, "bytes": 0}) for tier in tiers)
+        self.interactionFrames = 0
+        self.interactionBytes = 0
+        self.interactionSeconds = 0.0
+
+    def setLink(self, rtt=None, bytesPerSecond=None):
+        if rtt is not None and rtt >= 0:
+            self.rtt = smooth(self.rtt, float(rtt))
+        if bytesPerSecond is not None and bytesPerSecond > 0:
+            self.bytesPerSecond = smooth(self.bytesPerSecond, float(bytesPerSecond))
+
+    def getLink(self):
+        return {"rtt": self.rtt, "bytesPerSecond": self.bytesPerSecond}
+
+    def getIdleDelay(self):
+        return max(self.idleDelay, 2 * (self.rtt or 0.0))
+
+    def interact(self, now=None):
+        """
+        Notes user interaction.  Returns True if it starts a new one.
+        """
+        now = time.time() if now is None else now
+        self.lastInteraction = now
+        if self.interacting:
+            return False
+        self.interacting = True
+        self.interactionStart = now
+        return True
+
+    def release(self, now=None):
+        """
+        Ends the interaction.  Returns True if there was one to end.
+        """
+        if not self.interacting:
+            return False
+        now = time.time() if now is None else now
+        self.interacting = False
+        self.interactionSeconds += max(now - self.interactionStart, 0.0)
+        return True
+
+    def isIdle(self, now=None):
+        now = time.time() if now is None else now
+        return now - self.lastInteraction >= self.getIdleDelay()
+
+    def estimateBytes(self, tier, pixels):
+        return self.bytesPerPixel[tier["name"]] * pixels * tier["ratio"] ** 2
+
+    def chooseTier(self, pixels):
+        """
+        Returns the tier for the next frame of a view of 'pixels' pixels.
+        """
+        if not self.interacting:
+            return self.still
+        if not self.adaptive or len(self.interactiveTiers) == 1:
+            return self.interactiveTiers[-1]
+        if self.bytesPerSecond is None:
+            return self.interactiveTiers[len(self.interactiveTiers) // 2]
+
+        # The client asks for the next frame once it has this one, so a
+        # frame costs a round trip and its render on top of the transfer.
+        transferTime = 1.0 / self.targetFrameRate - (self.rtt or 0.0) - (self.renderTime or 0.0)
+        allowed = self.bytesPerSecond * max(transferTime, 0.0)
+        chosen = self.interactiveTiers[0]
+        for tier in self.interactiveTiers:
+            if self.estimateBytes(tier, pixels) <= allowed:
+                chosen = tier
+        return chosen
+
+    def recordFrame(self, tier, nbytes, pixels, seconds):
+        """
+        Notes a frame of 'pixels' pixels (as rendered) that took 'seconds'
+        to render and encode into 'nbytes'.
+        """
+        if pixels > 0 and nbytes > 0:
+            name = tier["name"]
+            self.bytesPerPixel[name] = smooth(self.bytesPerPixel[name], float(nbytes) / pixels)
+        self.renderTime = smooth(self.renderTime, seconds)
+        self.frames[tier["name"]]["frames"] += 1
+        self.frames[tier["name"]]["bytes"] += nbytes
+        if self.interacting:
+            self.interactionFrames += 1
+            self.interactionBytes += nbytes
+
+    def getStats(self):
+        seconds = self.interactionSeconds
+        if self.interacting:
+            seconds += time.time() - self.interactionStart
+        return {
+            "tiers": self.frames,
+            "link": self.getLink(),
+            "renderTime": self.renderTime,
+            "bytesPerPixel": self.bytesPerPixel,
+            "interaction": {
+                "frames": self.interactionFrames,
+                "bytes": self.interactionBytes,
+                "seconds": seconds,
+                "fps": self.interactionFrames / seconds if seconds > 0 else 0.0,
+                "bytesPerSecond": self.interactionBytes / seconds if seconds > 0 else 0.0,
+            },
+        }
+
+
+# =============================================================================
+#
+# Protocols
+#
+# =============================================================================
+
+class AMSImageDelivery(pv_protocols.ParaViewWebPublishImageDelivery):
+    """
+    ParaViewWebPublishImageDelivery with the quality and size of each
+    frame chosen by an AMSQualityController.  Both the pushed frames and
+    the ones asked for go through stillRender().
+    """
+    def __init__(self, decode=False, controller=None, callLater=None):
+        super(AMSImageDelivery, self).__init__(decode=decode)
+        self.controller = controller or AMSQualityController()
+        self.callLater = callLater or AMSJobs.defaultCallLater()
+
+        # View id -> the size the client wants, and the reduced size we
+        # last rendered it at (so we can tell the two apart when the
+        # view comes back at the reduced size).
+        self.fullSizes = {}
+        self.reducedSizes = {}
+        self.idleCheckPending = False
+
+    def stillRender(self, options):
+        options = dict(options or {})
+        view = self.getView(options.get("view", -1))
+        viewId = view.GetGlobalIDAsString()
+
+        size = [int(s) for s in (options.get("size") or view.ViewSize[0:2])]
+        if size != self.reducedSizes.get(viewId):
+            self.fullSizes[viewId] = size
+        fullSize = self.fullSizes[viewId]
+
+        tier = self.controller.chooseTier(fullSize[0] * fullSize[1])
+        renderSize = [max(16, int(s * tier["ratio"])) for s in fullSize]
+        self.reducedSizes[viewId] = renderSize if renderSize != fullSize else None
+        if [int(s) for s in view.ViewSize[0:2]] != renderSize:
+            view.ViewSize = renderSize
+        options["size"] = renderSize
+        options["quality"] = tier["quality"]
+
+        start = time.time()
+        reply = super(AMSImageDelivery, self).stillRender(options)
+        if reply and reply.get("image"):
+            elapsed = time.time() - start
+            self.controller.recordFrame(tier, frameBytes(reply), renderSize[0] * renderSize[1], elapsed)
+            # The frame's render and its encoding, which vtkWebApplication
+            # does in one call.
+            AMSMetrics.observe("ams_stage_seconds", elapsed, stage="image encode", tier=tier["name"])
+            reply["tier"] = tier["name"]
+        return reply
+
+    def onInteraction(self, action):
+        """
+        Called by the mouse handler with the action of each event.
+        """
+        if action == "up":
+            self.goIdle()
+            return
+        self.controller.interact()
+        if not self.idleCheckPending:
+            self.idleCheckPending = True
+            self.callLater(self.controller.getIdleDelay(), self.checkIdle)
+
+    def checkIdle(self):
+        self.idleCheckPending = False
+        if not self.controller.interacting:
+            return
+        if self.controller.isIdle():
+            self.goIdle()
+        else:
+            self.idleCheckPending = True
+            remaining = self.controller.lastInteraction + self.controller.getIdleDelay() - time.time()
+            self.callLater(max(remaining, 0.01), self.checkIdle)
+
+    def goIdle(self):
+        """
+        Ends the interaction and pushes a still frame of every view that
+        was rendered small.
+        """
+        if not self.controller.release():
+            return
+        app = self.getApplication()
+        for viewId, fullSize in self.fullSizes.items():
+            if self.reducedSizes.get(viewId) is None:
+                continue
+            view = self.getView(viewId)
+            view.ViewSize = fullSize
+            app.InvalidateCache(view.SMProxy)
+        app.InvokeEvent('UpdateEvent')
+
+    @exportRPC("amsprotocol.image.link.ping")
+    def pingLink(self):
+        return time.time()
+
+    @exportRPC("amsprotocol.image.link.probe")
+    def probeLink(self, size):
+        """
+        Returns 'size' bytes, for the client to time.
+        """
+        return "0" * max(0, min(int(size), MAX_PROBE_BYTES))
+
+    @exportRPC("amsprotocol.image.link.report")
+    def reportLink(self, link):
+        self.controller.setLink(link.get("rtt"), link.get("bytesPerSecond"))
+        return self.controller.getLink()
+
+    @exportRPC("amsprotocol.image.stats")
+    def getImageStats(self):
+        return self.controller.getStats()
+
+
+class AMSMouseHandler(pv_protocols.ParaViewWebMouseHandler):
+    """
+    ParaView's mouse handler, telling the image delivery when the user
+    is interacting.
+    """
+    def __init__(self, delivery):
+        super(AMSMouseHandler, self).__init__()
+        self.delivery = delivery
+
+    @exportRPC("viewport.mouse.interaction")
+    def mouseInteraction(self, event):
+        self.delivery.onInteraction(event.get("action"))
+        return super(AMSMouseHandler, self).mouseInteraction(event)
+
+    # Wheel zooms come separately in the ParaView versions that have them.
+    if hasattr(pv_protocols.ParaViewWebMouseHandler, "updateZoomFromWheel"):
+        @exportRPC("viewport.mouse.zoom.wheel")
+        def updateZoomFromWheel(self, event):
+            self.delivery.onInteraction("up" if "End" in event.get("type", "") else "move")
+            return super(AMSMouseHandler, self).updateZoomFromWheel(event)
+
+
+AMSMetrics.instrumentRPCs(AMSImageDelivery)
@@ -0,0 +1,261 @@
+r"""
+A job scheduler that takes pipeline work off the RPC path.
+
+ParaView proxies and VTK pipelines can only be touched from the main
+thread, so we don't run jobs on other threads.  Instead, a job is a
+generator that does its work in steps and yields (progress, message)
+between them (or (progress, message, True) when it has an image to
+show, e.g. a preview).  The scheduler runs one step at a time from the event loop
+(the same one that serves the websocket), so an RPC can hand back a job
+id right away, and mouse interaction and other RPCs get served between
+the steps of a long streamline run.
+
+    >>> def work():
+    ...     contour.UpdatePipeline()
+    ...     yield 0.5, "contoured"
+    ...     simple.Render()
+    ...     yield 1.0, "rendered"
+    >>> job = scheduler.submit("executePlot", work)
+    >>> job.id
+    7
+
+Every change of a job's state is reported to the listener, which the
+protocol uses to publish progress and completion events to the client.
+
+Jobs may be submitted with a target.  A new job for a target supersedes
+the ones for the same target that are still queued or running: they are
+dropped, and only the latest one gets computed.  That way dragging a
+slider across 50 values costs one or two pipeline runs, not 50.
+"""
+
+import time, inspect, traceback, collections
+
+# Job states.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# =============================================================================
+
+def defaultCallLater():
+    """
+    Returns a callLater(delay, function, *args) that runs the function
+    from the web server's event loop.
+    """
+    try:
+        from twisted.internet import reactor
+        return reactor.callLater
+    except ImportError:
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return lambda delay, function, *args: loop.call_later(delay, function, *args)
+
+
+class AMSJob(object):
+    """
+    One unit of pipeline work and its state.
+    """
+    def __init__(self, jobId, name, work, target=None):
+        self.id = jobId
+        self.name = name
+        self.work = work
+        self.target = target
+        self.supersededBy = None
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.steps = None
+
+        # Set by a step that yields (progress, message, True): there is an
+        # image (e.g. a preview) worth showing before the job is done.
+        self.imageReady = False
+        self.firstImage = None
+
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def isFinished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def toDict(self):
+        """
+        The job as the client sees it.
+        """
+        now = self.finished or time.time()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "target": self.target,
+            "supersededBy": self.supersededBy,
+            "imageReady": self.imageReady,
+            "firstImage": self.firstImage,
+            "queued": (self.started or now) - self.submitted,
+            "elapsed": now - self.started if self.started else 0.0,
+        }
+
+
+class AMSJobScheduler(object):
+    """
+    Runs jobs one at a time, in submission order, one step per turn of
+    the event loop.
+    """
+    def __init__(self, listener=None, callLater=None, historySize=100):
+        self.listener = listener
+        self.callLater = callLater or defaultCallLater()
+        self.queue = collections.deque()
+        self.current = None
+        self.jobs = collections.OrderedDict()   # id -> job, most recent last
+        self.historySize = historySize
+        self.nextId = 1
+        self.scheduled = False
+
+        # target -> {"served": jobs completed, "dropped": jobs superseded}
+        self.targetStats = {}
+
+    def submit(self, name, work, target=None):
+        """
+        Queues a job.  'work' is called with no arguments when the job
+        starts, and may return a generator of (progress, message) steps.
+        If a target is given, the older jobs for the same target that
+        haven't finished are dropped.
+        """
+        job = AMSJob(self.nextId, name, work, target)
+        self.nextId += 1
+
+        if target is not None:
+            stats = self.targetStats.setdefault(target, {"served": 0, "dropped": 0})
+            for older in list(self.queue) + [self.current]:
+                if older is not None and older.target == target:
+                    older.supersededBy = job.id
+                    self.cancel(older)
+                    stats["dropped"] += 1
+
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.historySize:
+            self.jobs.popitem(last=False)
+
+        self.queue.append(job)
+        self.notify(job)
+        self.schedule()
+        return job
+
+    def getJob(self, jobId):
+        return self.jobs.get(jobId)
+
+    def cancel(self, job):
+        """
+        Cancels a queued job, or stops a running one before its next step.
+        """
+        if job.isFinished():
+            return
+        if job in self.queue:
+            self.queue.remove(job)
+        elif job is self.current:
+            self.current = None
+            if job.steps is not None:
+                job.steps.close()
+        self.finish(job, CANCELLED)
+
+    def cancelAll(self):
+        for job in list(self.queue) + [self.current]:
+            if job is not None:
+                self.cancel(job)
+
+    def schedule(self):
+        if not self.scheduled and (self.current is not None or self.queue):
+            self.scheduled = True
+            self.callLater(0, self.step)
+
+    def step(self):
+        """
+        Runs one step of the current job (starting the next one if there
+        is none), then gives the event loop back.
+        """
+        self.scheduled = False
+        self.runStep()
+        self.schedule()
+
+    def runStep(self):
+        if self.current is None:
+            if not self.queue:
+                return
+            job = self.current = self.queue.popleft()
+            job.state = RUNNING
+            job.started = time.time()
+            self.notify(job)
+            try:
+                result = job.work()
+            except Exception:
+                self.fail(job)
+                return
+            if inspect.isgenerator(result):
+                job.steps = result
+            else:
+                self.current = None
+                self.finish(job, DONE)
+            return
+
+        job = self.current
+        try:
+            step = next(job.steps)
+            job.progress, job.message = step[:2]
+            job.imageReady = len(step) > 2 and bool(step[2])
+            if job.imageReady and job.firstImage is None:
+                job.firstImage = time.time() - job.submitted
+        except StopIteration:
+            self.current = None
+            self.finish(job, DONE)
+            return
+        except Exception:
+            self.fail(job)
+            return
+        self.notify(job)
+
+    def fail(self, job):
+        traceback.print_exc()
+        job.error = traceback.format_exc().strip().splitlines()[-1]
+        if job is self.current:
+            self.current = None
+        self.finish(job, FAILED)
+
+    def finish(self, job, state):
+        job.state = state
+        job.finished = time.time()
+        if state == DONE:
+            job.progress = 1.0
+            job.imageReady = True
+            if job.firstImage is None:
+                job.firstImage = job.finished - job.submitted
+            if job.target is not None:
+                self.targetStats[job.target]["served"] += 1
+        job.steps = None
+        self.notify(job)
+
+    def drain(self):
+        """
+        Runs everything that's queued to completion, right now.  For
+        scripts and benchmarks that have no event loop.
+        """
+        while self.current is not None or self.queue:
+            self.runStep()
+
+    def notify(self, job):
+        if self.listener is not None:
+            self.listener(job)
+
+    def getStats(self):
+        """
+        Returns the number of jobs served and dropped for each target.
+        """
+        return dict((target, dict(stats)) for target, stats in self.targetStats.items())
+
+    def isIdle(self):
+        return self.current is None and not self.queue
@@ -0,0 +1,386 @@
+r"""
+A session broker that keeps a pool of AMS servers warm.
+
+Starting AMSServer.py for a new browser session means importing
+ParaView, reading the data config and opening the first case, which
+takes seconds before the first frame.  The launcher starts a number of
+servers ahead of time, each on its own port with its own secret, and
+hands one to every session that asks.  The pool is refilled in the
+background as servers are handed out, and each server exits when its
+session ends (wslink's --timeout).  That timeout runs from when a
+server starts listening, so the servers nobody has claimed are
+replaced, one at a time, before they reach it.
+
+The client asks for a session the way wslink's SmartConnect does, with
+a POST to the launcher; the answer has the server's sessionURL and
+secret:
+
+    $ python AMSLauncher.py --port 9000 --pool-size 3 \
+          --server-args "--dataConfigFile files.json --prewarm"
+
+    POST /paraview                 -> {"id", "sessionURL", "secret", "queueWait"}
+    POST /paraview/<id>/metrics    <- {"firstImage": seconds}, from the client
+    GET  /stats                    -> pool size, queue wait, time to first image
+
+Queue wait is how long a session waited for a ready server; time to
+first image is measured by the client from its request to the first
+frame.
+"""
+
+import os, json, time, socket, random, shlex, threading, subprocess, collections
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AMSServer.py")
+
+# =============================================================================
+
+def summarize(values):
+    """
+    Returns count, mean, p50, p95 and max of a list of seconds.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "max": ordered[-1],
+    }
+
+
+def isListening(host, port):
+    try:
+        connection = socket.create_connection((host, port), 0.2)
+    except (socket.error, socket.timeout):
+        return False
+    connection.close()
+    return True
+
+
+class AMSServerProcess(object):
+    """
+    One AMS server: its port, secret and process, and when things
+    happened to it.
+    """
+    def __init__(self, command, host, port):
+        self.host = host
+        self.port = port
+        self.secret = "%032x" % random.getrandbits(128)
+        self.id = "%s-%d" % (self.secret[:8], port)
+        self.process = subprocess.Popen(command + ["--port", str(port), "--authKey", self.secret])
+
+        self.started = time.time()
+        self.ready = None           # when it started accepting connections
+        self.assigned = None        # when it was handed to a session
+
+    def isReady(self):
+        if self.ready is None and self.isRunning() and isListening(self.host, self.port):
+            self.ready = time.time()
+        return self.ready is not None
+
+    def isRunning(self):
+        return self.process.poll() is None
+
+    def getSessionURL(self, publicHost):
+        return "ws://%s:%d/ws" % (publicHost, self.port)
+
+    def stop(self):
+        if self.isRunning():
+            self.process.terminate()
+
+
+class AMSServerPool(object):
+    """
+    Keeps 'size' servers started or ready to go, and hands them out.
+    """
+    def __init__(self, command, size=2, host="localhost", ports=(9100, 9200), checkInterval=0.2,
+                 maxIdle=None):
+        self.command = command
+        self.size = size
+        self.host = host
+        self.ports = ports
+        self.checkInterval = checkInterval
+        # Seconds a ready server is kept unclaimed before it is replaced
+        # (see recycle()), or None to keep it until it exits.
+        self.maxIdle = maxIdle
+
+        self.starting = []                  # started, not accepting connections yet
+        self.ready = collections.deque()    # waiting for a session
+        self.assigned = {}                  # id -> server handed to a session
+        self.condition = threading.Condition()
+        self.running = True
+
+        # Why the last refill() couldn't start a server (no free port),
+        # or None.
+        self.refillError = None
+        self.recycleError = None
+
+        # Seconds, for the stats.
+        self.startupTimes = []
+        self.queueWaits = []
+        self.firstImages = []
+        self.sessions = 0
+        self.recycled = 0
+
+        self.thread = threading.Thread(target=self.monitor, name="server pool")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def getFreePort(self):
+        used = set(server.port for server in self.starting + list(self.ready) + list(self.assigned.values()))
+        for port in range(self.ports[0], self.ports[1]):
+            if port not in used and not isListening(self.host, port):
+                return port
+        raise RuntimeError("No free port in %d-%d" % self.ports)
+
+    def refill(self):
+        """
+        Starts servers until there are 'size' of them not yet handed
+        out.  Called with the condition held.  If there is no free port
+        (or the command fails) it starts what it can; the monitor tries
+        again on its next round.
+        """
+        try:
+            while len(self.starting) + len(self.ready) < self.size:
+                self.starting.append(AMSServerProcess(self.command, self.host, self.getFreePort()))
+        except (RuntimeError, OSError) as e:
+            # Out of ports, or the command can't be run.
+            if self.refillError is None:
+                print("could not refill the server pool: %s" % e)
+            self.refillError = str(e)
+        else:
+            if self.refillError is not None:
+                print("server pool refilled")
+            self.refillError = None
+
+    def recycle(self):
+        """
+        Replaces the oldest ready server once it has waited 'maxIdle'
+        seconds: a spare is started, and the old server stopped once the
+        spare is ready.  One at a time, so the pool never runs out of
+        ready servers on the way, as it would if the servers started
+        together all reached their timeout together.  Called with the
+        condition held.
+        """
+        if self.maxIdle is None or not self.ready or self.starting:
+            return
+        if time.time() - self.ready[0].ready < self.maxIdle:
+            return
+        if len(self.ready) > self.size:
+            self.ready.popleft().stop()
+            self.recycled += 1
+            return
+        try:
+            self.starting.append(AMSServerProcess(self.command, self.host, self.getFreePort()))
+        except (RuntimeError, OSError) as e:
+            # Tried again on the next round.
+            if self.recycleError != str(e):
+                print("could not start a spare server: %s" % e)
+            self.recycleError = str(e)
+        else:
+            self.recycleError = None
+
+    def monitor(self):
+        """
+        Moves servers from starting to ready, forgets the ones that
+        exited, and refills the pool.
+        """
+        while self.running:
+            with self.condition:
+                for server in list(self.starting):
+                    if server.isReady():
+                        self.starting.remove(server)
+                        self.ready.append(server)
+                        self.startupTimes.append(server.ready - server.started)
+                        self.condition.notify_all()
+                    elif not server.isRunning():
+                        print("server on port %d exited during startup" % server.port)
+                        self.starting.remove(server)
+                for server in list(self.ready):
+                    if not server.isRunning():
+                        self.ready.remove(server)
+                for sessionId, server in list(self.assigned.items()):
+                    if not server.isRunning():
+                        del self.assigned[sessionId]
+                self.refill()
+                self.recycle()
+            time.sleep(self.checkInterval)
+
+    def acquire(self, timeout=60.0):
+        """
+        Returns a ready server for a new session, waiting for one if
+        need be, or None after 'timeout' seconds, or right away if none
+        is starting and none can be started.
+        """
+        requested = time.time()
+        with self.condition:
+            while not self.ready:
+                remaining = timeout - (time.time() - requested)
+                if remaining <= 0:
+                    return None
+                if not self.starting:
+                    self.refill()
+                    if not self.starting:
+                        return None
+                self.condition.wait(min(remaining, self.checkInterval))
+            server = self.ready.popleft()
+            server.assigned = time.time()
+            server.queueWait = server.assigned - requested
+            self.assigned[server.id] = server
+            self.queueWaits.append(server.queueWait)
+            self.sessions += 1
+            self.refill()
+        return server
+
+    def recordFirstImage(self, sessionId, seconds):
+        with self.condition:
+            if sessionId in self.assigned:
+                self.firstImages.append(float(seconds))
+                return True
+        return False
+
+    def getStats(self):
+        with self.condition:
+            return {
+                "poolSize": self.size,
+                "ready": len(self.ready),
+                "starting": len(self.starting),
+                "sessions": self.sessions,
+                "recycled": self.recycled,
+                "active": len(self.assigned),
+                "serverStartup": summarize(self.startupTimes),
+                "queueWait": summarize(self.queueWaits),
+                "timeToFirstImage": summarize(self.firstImages),
+            }
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            for server in self.starting + list(self.ready) + list(self.assigned.values()):
+                server.stop()
+
+
+# =============================================================================
+#
+# HTTP interface
+#
+# =============================================================================
+
+class AMSLauncherHandler(BaseHTTPRequestHandler):
+
+    # Set by makeServer().
+    pool = None
+    publicHost = "localhost"
+    timeout = 60.0
+
+    def sendJSON(self, code, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def readJSON(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            return {}
+
+    def do_OPTIONS(self):
+        # CORS preflight: the client is served from another port.
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_POST(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ["paraview"]:
+            self.readJSON()
+            server = self.pool.acquire(self.timeout)
+            if server is None:
+                self.sendJSON(503, {"error": self.pool.refillError or "no server became ready in time"})
+                return
+            self.sendJSON(200, {
+                "id": server.id,
+                "sessionURL": server.getSessionURL(self.publicHost),
+                "secret": server.secret,
+                "queueWait": server.queueWait,
+            })
+        elif len(parts) == 3 and parts[0] == "paraview" and parts[2] == "metrics":
+            metrics = self.readJSON()
+            recorded = "firstImage" in metrics and self.pool.recordFirstImage(parts[1], metrics["firstImage"])
+            self.sendJSON(200 if recorded else 404, {"recorded": bool(recorded)})
+        else:
+            self.sendJSON(404, {"error": "unknown path " + self.path})
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") == "/stats":
+            self.sendJSON(200, self.pool.getStats())
+        else:
+            self.sendJSON(404, {"error": "unknown path " + self.path})
+
+
+class AMSLauncherServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def makeServer(pool, port, publicHost="localhost", timeout=60.0):
+    handler = type("Handler", (AMSLauncherHandler,),
+                   {"pool": pool, "publicHost": publicHost, "timeout": timeout})
+    return AMSLauncherServer(("", port), handler)
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Keep a pool of AMS servers and hand them to sessions")
+    parser.add_argument("--port", type=int, default=9000, help="Port of the launcher")
+    parser.add_argument("--host", default="localhost", help="Host name the clients use to reach the servers")
+    parser.add_argument("--pool-size", type=int, default=2, dest="poolSize",
+                        help="Number of servers kept ready (or starting)")
+    parser.add_argument("--server-ports", default="9100-9200", dest="serverPorts",
+                        help="Port range for the servers")
+    parser.add_argument("--pvpython", default="pvpython", help="Interpreter for AMSServer.py")
+    parser.add_argument("--server-args", default="", dest="serverArgs",
+                        help="More arguments for AMSServer.py, e.g. '--dataConfigFile files.json --prewarm'")
+    parser.add_argument("--session-timeout", type=int, default=300, dest="sessionTimeout",
+                        help="Seconds a server waits without clients before it exits")
+    parser.add_argument("--wait", type=float, default=60.0,
+                        help="Seconds a session request waits for a server")
+    args = parser.parse_args()
+
+    low, high = [int(p) for p in args.serverPorts.split("-")]
+    command = [args.pvpython, SERVER_SCRIPT, "--timeout", str(args.sessionTimeout)] + shlex.split(args.serverArgs)
+
+    # Unclaimed servers are replaced halfway to their timeout, so a
+    # session always has the other half to connect.
+    pool = AMSServerPool(command, args.poolSize, args.host, (low, high), maxIdle=args.sessionTimeout / 2.0)
+    httpServer = makeServer(pool, args.port, args.host, args.wait)
+    print("launcher on port %d, keeping %d servers warm" % (args.port, args.poolSize))
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
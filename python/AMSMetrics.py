@@ -0,0 +1,319 @@
+r"""
+Latency histograms, gauges and counters for the server, cheap enough to
+leave on.
+
+    import AMSMetrics
+
+    with AMSMetrics.timed("ams_stage_seconds", stage="contour", engine="vtk"):
+        contour.UpdatePipeline()
+
+    AMSMetrics.observe("ams_rpc_seconds", elapsed, rpc="amsprotocol.execute.plot")
+    AMSMetrics.instrumentRPCs(AMSTest)      # every amsprotocol.* RPC of the class
+
+What is recorded:
+
+    ams_rpc_seconds{rpc}            time in each amsprotocol.* RPC
+    ams_rpc_errors_total{rpc}       RPCs that raised
+    ams_job_seconds{job,state}      jobs, from start to finish
+    ams_job_queue_seconds{job}      jobs, from submission to start
+    ams_stage_seconds{stage,...}    pipeline stages: open, reader update,
+                                    contour, streamTracer, ribbon, view
+                                    update, render, image encode
+
+and, whenever a snapshot is taken, whatever the registered collectors
+report: memory per data object, cache hits and misses, hit rates.
+
+A histogram keeps counts in fixed buckets (as Prometheus does), so an
+observation is a bisect and an increment under a lock.  Percentiles
+are read from the buckets, so they are as fine as the buckets are.
+
+The snapshot goes out through the amsprotocol.metrics.get RPC, and the
+server can also write it in Prometheus' text format to a file every
+few seconds (AMSServer.py --metrics-file), for node_exporter's textfile
+collector or anything else that reads it.
+"""
+
+import os, time, bisect, functools, threading, traceback
+
+# Upper bounds of the buckets, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+class AMSHistogram(object):
+    """
+    Counts of observations by bucket, with their sum and maximum.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        The upper bound of the bucket the p-th percentile falls in (the
+        largest value seen, for the last bucket).
+        """
+        if self.count == 0:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def getStats(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+class AMSMetrics(object):
+    """
+    The registry: histograms and counters by name and labels, and
+    collectors that report gauges when asked.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}        # name -> {label key: AMSHistogram}
+        self.counters = {}          # name -> {label key: count}
+        self.collectors = []        # functions returning [(name, labels, value)]
+        self.started = time.time()
+
+    def observe(self, name, seconds, **labels):
+        key = labelKey(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = AMSHistogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        key = labelKey(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def addCollector(self, collector):
+        """
+        Adds a function returning a list of (name, labels, value) gauges,
+        called for every snapshot.
+        """
+        self.collectors.append(collector)
+
+    def collectGauges(self):
+        gauges = []
+        for collector in self.collectors:
+            try:
+                gauges.extend(collector())
+            except Exception:
+                # A broken collector shouldn't take the metrics with it.
+                traceback.print_exc()
+        return gauges
+
+    def getSnapshot(self):
+        """
+        Everything, as a dict for the RPC.
+        """
+        with self.lock:
+            histograms = dict((name, [dict(labels=dict(key), **histogram.getStats())
+                                      for key, histogram in sorted(series.items())])
+                              for name, series in self.histograms.items())
+            counters = dict((name, [{"labels": dict(key), "value": value}
+                                    for key, value in sorted(series.items())])
+                            for name, series in self.counters.items())
+        gauges = {}
+        for name, labels, value in self.collectGauges():
+            gauges.setdefault(name, []).append({"labels": labels, "value": value})
+        return {
+            "uptime": time.time() - self.started,
+            "histograms": histograms,
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def toPrometheus(self):
+        """
+        Everything, in Prometheus' text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.histograms.keys()):
+                lines.append("# TYPE %s histogram" % name)
+                for key, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append("%s_bucket%s %d" % (name, formatLabels(key + (("le", le),)), cumulative))
+                    lines.append("%s_sum%s %r" % (name, formatLabels(key), histogram.sum))
+                    lines.append("%s_count%s %d" % (name, formatLabels(key), histogram.count))
+            for name in sorted(self.counters.keys()):
+                lines.append("# TYPE %s counter" % name)
+                for key, value in sorted(self.counters[name].items()):
+                    lines.append("%s%s %d" % (name, formatLabels(key), value))
+
+        typed = set()
+        for name, labels, value in sorted(self.collectGauges(), key=lambda gauge: gauge[0]):
+            if name not in typed:
+                lines.append("# TYPE %s gauge" % name)
+                typed.add(name)
+            lines.append("%s%s %r" % (name, formatLabels(labelKey(labels)), float(value)))
+        return "\n".join(lines) + "\n"
+
+    def dumpPrometheus(self, fileName):
+        """
+        Writes the Prometheus text to 'fileName', replacing it in one go
+        so readers never see half a file.
+        """
+        temporary = "%s.%d.tmp" % (fileName, os.getpid())
+        with open(temporary, "w") as fp:
+            fp.write(self.toPrometheus())
+        os.rename(temporary, fileName)
+
+
+def formatLabels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in key) + "}"
+
+
+# =============================================================================
+#
+# The server's registry, and shortcuts to it
+#
+# =============================================================================
+
+registry = AMSMetrics()
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+def increment(name, amount=1, **labels):
+    registry.increment(name, amount, **labels)
+
+
+def addCollector(collector):
+    registry.addCollector(collector)
+
+
+class timed(object):
+    """
+    Context manager that observes the time spent in it.
+    """
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
+        registry.observe(self.name, self.elapsed, **self.labels)
+
+
+def timeStage(stage, **labels):
+    """
+    timed() for a pipeline stage.
+    """
+    labels["stage"] = stage
+    return timed("ams_stage_seconds", **labels)
+
+
+def residentMemory():
+    """
+    The resident set size of this process in bytes (None where there is
+    no /proc).
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def processGauges():
+    gauges = [("ams_uptime_seconds", {}, time.time() - registry.started)]
+    resident = residentMemory()
+    if resident is not None:
+        gauges.append(("ams_process_resident_bytes", {}, resident))
+    return gauges
+
+registry.addCollector(processGauges)
+
+
+def startDumping(fileName, interval=15.0, callLater=None):
+    """
+    Writes the Prometheus text to 'fileName' every 'interval' seconds,
+    from the event loop.
+    """
+    if callLater is None:
+        import AMSJobs
+        callLater = AMSJobs.defaultCallLater()
+
+    def dump():
+        try:
+            registry.dumpPrometheus(fileName)
+        except (IOError, OSError) as e:
+            print("could not write metrics to %s: %s" % (fileName, e))
+        callLater(interval, dump)
+
+    callLater(interval, dump)
+
+
+def instrumentRPCs(cls, prefix="amsprotocol."):
+    """
+    Wraps the RPC methods of a protocol class whose names start with
+    'prefix' so that their time and errors are recorded.  The wrappers
+    keep the wslink registration of the methods.
+    """
+    for attribute, method in list(vars(cls).items()):
+        uris = [entry["uri"] for entry in getattr(method, "_wslinkuris", [])]
+        uris = [uri for uri in uris if uri.startswith(prefix)]
+        if uris:
+            setattr(cls, attribute, timeRPC(method, uris[0]))
+    return cls
+
+
+def timeRPC(method, uri):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            registry.increment("ams_rpc_errors_total", rpc=uri)
+            raise
+        finally:
+            registry.observe("ams_rpc_seconds", time.time() - start, rpc=uri)
+    return wrapper
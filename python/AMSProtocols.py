@@ -116,10 +116,35 @@ def simpleColorBy(rep=None, value=None):
 
 from AMS2Protocols import *
 
+import AMSBatch
+import AMSCatalog
+import AMSDifference
+import AMSJobs
+import AMSMetrics
+import AMSScene
+import AMSTrace
+
 
 class AMSTest(pv_protocols.ParaViewWebProtocol):
 
-    def __init__(self, config, profile):
+    # Clients subscribe to this topic to hear about the jobs.
+    JOB_TOPIC = "amsprotocol.job.event"
+
+    # The coalescing target of the jobs that (re)draw the current plot.
+    PLOT_TARGET = "plot"
+
+    # Clients subscribe to this topic to hear that the scene changed.
+    SCENE_TOPIC = "amsprotocol.scene.event"
+
+    # Clients subscribe to this topic to hear that the cases that were
+    # still being indexed when they got the catalog are done, and ask
+    # for the catalog again.
+    CATALOG_TOPIC = "amsprotocol.catalog.event"
+
+    # Seconds between the checks for the end of the indexing.
+    INDEXING_POLL_SECONDS = 1.0
+
+    def __init__(self, config, profile, callLater=None, batchRoot="batches"):
         super(AMSTest, self).__init__()
         self.context = None
         self.extractBlocks = None
@@ -135,17 +160,53 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
         # them, and so on.
         self.dataCatalog = {}
 
+        # Variable ranges and other per-case metadata, kept in sidecar
+        # files so they're computed once per case, not once per request.
+        self.catalogIndex = AMSCatalog.AMSCatalogIndex()
+
+        # Catalog entries the clients got without their metadata, which
+        # watchIndexing() is waiting for.
+        self.indexingNames = set()
+
         
-        self.dataObjects = AMSDataObjectCollection()
+        # Data objects are opened when they are first used; see
+        # initializeData().
+        self.dataObjects = AMSDataObjectCollection(onMaterialize=self.onMaterialize)
+        self.standardViewTaken = False
         self.plotCookBook = AMSCookBook()
-        self.currentPlot = AMSPlot(None, None)
+        self.currentPlot = AMSPlot(None, None, self.dataObjects.pipelines)
+        # The (data, recipe) of the last execute.plot, until its job
+        # starts drawing it; see changeSurface().
+        self.pendingPlot = None
 
         self.toggle = True
         self.data0on = True
         self.data1on = False
 
-        # A time stamp to keep from overloading the server.
-        self.lastTime = 0  
+        # The pipeline work of the plot RPCs runs as jobs, a step at a
+        # time, from the event loop.  The RPCs return the job id right
+        # away and the client hears about progress on JOB_TOPIC.  The
+        # parameter RPCs submit their jobs for PLOT_TARGET, so that a
+        # new value drops the ones that haven't been computed yet; that
+        # is what keeps the sliders from overloading the server.
+        # 'callLater' is the event loop's (see AMSJobs.defaultCallLater);
+        # bench/benchReplay.py passes its own.
+        self.jobs = AMSJobs.AMSJobScheduler(listener=self.onJobEvent, callLater=callLater)
+
+        # Frames go out when the scene changes, not when the clients
+        # poll.  What changes the pipeline marks the scene dirty; the
+        # camera is watched once there is a view (see watchScene()).
+        self.scene = AMSScene.AMSSceneState(lambda event: self.publish(self.SCENE_TOPIC, event),
+                                            callLater=callLater)
+
+        # Memory and cache numbers for the metrics snapshots.
+        AMSMetrics.addCollector(self.collectMetrics)
+
+        # id -> AMSBatchRun, for the batch RPCs.  The batches render in
+        # their own processes; the client polls for their status.  Their
+        # images go under 'batchRoot', wherever the client asks.
+        self.batches = {}
+        self.batchRoot = os.path.abspath(batchRoot)
 
         self.debug = True
         
@@ -156,21 +217,159 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
             functionName = traceback.extract_stack(None, 2)[0][2]
             print("calling " + functionName + " for " + self.name)
 
-    def initializeData(self, inputDataCatalog):
+    def initializeData(self, inputDataCatalog, workers=1):
         """
-        Initialize data from the data catalog.  Show the first one, hide
-        the rest.
+        Initialize data from the data catalog.  Nothing is opened here:
+        the collection gets a placeholder per entry, and a case is opened
+        when it's first used, so this takes the same time however big the
+        catalog is.  The first case is read ahead on a worker thread
+        (one of 'workers'; 0 turns reading ahead off), and after that
+        whichever case is likely to be next.
         """
-        i = 0
+        start = time.time()
+
+        # Start indexing the cases we haven't seen (or that changed) in
+        # the background, for getDataCatalog().  Differences have no
+        # files of their own.
+        self.catalogIndex.warm([inputDataCatalog[entry]["fileName"]
+                                for entry in inputDataCatalog.keys()
+                                if "difference" not in inputDataCatalog[entry]])
+
+        self.dataCatalog = inputDataCatalog
+        self.dataObjects.workers = workers
         for entry in inputDataCatalog.keys():
-            self.addObject(entry, AMSDataObject(inputDataCatalog[entry]))
+            self.dataObjects.addEntry(entry, inputDataCatalog[entry])
+        self.dataObjects.prefetch(self.dataObjects.getNextLikely())
+
+        print("data catalog ready in %.3f s (%d cases)" % (time.time() - start, len(inputDataCatalog)))
+
+    def onMaterialize(self, name, dataObject):
+        """
+        Called when a data object is opened.  The first one sets up the
+        camera, like the old eager startup did.
+        """
+        if not self.standardViewTaken:
+            dataObject.takeStandardView()
+            self.standardViewTaken = True
 
-            if i == 0:
-                self.dataObjects[0].show()
-                self.dataObjects[0].takeStandardView()
-                i += 1
-            else:
-                self.dataObjects[1].hide()
+    def watchScene(self, view):
+        """
+        Starts tracking the changes of the view's camera, and of the frames
+        pushed to the clients.  Called by the server once the view is set
+        up.
+        """
+        self.scene.watch(self.getApplication(), view)
+
+    def onJobEvent(self, job):
+        """
+        Tells the clients about a job's progress, and pushes the view once
+        it has finished or has something to show.  That is pushed right
+        away, before the next step of the job changes it again.
+        """
+        if job.isFinished() or job.imageReady:
+            self.scene.markDirty(job.name)
+            self.scene.flush()
+        if job.isFinished() and job.started is not None:
+            AMSMetrics.observe("ams_job_seconds", job.finished - job.started, job=job.name, state=job.state)
+            AMSMetrics.observe("ams_job_queue_seconds", job.started - job.submitted, job=job.name)
+        self.publish(self.JOB_TOPIC, job.toDict())
+
+    def collectMetrics(self):
+        """
+        Gauges for AMSMetrics: the memory of each open data object, the
+        hit rates of the caches, and what the transactions avoided.
+        """
+        gauges = []
+        for name in self.dataObjects.keys():
+            if self.dataObjects.isMaterialized(name):
+                usage = self.dataObjects.getEntry(name).getMemoryUsage()
+                for part in sorted(usage.keys()):
+                    gauges.append(("ams_data_object_bytes", {"data": name, "part": part}, usage[part]))
+
+        for cache, stats in (("pipelines", self.dataObjects.pipelines.getStats()),
+                             ("surfaces", self.dataObjects.surfaces.getStats())):
+            lookups = stats["hits"] + stats["misses"]
+            labels = {"cache": cache}
+            gauges.append(("ams_cache_hits", labels, stats["hits"]))
+            gauges.append(("ams_cache_misses", labels, stats["misses"]))
+            gauges.append(("ams_cache_evictions", labels, stats["evictions"]))
+            gauges.append(("ams_cache_entries", labels, stats["entries"]))
+            gauges.append(("ams_cache_hit_ratio", labels, float(stats["hits"]) / lookups if lookups else 0.0))
+            if "bytes" in stats:
+                gauges.append(("ams_cache_bytes", labels, stats["bytes"]))
+
+        transactions = self.dataObjects.transactions.getStats()
+        for event in sorted(transactions.keys()):
+            gauges.append(("ams_transaction_events", {"event": event}, transactions[event]))
+        return gauges
+
+    def getIndexedFiles(self, name):
+        """
+        Returns the case files whose metadata an entry's is made from: its
+        own, or a difference's two cases'.
+        """
+        caseFiles = self.dataObjects.getCaseFiles(name)
+        if caseFiles is None:
+            return [self.dataObjects.getEntry(name).getDataFile()]
+        return caseFiles
+
+    def getMetadata(self, name):
+        """
+        Returns the catalog metadata of an entry, or None if it isn't
+        indexed yet (the indexing is started, not waited for).  A
+        difference's is made from its two cases' (see
+        AMSDifference.differenceMetadata).
+        """
+        try:
+            caseFiles = self.getIndexedFiles(name)
+        except (KeyError, ValueError):
+            return None
+        metadata = [self.catalogIndex.get(caseFile, wait=False) for caseFile in caseFiles]
+        if None in metadata:
+            return None
+        if len(metadata) == 1:
+            return metadata[0]
+        return AMSDifference.differenceMetadata(*metadata)
+
+    def isIndexing(self, name):
+        try:
+            return any(self.catalogIndex.isRebuilding(caseFile) for caseFile in self.getIndexedFiles(name))
+        except (KeyError, ValueError):
+            return False
+
+    def watchIndexing(self, name):
+        """
+        Waits for an entry's cases to be indexed, checking every
+        INDEXING_POLL_SECONDS, then tells the clients on CATALOG_TOPIC
+        which entries are ready.  A case whose indexing failed is dropped
+        without telling them, so they don't ask again for nothing.
+        """
+        if not self.indexingNames:
+            self.jobs.callLater(self.INDEXING_POLL_SECONDS, self.checkIndexing)
+        self.indexingNames.add(name)
+
+    def checkIndexing(self):
+        if any(self.isIndexing(name) for name in self.indexingNames):
+            self.jobs.callLater(self.INDEXING_POLL_SECONDS, self.checkIndexing)
+            return
+        ready = sorted(name for name in self.indexingNames if self.getMetadata(name) is not None)
+        self.indexingNames = set()
+        if ready:
+            self.publish(self.CATALOG_TOPIC, {"ready": ready})
+
+    def runPlot(self, plot):
+        """
+        The steps of a plot job.  The plot becomes the current one when
+        the job starts.  A newer plot request cancels the job, and with
+        it the refinement of a progressive plot.  The data is refreshed
+        first, since the slider moves re-draw a plot without plotData().
+        """
+        if plot.dataObject is not None:
+            self.dataObjects.refreshData(plot.dataObject)
+        self.currentPlot = plot
+        self.pendingPlot = None
+        for step in plot.drawSteps(plot.isProgressive()):
+            yield step
 
     def getInput(self):
         return self.dataset
@@ -184,6 +383,11 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
         """
         Returns the data catalog to the client.  Also reviews the data as
         it passes through to get the variable names and ranges.
+
+        A case that hasn't been indexed yet (a new export) is listed with
+        "indexing": true and without its variables' ranges, rather than
+        keeping the client waiting for the indexing; CATALOG_TOPIC says
+        when to ask again.
         """
         # The data catalog on the client isn't exactly the same as the
         # data catalog over here, so we have to build an 'ad hoc' catalog
@@ -192,17 +396,32 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
 
         # Loop through the data entries.
         for key in self.dataObjects.keys():
+            # The entries may not have been opened yet; what we need here
+            # doesn't require that.
+            entry = self.dataObjects.getEntry(key)
             adHocCatalog[key] = {
-                "fileName": self.dataObjects[key].getDataFile(),
-                "description": self.dataObjects[key].getDescription(),
-                "variables": self.dataObjects[key].getVariables()
+                "fileName": entry.getDataFile(),
+                "description": entry.getDescription(),
+                "variables": dict(entry.getVariables())
             }
 
-            # Gather the variable names and ranges.
-            for variable in self.dataObjects[key].caseData.PointData:
-                adHocCatalog[key]["variables"][variable.GetName()] = {
-                    "range": variable.GetRange(-1),
-                    "components": variable.GetNumberOfComponents() }
+            # Gather the variable names and ranges from the metadata
+            # index.  If the case changed since it was indexed, this is
+            # the old metadata until the index has caught up.  The ranges
+            # of a difference are bounds.
+            metadata = self.getMetadata(key)
+            if metadata is None:
+                if self.isIndexing(key):
+                    adHocCatalog[key]["indexing"] = True
+                    self.watchIndexing(key)
+                continue
+            for name, variable in metadata["variables"].items():
+                adHocCatalog[key]["variables"][name] = {
+                    "range": variable["range"],
+                    "components": variable["components"] }
+            adHocCatalog[key]["numberOfPoints"] = metadata["numberOfPoints"]
+            adHocCatalog[key]["numberOfCells"] = metadata["numberOfCells"]
+            adHocCatalog[key]["parts"] = [part["description"] for part in metadata["parts"]]
             
         return adHocCatalog
         
@@ -216,7 +435,7 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
             self.dataObjects[0].show()
             self.data0on = True
 
-        self.getApplication().InvokeEvent('UpdateEvent')
+        self.scene.markDirty("draw100rpm")
         return "**** executed draw100rpm() ****"
 
     @exportRPC("amsprotocol.draw.high.rpm")
@@ -229,26 +448,34 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
             self.dataObjects[1].show()
             self.data1on = True
 
-        self.getApplication().InvokeEvent('UpdateEvent')    
+        self.scene.markDirty("draw250rpm")
         return "**** executed draw250rpm() ****"
 
 
     @exportRPC("amsprotocol.show.tank.geometry")
     def showTankGeometry(self):
 
-        self.dataObjects[0].toggleTankGeometry()
-        self.getApplication().InvokeEvent('UpdateEvent')
+        job = self.jobs.submit("showTankGeometry", lambda: self.dataObjects[0].toggleTankGeometry())
+        return {"job": job.id}
         
 
     @exportRPC("amsprotocol.heartbeat.update")
     def heartbeatUpdate(self):
         """
-        Meant to be called at regular intervals so that the other graphics
-        routines can just set parameters and get out.  Sort of simulates a
-        kind of threading.
+        Liveness check.  It used to push a frame every time, to show what
+        the graphics routines had changed; now they mark the scene dirty
+        and it is pushed on SCENE_TOPIC when it changes.  Returns the
+        scene version, so a client can tell if it missed an event.
+        """
+        return self.scene.heartbeat()
+
+    @exportRPC("amsprotocol.scene.stats")
+    def getSceneStats(self):
         """
-        self.getApplication().InvokeEvent('UpdateEvent')
-        return "heart is beating"
+        Returns how often the scene changed and was published, and how
+        often flushes found nothing to publish.
+        """
+        return self.scene.getStats()
         
 
     @exportRPC("amsprotocol.change.surface")
@@ -258,6 +485,23 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
         for obj in self.dataObjects:
             obj.setIsoSurfaces([self.targetVal])
 
+        # Move the current contour, if there is one.  Values we have been
+        # to before come out of the surface cache.  A plot request that
+        # hasn't been drawn yet is dropped by this job, which draws it
+        # instead, with the new value if it is a contour.
+        pending = self.pendingPlot
+        if pending is not None or self.currentPlot.getPlotType() == 'contour':
+            def work():
+                if pending is not None:
+                    plot = self.dataObjects.plotData(pending[0], pending[1], self.plotCookBook)
+                else:
+                    plot = self.currentPlot
+                if plot.getPlotType() == 'contour':
+                    plot.setIsovalues([self.targetVal])
+                return self.runPlot(plot)
+            job = self.jobs.submit("changeSurface", work, self.PLOT_TARGET)
+            return {"job": job.id}
+
         return "******** executed changeSurface with: " + arg + " *******"
 
     @exportRPC("amsprotocol.execute.plot")
@@ -283,17 +527,116 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
         if self.debug:
             self.plotCookBook.printBook()
 
-        # Create a plot object for the given data set and recipe.
-        self.currentPlot = self.dataObjects.plotData(dataName, vizName, self.plotCookBook)
+        # Create a plot object for the given data set and recipe, and
+        # execute it.  Both happen in the job, since making the plot
+        # opens the data set if this is the first time it's used.  The
+        # client's view is updated when the job is done (see
+        # onJobEvent).
+        self.pendingPlot = (dataName, vizName)
+        work = lambda: self.runPlot(self.dataObjects.plotData(dataName, vizName, self.plotCookBook))
+        job = self.jobs.submit("executePlot", work, self.PLOT_TARGET)
+        return {"job": job.id}
+
+    @exportRPC("amsprotocol.add.difference")
+    def addDifference(self, arg):
+        """
+        Adds the difference of two catalog entries, A minus B, to the
+        catalog (see AMSDifference).  The arg is {"name": ...,
+        "difference": [A, B], "description": ...}; the difference is
+        plotted with execute.plot like any other entry.  Returns the new
+        data catalog.
+        """
+        name = arg["name"]
+        nameA, nameB = arg["difference"]
+        for caseName in (nameA, nameB):
+            if caseName not in self.dataObjects.keys():
+                return {"error": "no data named %s" % caseName}
+            if self.dataObjects.isDifference(caseName):
+                return {"error": "%s is a difference itself" % caseName}
+        entry = {"difference": [nameA, nameB],
+                 "description": arg.get("description", AMSDifference.getDifferenceName(nameA, nameB))}
+        self.dataObjects.addEntry(name, entry)
+        self.dataCatalog[name] = entry
+        return self.getDataCatalog()
+
+    @exportRPC("amsprotocol.job.status")
+    def getJobStatus(self, jobId):
+        job = self.jobs.getJob(jobId)
+        return job.toDict() if job is not None else None
+
+    @exportRPC("amsprotocol.job.stats")
+    def getJobStats(self):
+        """
+        Returns how many parameter requests were computed and how many
+        were dropped because a newer one came in.
+        """
+        return self.jobs.getStats()
 
-        # Execute that plot object.
-        self.currentPlot.draw()
+    @exportRPC("amsprotocol.job.cancel")
+    def cancelJob(self, jobId):
+        job = self.jobs.getJob(jobId)
+        if job is not None:
+            self.jobs.cancel(job)
+            return job.toDict()
+        return None
 
-        # This makes the client update its view.        
-        self.getApplication().InvokeEvent('UpdateEvent')
+    
+    @exportRPC("amsprotocol.get.cache.stats")
+    def getCacheStats(self):
+        """
+        Returns the hit and miss counts of the pipeline and surface caches,
+        and the updates, renders and property changes the transactions
+        avoided.
+        """
+        return {
+            "pipelines": self.dataObjects.pipelines.getStats(),
+            "surfaces": self.dataObjects.surfaces.getStats(),
+            "transactions": self.dataObjects.transactions.getStats(),
+        }
+
+    @exportRPC("amsprotocol.batch.render")
+    def batchRender(self, spec):
+        """
+        Starts rendering a batch of (data, recipe, camera) jobs to image
+        files, as AMSBatch.py does from the command line.  The spec has
+        the recipes and the jobs (or the data and cameras to make a
+        matrix of), and optionally "output" (a directory under the
+        server's batch directory), "workers" and "size".  Returns the
+        batch id for batch.status.
+        """
+        batchId = "batch%d" % (len(self.batches) + 1)
+        try:
+            output = AMSBatch.resolvePath(self.batchRoot, spec.get("output", batchId))
+            batch = AMSBatch.AMSBatchRun(spec, self.dataCatalog, output,
+                                         spec.get("workers", 1),
+                                         spec.get("size", AMSBatch.DEFAULT_SIZE))
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": "bad batch spec: %s" % e}
+        self.batches[batchId] = batch
+        return {"batch": batchId, "jobs": len(batch.jobs), "workers": len(batch.processes),
+                "output": batch.outputDir}
+
+    @exportRPC("amsprotocol.batch.status")
+    def batchStatus(self, batchId):
+        """
+        Returns how far along a batch is; once it is done, the timings of
+        every job and the images per minute.
+        """
+        batch = self.batches.get(batchId)
+        return batch.poll() if batch is not None else None
+
+    @exportRPC("amsprotocol.metrics.get")
+    def getMetrics(self):
+        """
+        Returns the latency histograms of the RPCs, jobs and pipeline
+        stages, and the memory and cache gauges (see AMSMetrics).
+        """
+        return AMSMetrics.registry.getSnapshot()
 
+    @exportRPC("amsprotocol.metrics.prometheus")
+    def getPrometheusMetrics(self):
+        return AMSMetrics.registry.toPrometheus()
 
-    
     @exportRPC("amsprotocol.test.button")
     def testButton(self, arg):
 
@@ -307,10 +650,15 @@ class AMSTest(pv_protocols.ParaViewWebProtocol):
     @exportRPC("amsprotocol.clear.all")
     def clearAll(self):
 
+        # Whatever is still queued would work on the filters we delete.
+        self.jobs.cancelAll()
         self.currentPlot.clearAll()
-        self.getApplication().InvokeEvent('UpdateEvent')
+        self.scene.markDirty("clearAll")
         
 #
 
 
-    
+# Time every amsprotocol.* RPC, and record them when asked to (see
+# AMSServer's --record-trace).
+AMSMetrics.instrumentRPCs(AMSTest)
+AMSTrace.recordRPCs(AMSTest)
@@ -0,0 +1,277 @@
+r"""
+Multi-resolution pyramids of the dataCatalog cases.
+
+Each level of a pyramid is the case resampled onto a regular grid, with
+the point arrays interpolated onto it, and written as a .vti file in a
+directory next to the case (<case file>.pyramid/).  An index.json in
+that directory lists the levels, coarsest first, and records the size
+and mtime of the case files, so a pyramid built from an older export is
+not used.
+
+Build the pyramids for every case in a data config file (the same one
+AMSServer is given with --dataConfigFile) with:
+
+    $ pvpython AMSPyramid.py --dataConfigFile files.json --levels 32,64,128
+
+At run time, AMSDataObject picks a level for each plot from the recipe's
+quality setting or time budget; see AMSPyramid.selectLevel().  Cells of
+a level that fall outside the mesh have vtkValidPointMask = 0, so
+contours of a level can throw away the triangles that touch them.
+"""
+
+import os, json, time
+
+import AMSEnSight
+import AMSCatalog
+import AMSStore
+
+try:
+    from vtk.vtkFiltersCore import vtkResampleToImage
+    from vtk.vtkIOXML import vtkXMLImageDataWriter
+except ImportError:
+    # Choosing a level only needs the index; building one needs VTK.
+    vtkResampleToImage = None
+
+# Bump this when the layout of the index changes.
+PYRAMID_VERSION = 1
+
+PYRAMID_SUFFIX = ".pyramid"
+INDEX_FILE = "index.json"
+
+DEFAULT_LEVELS = (32, 64, 128)
+
+# What a plot costs per cell of its input, in seconds, until we have
+# timed one.  Roughly what a contour of the 3.5M-cell cases takes.
+DEFAULT_SECONDS_PER_CELL = 2.0e-7
+
+# =============================================================================
+
+def getPyramidDir(caseFile):
+    return caseFile + PYRAMID_SUFFIX
+
+
+def levelDimensions(bounds, resolution):
+    """
+    Returns the sampling dimensions for a level: 'resolution' points
+    along the longest side of the bounds, and proportionally fewer along
+    the others (at least 2).
+    """
+    sizes = [bounds[1] - bounds[0], bounds[3] - bounds[2], bounds[5] - bounds[4]]
+    longest = max(sizes) or 1.0
+    return [max(2, int(round(resolution * size / longest))) for size in sizes]
+
+
+def getBounds(geometry):
+    """
+    Returns the [xmin, xmax, ymin, ymax, zmin, zmax] of all the parts.
+    """
+    low = [float("inf")] * 3
+    high = [float("-inf")] * 3
+    for part in geometry.parts:
+        coordinates = part.getCoordinates()
+        if len(coordinates) == 0:
+            continue
+        low = [min(a, float(b)) for a, b in zip(low, coordinates.min(axis=0))]
+        high = [max(a, float(b)) for a, b in zip(high, coordinates.max(axis=0))]
+    return [low[0], high[0], low[1], high[1], low[2], high[2]]
+
+
+def buildPyramid(caseFile, resolutions=DEFAULT_LEVELS, pointArrays=None, force=False):
+    """
+    Builds (or rebuilds, if it is stale or 'force' is set) the pyramid
+    of a case and returns its index.  'pointArrays' are the per-node
+    variables to interpolate onto the levels; by default all of them.
+    A pyramid with other levels or other arrays is stale.
+    """
+    if vtkResampleToImage is None:
+        raise ImportError("buildPyramid() requires VTK")
+
+    case = AMSStore.openCase(caseFile)
+    try:
+        if pointArrays is None:
+            pointArrays = [name for name in case.getVariableNames()
+                           if case.getVariableInfo(name)["location"] == "node"]
+
+        pyramid = loadPyramid(caseFile)
+        if pyramid is not None and not force and \
+           [level["resolution"] for level in pyramid.levels] == sorted(resolutions) and \
+           sorted(pyramid.getPointArrays()) == sorted(pointArrays):
+            return pyramid.index
+
+        start = time.time()
+        dataset = AMSEnSight.makeVTKDataSet(case, pointArrays)
+        geometry = case.getGeometry()
+        print("read " + caseFile + " in %.1f s" % (time.time() - start))
+
+        directory = getPyramidDir(caseFile)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        resample = vtkResampleToImage()
+        resample.SetInputDataObject(dataset)
+        resample.UseInputBoundsOn()
+
+        bounds = getBounds(geometry)
+        levels = []
+        for resolution in sorted(resolutions):
+            start = time.time()
+            dimensions = levelDimensions(bounds, resolution)
+            resample.SetSamplingDimensions(*dimensions)
+            resample.Update()
+            image = resample.GetOutput()
+
+            fileName = "level-%03d.vti" % resolution
+            writer = vtkXMLImageDataWriter()
+            writer.SetInputData(image)
+            writer.SetFileName(os.path.join(directory, fileName))
+            writer.SetDataModeToAppended()
+            writer.Write()
+
+            levels.append({
+                "resolution": resolution,
+                "file": fileName,
+                "dimensions": dimensions,
+                "numberOfPoints": image.GetNumberOfPoints(),
+                "numberOfCells": image.GetNumberOfCells(),
+            })
+            print("  level %d %s in %.1f s" % (resolution, dimensions, time.time() - start))
+
+        index = {
+            "version": PYRAMID_VERSION,
+            "caseFile": caseFile,
+            "signature": AMSCatalog.fileSignature(case.getFiles()),
+            "bounds": bounds,
+            "numberOfPoints": geometry.getNumberOfPoints(),
+            "numberOfCells": geometry.getNumberOfCells(),
+            "pointArrays": list(pointArrays),
+            "levels": levels,
+        }
+
+        # Written last, and atomically, so a half-built pyramid is never
+        # picked up.
+        indexFile = os.path.join(directory, INDEX_FILE)
+        with open(indexFile + ".tmp", "w") as fp:
+            json.dump(index, fp, indent=1)
+        os.rename(indexFile + ".tmp", indexFile)
+        return index
+    finally:
+        case.close()
+
+
+def loadPyramid(caseFile):
+    """
+    Returns the pyramid of a case, or None if it has none or the case
+    files changed since it was built.
+    """
+    try:
+        with open(os.path.join(getPyramidDir(caseFile), INDEX_FILE)) as fp:
+            index = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get("version") != PYRAMID_VERSION:
+        return None
+    if AMSCatalog.fileSignature(index["signature"].keys()) != index["signature"]:
+        return None
+    return AMSPyramid(caseFile, index)
+
+
+class AMSPyramid(object):
+    """
+    The levels of one case's pyramid, and how to choose among them.
+
+    Levels are numbered from 0 (coarsest) up; the full-resolution case
+    is level None.
+    """
+    def __init__(self, caseFile, index):
+        self.caseFile = caseFile
+        self.index = index
+        self.levels = sorted(index["levels"], key=lambda level: level["numberOfCells"])
+
+        # Measured plot cost, seconds per input cell.  See recordTime().
+        self.secondsPerCell = DEFAULT_SECONDS_PER_CELL
+        self.timed = False
+
+    def getNumberOfLevels(self):
+        return len(self.levels)
+
+    def getLevelFile(self, level):
+        return os.path.join(getPyramidDir(self.caseFile), self.levels[level]["file"])
+
+    def getPointArrays(self):
+        return self.index["pointArrays"]
+
+    def getNumberOfCells(self, level):
+        if level is None:
+            return self.index["numberOfCells"]
+        return self.levels[level]["numberOfCells"]
+
+    def selectLevel(self, quality=None, timeBudget=None):
+        """
+        Picks a level.  'quality' goes from 0 (the coarsest level) to 1
+        (full resolution), in equal steps over the levels.  'timeBudget'
+        (seconds) picks the finest level whose estimated cost fits in it,
+        or the coarsest if none does.  With both, the coarser of the two
+        wins; with neither, it's full resolution.
+        """
+        candidates = list(range(len(self.levels))) + [None]
+        choice = len(candidates) - 1
+
+        if quality is not None:
+            quality = min(1.0, max(0.0, float(quality)))
+            choice = min(choice, int(round(quality * (len(candidates) - 1))))
+
+        if timeBudget is not None:
+            fits = 0
+            for i, level in enumerate(candidates):
+                if self.getNumberOfCells(level) * self.secondsPerCell <= timeBudget:
+                    fits = i
+            choice = min(choice, fits)
+
+        return candidates[choice]
+
+    def recordTime(self, level, seconds):
+        """
+        Updates the cost estimate from the time a plot on a level took.
+        """
+        cells = self.getNumberOfCells(level)
+        if cells <= 0 or seconds <= 0:
+            return
+        rate = seconds / float(cells)
+        if self.timed:
+            self.secondsPerCell = 0.7 * self.secondsPerCell + 0.3 * rate
+        else:
+            self.secondsPerCell = rate
+            self.timed = True
+
+
+# =============================================================================
+# Main: build the pyramids of the cases in a data config file
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build multi-resolution pyramids of the dataCatalog cases")
+    parser.add_argument("--dataConfigFile", required=True, help="Path to a data config file")
+    parser.add_argument("--levels", default=",".join(str(n) for n in DEFAULT_LEVELS),
+                        help="Comma-separated number of points along the longest side, one per level")
+    parser.add_argument("--arrays", default=None,
+                        help="Comma-separated point arrays to keep (default: the entry's 'pyramidArrays', or all)")
+    parser.add_argument("--force", action="store_true", help="Rebuild pyramids that are up to date")
+    args = parser.parse_args()
+
+    with open(args.dataConfigFile) as fp:
+        dataCatalog = json.load(fp)["dataCatalog"]
+
+    resolutions = [int(n) for n in args.levels.split(",")]
+    for name in sorted(dataCatalog.keys()):
+        entry = dataCatalog[name]
+        # Differences have no files of their own.
+        if "difference" in entry:
+            continue
+        if args.arrays:
+            pointArrays = args.arrays.split(",")
+        else:
+            pointArrays = entry.get("pyramidArrays")
+        print("building pyramid for " + name)
+        buildPyramid(entry["fileName"], resolutions, pointArrays, args.force)
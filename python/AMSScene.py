@@ -0,0 +1,156 @@
+r"""
+Tracks whether the scene has changed since the clients last saw it, so
+the server renders and publishes only when it has.
+
+The clients used to call amsprotocol.heartbeat.update every second, and
+every call invoked 'UpdateEvent', which made the image delivery render
+and publish a frame whether anything had changed or not.  Now the code
+that changes the pipeline calls markDirty(), and the camera is watched
+for changes.  The first change after a publish schedules a flush on the
+event loop, so a burst of changes costs one frame.  The flush invokes
+'UpdateEvent' (the image delivery pushes the frame to the subscribed
+clients) and publishes a scene event:
+
+    amsprotocol.scene.event   {"version": n, "reasons": ["executePlot", "camera"]}
+
+Frames pushed by somebody else (the mouse handler pushes its own while
+the user drags the camera) count as publishes: the camera they show is
+not changed any more.  A render nudges the camera's clipping range,
+which is why camera changes are found by comparing the camera's
+position, focal point, view up and zoom with those last published
+rather than by its modified events alone.
+
+The heartbeat is now only a liveness check; it returns the scene
+version, so a client that missed an event can tell.
+"""
+
+import time
+
+import AMSJobs
+
+
+def cameraKey(camera):
+    """
+    What the clients can see of a camera.
+    """
+    return (tuple(camera.GetPosition()), tuple(camera.GetFocalPoint()), tuple(camera.GetViewUp()),
+            camera.GetViewAngle(), camera.GetParallelScale(), camera.GetParallelProjection())
+
+
+class AMSSceneState(object):
+    """
+    The dirty state of the scene, and the flushing of it.  'publish' is
+    called with the scene event of every flush.
+    """
+    def __init__(self, publish, callLater=None):
+        self.publish = publish
+        self.callLater = callLater or AMSJobs.defaultCallLater()
+
+        self.application = None
+        self.camera = None
+        self.publishedCamera = None
+
+        self.version = 0
+        self.reasons = []           # what changed since the last flush
+        self.pending = False        # a flush is scheduled
+        self.flushing = False
+
+        # For the stats.
+        self.changes = 0
+        self.flushes = 0
+        self.emptyFlushes = 0
+        self.externalUpdates = 0
+        self.heartbeats = 0
+        self.lastFlush = None
+
+    def watch(self, application, view):
+        """
+        Starts watching the view's camera and the frames pushed through
+        'application'.
+        """
+        self.application = application
+        application.AddObserver('UpdateEvent', self.onUpdate)
+        self.camera = view.GetActiveCamera()
+        self.camera.AddObserver('ModifiedEvent', self.onCameraModified)
+        self.publishedCamera = cameraKey(self.camera)
+
+    def isDirty(self):
+        return bool(self.reasons) or self.isCameraChanged()
+
+    def isCameraChanged(self):
+        return self.camera is not None and cameraKey(self.camera) != self.publishedCamera
+
+    def markDirty(self, reason):
+        """
+        Notes a change of the scene, to be published on the next pass of
+        the event loop (or by flush()).
+        """
+        self.changes += 1
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+        self.schedule()
+
+    def schedule(self):
+        if not self.pending:
+            self.pending = True
+            self.callLater(0, self.flush)
+
+    def onCameraModified(self, camera, event):
+        # Checked at the flush; renders modify the camera too.
+        if not self.flushing:
+            self.schedule()
+
+    def onUpdate(self, application, event):
+        """
+        Any frame pushed shows the camera as it is now.
+        """
+        if not self.flushing:
+            self.externalUpdates += 1
+        if self.camera is not None:
+            self.publishedCamera = cameraKey(self.camera)
+
+    def flush(self):
+        """
+        Renders and publishes the scene if it changed since the last time.
+        Returns True if it did.
+        """
+        self.pending = False
+        reasons = list(self.reasons)
+        if self.isCameraChanged():
+            reasons.append("camera")
+        if not reasons:
+            self.emptyFlushes += 1
+            return False
+
+        self.reasons = []
+        self.version += 1
+        self.flushes += 1
+        self.lastFlush = time.time()
+        self.flushing = True
+        try:
+            if self.application is not None:
+                self.application.InvokeEvent('UpdateEvent')
+        finally:
+            self.flushing = False
+        if self.camera is not None:
+            self.publishedCamera = cameraKey(self.camera)
+        self.publish({"version": self.version, "reasons": reasons})
+        return True
+
+    def heartbeat(self):
+        """
+        Answer to the client's liveness check.
+        """
+        self.heartbeats += 1
+        return {"alive": True, "version": self.version}
+
+    def getStats(self):
+        return {
+            "version": self.version,
+            "changes": self.changes,
+            "flushes": self.flushes,
+            "emptyFlushes": self.emptyFlushes,
+            "externalUpdates": self.externalUpdates,
+            "heartbeats": self.heartbeats,
+            "secondsSinceFlush": time.time() - self.lastFlush if self.lastFlush else None,
+        }
@@ -67,6 +67,10 @@ from paraview.web import pv_wslink
 from paraview.web import protocols as pv_protocols
 
 import AMSProtocols
+import AMSHostCache
+import AMSImageDelivery
+import AMSMetrics
+import AMSTrace
 
 # import RPC annotation
 from wslink import register as exportRPC
@@ -109,6 +113,13 @@ class AMSServer(pv_wslink.PVServerProtocol):
     viewportScale=1.0
     viewportMaxWidth=2560
     viewportMaxHeight=1440
+    loadWorkers=1
+    prewarm=False
+    imageQuality="adaptive"
+    metricsFile=None
+    metricsInterval=15.0
+    recordTrace=None
+    batchDir="batches"
     config = {
         "profiles": {
             "default": {
@@ -137,6 +148,14 @@ class AMSServer(pv_wslink.PVServerProtocol):
         parser.add_argument("--viewport-max-width", default=2560, type=int, help="Viewport maximum size in width", dest="viewportMaxWidth")
         parser.add_argument("--viewport-max-height", default=1440, type=int, help="Viewport maximum size in height", dest="viewportMaxHeight")
         parser.add_argument("--settings-lod-threshold", default=102400, type=int, help="LOD Threshold in Megabytes", dest="settingsLODThreshold")
+        parser.add_argument("--host-cache", default=None, help="Directory of the host-wide case cache shared by server processes ('default' for /dev/shm/ams-cache); only used by the native reader", dest="hostCache")
+        parser.add_argument("--load-workers", default=1, type=int, help="Number of threads reading cases ahead of their first use (0 for none)", dest="loadWorkers")
+        parser.add_argument("--prewarm", default=False, action="store_true", help="Open the first case before accepting connections, for servers started ahead of their session (see AMSLauncher.py)", dest="prewarm")
+        parser.add_argument("--metrics-file", default=None, help="Write the metrics in Prometheus' text format to this file, every --metrics-interval seconds", dest="metricsFile")
+        parser.add_argument("--metrics-interval", default=15.0, type=float, help="Seconds between writes of --metrics-file", dest="metricsInterval")
+        parser.add_argument("--record-trace", default=None, help="Record the clients' RPCs to this file, for bench/benchReplay.py", dest="recordTrace")
+        parser.add_argument("--batch-dir", default="batches", help="Directory the batch.render RPC writes its images under", dest="batchDir")
+        parser.add_argument("--image-quality", default="adaptive", help="'adaptive' for smaller frames while interacting, fitted to the link (see AMSImageDelivery.py), or a JPEG quality for every frame", dest="imageQuality")
 
     @staticmethod
     def configure(args):
@@ -155,6 +174,16 @@ class AMSServer(pv_wslink.PVServerProtocol):
         AMSServer.viewportMaxWidth  = args.viewportMaxWidth
         AMSServer.viewportMaxHeight = args.viewportMaxHeight
         AMSServer.settingsLODThreshold = args.settingsLODThreshold
+        AMSServer.loadWorkers = args.loadWorkers
+        AMSServer.prewarm = args.prewarm
+        AMSServer.imageQuality = args.imageQuality
+        AMSServer.metricsFile = args.metricsFile
+        AMSServer.metricsInterval = args.metricsInterval
+        AMSServer.recordTrace = args.recordTrace
+        AMSServer.batchDir = args.batchDir
+
+        if args.hostCache:
+            AMSHostCache.configure(None if args.hostCache == "default" else args.hostCache)
 
 
     def initialize(self):
@@ -162,14 +191,20 @@ class AMSServer(pv_wslink.PVServerProtocol):
         # Bring used components
 #        self.registerVtkWebProtocol(pv_protocols.ParaViewWebFileListing(AMSServer.data, "Home", AMSServer.excludeRegex, AMSServer.groupRegex))
 #        self.registerVtkWebProtocol(pv_protocols.ParaViewWebColorManager())
-        self.registerVtkWebProtocol(pv_protocols.ParaViewWebMouseHandler())
+
+        # Image delivery picks the quality of each frame: small and
+        # compressed while the mouse moves, full quality once it stops.
+        fixedQuality = None if AMSServer.imageQuality == "adaptive" else int(AMSServer.imageQuality)
+        imageDelivery = AMSImageDelivery.AMSImageDelivery(
+            decode=False, controller=AMSImageDelivery.AMSQualityController(fixedQuality=fixedQuality))
+        self.registerVtkWebProtocol(AMSImageDelivery.AMSMouseHandler(imageDelivery))
 #        self.registerVtkWebProtocol(pv_protocols.ParaViewWebTimeHandler())
         self.registerVtkWebProtocol(pv_protocols.ParaViewWebViewPort(AMSServer.viewportScale, AMSServer.viewportMaxWidth, AMSServer.viewportMaxHeight))
-        self.registerVtkWebProtocol(pv_protocols.ParaViewWebPublishImageDelivery(decode=False))
+        self.registerVtkWebProtocol(imageDelivery)
 #        self.registerVtkWebProtocol(pv_protocols.ParaViewWebViewPortImageDelivery())
 #        self.registerVtkWebProtocol(pv_protocols.ParaViewPublishImageDelivery())
 
-        amstest = AMSProtocols.AMSTest(AMSServer.config, AMSServer.profile)
+        amstest = AMSProtocols.AMSTest(AMSServer.config, AMSServer.profile, batchRoot=AMSServer.batchDir)
 
         ## Register the AMS components
         self.registerVtkWebProtocol(amstest)
@@ -187,11 +222,30 @@ class AMSServer(pv_wslink.PVServerProtocol):
         simple.GetRenderView().Background = [0,0,0]
         simple.GetRenderView().Background2 = [0,0,0]
 
+        # Push a frame when the scene changes, instead of whenever the
+        # client's heartbeat comes in.
+        amstest.watchScene(simple.GetRenderView())
+
+        if AMSServer.metricsFile:
+            AMSMetrics.startDumping(AMSServer.metricsFile, AMSServer.metricsInterval)
+
+        if AMSHostCache.getDefault() is not None:
+            AMSHostCache.startCollecting()
+
+        if AMSServer.recordTrace:
+            AMSTrace.startRecording(AMSServer.recordTrace)
+
         if self.dataConfig:
-            amstest.initializeData( self.dataConfig["dataCatalog"] )
+            amstest.initializeData( self.dataConfig["dataCatalog"], AMSServer.loadWorkers )
         else:
             amstest.initializeData( ["/Users/tomfool/tech/18/amgen/ams-102-AgileViz/EnSight/mat-viz-mofTFF-90L-9.1lpm-100rpm/mat-viz-mofTFF-90L-9.1lpm-100rpm.case", "/Users/tomfool/tech/18/amgen/ams-102-AgileViz/EnSight/mat-viz-mofTFF-90L-9.1lpm-250rpm/mat-viz-mofTFF-90L-9.1lpm-250rpm.case" ])
 
+        # A pre-warmed server has time on its hands before its session
+        # shows up, so it opens the first case (and takes the standard
+        # view) now rather than on the first plot.
+        if AMSServer.prewarm:
+            amstest.dataObjects.getFirst()
+
          # Update interaction mode
         pxm = simple.servermanager.ProxyManager()
         interactionProxy = pxm.GetProxy('settings',
@@ -0,0 +1,213 @@
+r"""
+Span-space index for interactive isosurface extraction.
+
+A contour filter visits every cell of the mesh for every new isovalue,
+but only the cells whose scalar range straddles the isovalue contribute
+to the surface.  This module stores each cell's (min, max) in a span
+space: the cells are split into buckets by their minimum, and sorted by
+their maximum inside each bucket.  A query for an isovalue v then only
+looks at buckets with min <= v, and in each of those it finds the cells
+with max >= v by binary search.
+
+The contour itself is run by VTK on just the candidate cells, so the
+surface is the same as the one the stock Contour filter produces.
+
+    >>> index = buildIndex(case, "uds_0_scalar")
+    >>> surface = extractIsosurface(dataset, index, "uds_0_scalar", [400.0])
+"""
+
+import numpy
+
+try:
+    from vtk.util import numpy_support
+    from vtk.vtkCommonDataModel import vtkDataObject, vtkMultiBlockDataSet, vtkSelection, vtkSelectionNode
+    from vtk.vtkFiltersExtraction import vtkExtractSelection
+    from vtk.vtkFiltersCore import vtkContourFilter
+except ImportError:
+    # Building and querying the index only needs NumPy.
+    numpy_support = None
+
+# =============================================================================
+
+def blockCellRanges(block, values):
+    """
+    Returns the (min, max) of 'values' over the nodes of every element in
+    an element block.
+    """
+    if block.nodesPerElement is not None:
+        nodeValues = values[block.connectivity - 1]
+        return nodeValues.min(axis=1), nodeValues.max(axis=1)
+
+    # Variable-size elements: reduce over each element's node list.  For
+    # nfaced the node list is per face, so reduce over faces, then over
+    # each element's faces.
+    nodeValues = values[block.connectivity - 1]
+    starts = numpy.concatenate([[0], numpy.cumsum(block.nodeCounts)[:-1]])
+    low = numpy.minimum.reduceat(nodeValues, starts)
+    high = numpy.maximum.reduceat(nodeValues, starts)
+    if block.faceCounts is not None:
+        starts = numpy.concatenate([[0], numpy.cumsum(block.faceCounts)[:-1]])
+        low = numpy.minimum.reduceat(low, starts)
+        high = numpy.maximum.reduceat(high, starts)
+    return low, high
+
+
+def cellRanges(case, variable, timeStep=0):
+    """
+    Returns (cell min, cell max, part offsets) of a per-node variable over
+    all non-ghost cells of a case, in the order the cells have in the
+    VTK dataset: part by part, block by block.  Cells of part i are
+    [offsets[i], offsets[i+1]).
+    """
+    geometry = case.getGeometry(timeStep)
+    lows = []
+    highs = []
+    offsets = [0]
+    for part in geometry.parts:
+        values = case.getPartArray(variable, part.partId, timeStep)
+        count = 0
+        for block in part.blocks:
+            if block.ghost or block.count == 0:
+                continue
+            if values is None:
+                # No values on this part: it can never straddle anything.
+                low = numpy.full(block.count, numpy.inf, dtype=numpy.float32)
+                high = numpy.full(block.count, -numpy.inf, dtype=numpy.float32)
+            else:
+                low, high = blockCellRanges(block, values)
+            lows.append(low)
+            highs.append(high)
+            count += block.count
+        offsets.append(offsets[-1] + count)
+
+    if not lows:
+        empty = numpy.zeros(0, dtype=numpy.float32)
+        return empty, empty, numpy.array(offsets)
+    return numpy.concatenate(lows), numpy.concatenate(highs), numpy.array(offsets)
+
+
+class AMSSpanSpaceIndex(object):
+    """
+    The span-space index of one scalar over one mesh.
+    """
+    def __init__(self, cellMin, cellMax, partOffsets=None, numberOfBuckets=128):
+        self.numberOfCells = len(cellMin)
+        self.partOffsets = partOffsets if partOffsets is not None else numpy.array([0, self.numberOfCells])
+        self.cellMin = numpy.asarray(cellMin)
+
+        # Split the cells, in order of their minimum, into buckets of
+        # (about) equal size.
+        byMin = numpy.argsort(cellMin, kind="mergesort")
+        buckets = numpy.array_split(byMin, max(1, min(numberOfBuckets, self.numberOfCells)))
+
+        self.bucketMinLow = []      # smallest min in the bucket
+        self.bucketMinHigh = []     # largest min in the bucket
+        self.bucketCells = []       # cell ids, by decreasing max
+        self.bucketNegMax = []      # -max of those cells, increasing
+        for cells in buckets:
+            if len(cells) == 0:
+                continue
+            order = numpy.argsort(-cellMax[cells], kind="mergesort")
+            cells = cells[order]
+            self.bucketCells.append(cells.astype(numpy.int64))
+            self.bucketNegMax.append(-numpy.asarray(cellMax[cells], dtype=numpy.float64))
+            self.bucketMinLow.append(float(cellMin[cells].min()))
+            self.bucketMinHigh.append(float(cellMin[cells].max()))
+
+    def query(self, value):
+        """
+        Returns the ids of the cells with min <= value <= max, sorted.
+        """
+        found = []
+        for k in range(len(self.bucketCells)):
+            if self.bucketMinLow[k] > value:
+                # Buckets are in order of their minimum, so none of the
+                # rest can contain the value either.
+                break
+            count = numpy.searchsorted(self.bucketNegMax[k], -value, side="right")
+            cells = self.bucketCells[k][:count]
+            if self.bucketMinHigh[k] > value:
+                # The bucket straddles the value, so check each minimum.
+                cells = cells[self.cellMin[cells] <= value]
+            found.append(cells)
+        if not found:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.sort(numpy.concatenate(found))
+
+    def queryValues(self, values):
+        """
+        Returns the union of the cells straddling any of the values.
+        """
+        cells = [self.query(v) for v in values]
+        if len(cells) == 1:
+            return cells[0]
+        return numpy.unique(numpy.concatenate(cells))
+
+    def splitByPart(self, cells):
+        """
+        Splits sorted global cell ids into a list of per-part local ids.
+        """
+        bounds = numpy.searchsorted(cells, self.partOffsets)
+        return [cells[bounds[i]:bounds[i + 1]] - self.partOffsets[i]
+                for i in range(len(self.partOffsets) - 1)]
+
+
+def buildIndex(case, variable, timeStep=0, numberOfBuckets=128):
+    """
+    Builds the span-space index of a per-node scalar of a case.
+    """
+    cellMin, cellMax, offsets = cellRanges(case, variable, timeStep)
+    return AMSSpanSpaceIndex(cellMin, cellMax, offsets, numberOfBuckets)
+
+
+# =============================================================================
+
+def contourCells(grid, cells, variable, isovalues):
+    """
+    Contours only the given cells of an unstructured grid.
+    """
+    node = vtkSelectionNode()
+    node.SetFieldType(vtkSelectionNode.CELL)
+    node.SetContentType(vtkSelectionNode.INDICES)
+    node.SetSelectionList(numpy_support.numpy_to_vtkIdTypeArray(numpy.ascontiguousarray(cells, dtype=numpy.int64), deep=1))
+    selection = vtkSelection()
+    selection.AddNode(node)
+
+    extract = vtkExtractSelection()
+    extract.SetInputData(0, grid)
+    extract.SetInputData(1, selection)
+    extract.Update()
+    candidates = extract.GetOutput()
+    candidates.GetPointData().RemoveArray("vtkOriginalPointIds")
+    candidates.GetCellData().RemoveArray("vtkOriginalCellIds")
+
+    contour = vtkContourFilter()
+    contour.SetInputData(candidates)
+    contour.SetInputArrayToProcess(0, 0, 0, vtkDataObject.FIELD_ASSOCIATION_POINTS, variable)
+    contour.SetNumberOfContours(len(isovalues))
+    for i, value in enumerate(isovalues):
+        contour.SetValue(i, value)
+    contour.Update()
+    return contour.GetOutput()
+
+
+def extractIsosurface(dataset, index, variable, isovalues):
+    """
+    Returns the isosurfaces of a multiblock dataset (one unstructured grid
+    per part, as the EnSight readers produce) as a multiblock of polydata,
+    like the Contour filter does, visiting only the cells the index says
+    straddle an isovalue.
+    """
+    if numpy_support is None:
+        raise ImportError("extractIsosurface() requires VTK")
+
+    cellsByPart = index.splitByPart(index.queryValues(isovalues))
+
+    output = vtkMultiBlockDataSet()
+    output.SetNumberOfBlocks(dataset.GetNumberOfBlocks())
+    for i in range(dataset.GetNumberOfBlocks()):
+        grid = dataset.GetBlock(i)
+        if grid is None or i >= len(cellsByPart) or len(cellsByPart[i]) == 0:
+            continue
+        output.SetBlock(i, contourCells(grid, cellsByPart[i], variable, isovalues))
+    return output
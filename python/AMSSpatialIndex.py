@@ -0,0 +1,885 @@
+r"""
+Spatial index of a case's mesh, built once and kept next to the case.
+
+Probing, streamline integration and resampling all need to know which
+cell a point is in.  The VTK filters each build a locator for every
+call; this index is built from the case's geometry once, written into
+a directory next to the case (<case file>.index/), and mapped from
+there by every server process that opens the case.  An index.json
+holds the size and mtime of the geometry file it was built from, and
+an index whose geometry changed is built again.
+
+The index has:
+
+    a tet mesh      the volume cells split into tetrahedra, with the
+                    inverse edge matrices that give a point's
+                    barycentric coordinates (its interpolation weights)
+                    and each tet's neighbours across its faces
+    uniform bins    a grid over the bounds listing the tets overlapping
+                    each bin, to find the tet containing a point: a
+                    search walks from a tet of the point's bin (or a
+                    guess, like the previous tet of a streamline) across
+                    the faces towards it, and only tests the whole bin
+                    if that fails
+    a k-d tree      over the mesh nodes, to find the closest node
+
+All the queries take (n, 3) arrays of points and answer for all of
+them at once:
+
+    >>> index = getSpatialIndex(caseFile, case)
+    >>> cells, tets, weights = index.findCells(points)
+    >>> pressure = index.interpolate(case.getPointArray("pressure"), points)
+    >>> nodes, distances = index.findClosestPoints(points)
+
+    $ python AMSSpatialIndex.py --dataConfigFile files.json [--force]
+
+builds the indices of the cases in a data config ahead of time.
+"""
+
+import os, json, time, shutil
+
+import numpy
+
+try:
+    from vtk.util import numpy_support
+    from vtk.vtkCommonDataModel import vtkImageData
+except ImportError:
+    # Building and querying the index only needs NumPy.
+    numpy_support = None
+
+import AMSCatalog
+import AMSPyramid
+import AMSStore
+
+SPATIAL_INDEX_VERSION = 2
+
+SPATIAL_INDEX_SUFFIX = ".index"
+INDEX_FILE = "index.json"
+
+# =============================================================================
+#
+# Tetrahedral decomposition
+#
+# =============================================================================
+
+# Tets of each cell type, as node indices in VTK order (see
+# AMSEnSightElementBlock.getConnectivity()).  Quadratic cells are split
+# by their corner nodes, which VTK lists first.
+HEXAHEDRON_TETS = [[0, 1, 2, 6], [0, 2, 3, 6], [0, 3, 7, 6], [0, 7, 4, 6], [0, 4, 5, 6], [0, 5, 1, 6]]
+WEDGE_TETS = [[0, 1, 2, 3], [1, 2, 3, 4], [2, 3, 4, 5]]
+PYRAMID_TETS = [[0, 1, 2, 4], [0, 2, 3, 4]]
+
+TET_DECOMPOSITION = {
+    "tetra4": [[0, 1, 2, 3]],
+    "tetra10": [[0, 1, 2, 3]],
+    "pyramid5": PYRAMID_TETS,
+    "pyramid13": PYRAMID_TETS,
+    "penta6": WEDGE_TETS,
+    "penta15": WEDGE_TETS,
+    "hexa8": HEXAHEDRON_TETS,
+    "hexa20": HEXAHEDRON_TETS,
+}
+
+
+class AMSTetMesh(object):
+    """
+    The volume cells of a geometry as tetrahedra over one point array
+    (the parts' nodes one after the other, in the order of the point
+    arrays from AMSEnSightCase.getPointArray()).
+
+    Polyhedra are split into one tet per triangle of their faces and an
+    extra point at their center, whose field values are the average of
+    the polyhedron's nodes; extendField() appends them.
+
+    'arrays' is what makeTetMesh() computes (or what was saved of it).
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.points = arrays["points"]
+        self.tets = arrays["tets"]
+        # Which cell of the dataset each tet came from (tets of a cell
+        # are next to each other).
+        self.tetCells = arrays["tetCells"]
+        # For the polyhedron centers: node ids, and which center each
+        # belongs to.  Empty if there are no polyhedra.
+        self.centerNodes = arrays["centerNodes"]
+        self.centerIndex = arrays["centerIndex"]
+        # StreamTracer measures steps in lengths of the cell they start
+        # in: the diagonal of its bounding box.
+        self.cellLength = arrays["cellLength"]
+        # Bounding boxes of the tets, only kept until the bins are built.
+        self.tetLow = arrays.get("tetLow")
+        self.tetHigh = arrays.get("tetHigh")
+        # Barycentric coordinates of p in tet t: inverse[t] . (p - origin[t]).
+        self.inverse = arrays["inverse"]
+        self.origin = arrays["origin"]
+        # The tet across the face opposite each node (-1 on the boundary).
+        self.neighbors = arrays["neighbors"]
+
+        self.numberOfNodes = len(self.points) - self.getNumberOfCenters()
+
+    def getNumberOfTets(self):
+        return len(self.tets)
+
+    def getNumberOfCenters(self):
+        if len(self.centerIndex) == 0:
+            return 0
+        return int(self.centerIndex.max()) + 1
+
+    def getBounds(self):
+        low = self.points.min(axis=0)
+        high = self.points.max(axis=0)
+        return [float(low[0]), float(high[0]), float(low[1]), float(high[1]), float(low[2]), float(high[2])]
+
+    def extendField(self, values):
+        """
+        Returns per-node values with the values at the polyhedron centers
+        appended, as float64.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        numberOfCenters = self.getNumberOfCenters()
+        if numberOfCenters == 0:
+            return values
+        counts = numpy.bincount(self.centerIndex, minlength=numberOfCenters)
+        flat = values.reshape(len(values), -1)
+        centers = numpy.empty((numberOfCenters, flat.shape[1]))
+        for component in range(flat.shape[1]):
+            centers[:, component] = numpy.bincount(self.centerIndex, weights=flat[self.centerNodes, component],
+                                                   minlength=numberOfCenters) / counts
+        return numpy.concatenate([values, centers.reshape((numberOfCenters,) + values.shape[1:])])
+
+    def interpolate(self, values, tets, weights):
+        """
+        Interpolates per-point values (already extended) at points given
+        by their tets and barycentric weights.
+        """
+        nodeValues = values[self.tets[tets]]
+        if nodeValues.ndim == 2:
+            return (nodeValues * weights).sum(axis=1)
+        return numpy.einsum("nk,nkc->nc", weights, nodeValues)
+
+
+def invertTets(corners):
+    """
+    Returns the inverses of the edge matrices [v1-v0, v2-v0, v3-v0] of a
+    set of tets, and their v0, so that the barycentric coordinates of p
+    are inverse . (p - v0).  Flat tets get NaNs, which contain nothing.
+    """
+    origin = corners[:, 0]
+    edges = numpy.stack([corners[:, 1] - origin, corners[:, 2] - origin, corners[:, 3] - origin], axis=2)
+    determinant = numpy.linalg.det(edges)
+    scale = numpy.abs(edges).max(axis=(1, 2)) ** 3
+    flat = numpy.abs(determinant) <= 1e-12 * scale
+    edges[flat] = numpy.eye(3)
+    inverse = numpy.linalg.inv(edges)
+    inverse[flat] = numpy.nan
+    return inverse, origin
+
+
+def findNeighbors(tets):
+    """
+    Returns the tet across the face opposite each node of each tet, (m, 4),
+    or -1 where no other tet has the same three nodes (the boundary, and
+    faces split differently by the cells on either side).
+    """
+    faces = numpy.sort(tets[:, [[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]]], axis=2).reshape(-1, 3)
+    order = numpy.lexsort((faces[:, 2], faces[:, 1], faces[:, 0]))
+    faces = faces[order]
+    same = numpy.flatnonzero((faces[1:] == faces[:-1]).all(axis=1))
+    neighbors = numpy.full(len(faces), -1, dtype=numpy.int64)
+    neighbors[order[same]] = order[same + 1] // 4
+    neighbors[order[same + 1]] = order[same] // 4
+    return neighbors.reshape(-1, 4)
+
+
+def makeTetMesh(points, tets, tetCells, centerNodes, centerIndex):
+    """
+    Returns an AMSTetMesh, computing the per-tet arrays the queries use.
+    """
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    tets = numpy.ascontiguousarray(tets, dtype=numpy.int64)
+    corners = points[tets]
+    low = corners.min(axis=1)
+    high = corners.max(axis=1)
+
+    starts = numpy.flatnonzero(numpy.concatenate([[True], tetCells[1:] != tetCells[:-1]]))
+    cellLow = numpy.minimum.reduceat(low, starts)
+    cellHigh = numpy.maximum.reduceat(high, starts)
+    counts = numpy.diff(numpy.append(starts, len(tetCells)))
+    inverse, origin = invertTets(corners)
+
+    return AMSTetMesh({
+        "points": points,
+        "tets": tets,
+        "tetCells": tetCells,
+        "centerNodes": centerNodes,
+        "centerIndex": centerIndex,
+        "cellLength": numpy.repeat(numpy.linalg.norm(cellHigh - cellLow, axis=1), counts),
+        "tetLow": low,
+        "tetHigh": high,
+        "inverse": inverse,
+        "origin": origin,
+        "neighbors": findNeighbors(tets),
+    })
+
+
+def polyhedronTets(block, offset, firstCenter):
+    """
+    Splits an nfaced block into one tet per fan triangle of each face
+    and the polyhedron's center.  Returns (tets, element of each tet,
+    node ids, center of each node id); centers are numbered from
+    'firstCenter', and stand in the tets as -1 - their number until
+    the nodes are all counted.
+    """
+    faceCounts = block.faceCounts.astype(numpy.int64)
+    nodeCounts = block.nodeCounts.astype(numpy.int64)
+    nodes = block.connectivity.astype(numpy.int64) - 1 + offset
+
+    faceElement = numpy.repeat(numpy.arange(block.count), faceCounts)
+    faceStart = numpy.concatenate([[0], numpy.cumsum(nodeCounts)[:-1]])
+
+    # Fan triangles (0, j, j+1) of every face, j = 1 .. n-2.
+    triangles = nodeCounts - 2
+    triangleFace = numpy.repeat(numpy.arange(len(nodeCounts)), triangles)
+    j = numpy.arange(len(triangleFace)) - numpy.repeat(numpy.cumsum(triangles) - triangles, triangles) + 1
+    start = faceStart[triangleFace]
+    element = faceElement[triangleFace]
+
+    tets = numpy.stack([nodes[start], nodes[start + j], nodes[start + j + 1],
+                        -1 - (firstCenter + element)], axis=1)
+    return tets, element, nodes, firstCenter + numpy.repeat(faceElement, nodeCounts)
+
+
+def buildTetMesh(geometry):
+    """
+    Builds the tet mesh of the volume cells of an EnSight geometry (or
+    a store's).  Surface elements and ghosts are left out, but count in
+    the cell numbering, which is the VTK dataset's.
+    """
+    coordinates = []
+    tets = []
+    tetCells = []
+    centerNodes = []
+    centerIndex = []
+    offset = 0
+    cellOffset = 0
+    numberOfCenters = 0
+    for part in geometry.parts:
+        coordinates.append(numpy.asarray(part.getCoordinates(), dtype=numpy.float64))
+        for block in part.blocks:
+            if block.ghost or block.count == 0:
+                continue
+            elementType = block.elementType.replace("g_", "")
+            if elementType in TET_DECOMPOSITION:
+                table = numpy.array(TET_DECOMPOSITION[elementType])
+                connectivity = block.getConnectivity().astype(numpy.int64) + offset
+                tets.append(connectivity[:, table].reshape(-1, 4))
+                tetCells.append(cellOffset + numpy.repeat(numpy.arange(block.count), len(table)))
+            elif elementType == "nfaced":
+                blockTets, element, nodes, index = polyhedronTets(block, offset, numberOfCenters)
+                tets.append(blockTets)
+                tetCells.append(cellOffset + element)
+                centerNodes.append(nodes)
+                centerIndex.append(index)
+                numberOfCenters += block.count
+            cellOffset += block.count
+        offset += part.numberOfNodes
+
+    if not tets:
+        raise ValueError("No volume cells in " + geometry.fileName)
+    points = numpy.concatenate(coordinates)
+    tets = numpy.concatenate(tets)
+    tetCells = numpy.concatenate(tetCells)
+    if numberOfCenters == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return makeTetMesh(points, tets, tetCells, empty, empty)
+
+    # The centers go after the nodes.
+    centerNodes = numpy.concatenate(centerNodes)
+    centerIndex = numpy.concatenate(centerIndex)
+    counts = numpy.bincount(centerIndex, minlength=numberOfCenters)
+    centers = numpy.stack([numpy.bincount(centerIndex, weights=points[centerNodes, axis],
+                                          minlength=numberOfCenters) / counts
+                           for axis in range(3)], axis=1)
+    isCenter = tets < 0
+    tets[isCenter] = len(points) - 1 - tets[isCenter]
+    return makeTetMesh(numpy.concatenate([points, centers]), tets, tetCells, centerNodes, centerIndex)
+
+
+# =============================================================================
+#
+# Uniform bins: which tet a point is in
+#
+# =============================================================================
+
+class AMSUniformBins(object):
+    """
+    A uniform grid of bins over the mesh bounds, each listing the tets
+    whose bounding box overlaps it, so a point only has to be tested
+    against the tets of its bin.  'arrays' is what buildUniformBins()
+    computes.
+    """
+    def __init__(self, mesh, arrays, tolerance=1e-9, maxWalk=8, maxPairs=1 << 20):
+        self.mesh = mesh
+        self.arrays = arrays
+        self.tolerance = tolerance
+        self.maxWalk = maxWalk
+        self.maxPairs = maxPairs
+        self.low = arrays["low"]
+        self.binSize = arrays["binSize"]
+        self.dimensions = arrays["dimensions"]
+        self.binTets = arrays["binTets"]
+        self.binStart = arrays["binStart"]
+
+    def getBins(self, points):
+        """
+        Returns the bin of each point, or -1 for points outside the bounds.
+        Points on the high faces of the bounds (or within 'tolerance' bins
+        of any face) go in the bins along that face.
+        """
+        scaled = (points - self.low) / self.binSize
+        outside = ((scaled < -self.tolerance) | (scaled > self.dimensions + self.tolerance)).any(axis=1)
+        coordinates = numpy.clip(numpy.floor(scaled).astype(numpy.int64), 0, self.dimensions - 1)
+        bins = coordinates[:, 0] + self.dimensions[0] * (coordinates[:, 1] + self.dimensions[1] * coordinates[:, 2])
+        bins[outside] = -1
+        return bins
+
+    def getBinTets(self, points):
+        """
+        Returns where the list of tets of each point's bin starts in
+        binTets, and its length (0 for points outside the bounds).
+        """
+        bins = self.getBins(points)
+        start = self.binStart[numpy.maximum(bins, 0)]
+        count = numpy.where(bins >= 0, self.binStart[bins + 1] - start, 0)
+        return start, count
+
+    def getWeights(self, points, tets):
+        """
+        Returns the barycentric coordinates of points in tets, (n, 4),
+        and whether each point is inside its tet.
+        """
+        mesh = self.mesh
+        local = numpy.einsum("nij,nj->ni", mesh.inverse[tets], points - mesh.origin[tets])
+        weights = numpy.empty((len(points), 4))
+        weights[:, 0] = 1.0 - local.sum(axis=1)
+        weights[:, 1:] = local
+        inside = (weights >= -self.tolerance).all(axis=1)
+        return weights, inside
+
+    def locate(self, points, guess=None):
+        """
+        Returns (tets, weights) for an (n, 3) array of points: the tet each
+        point is in (-1 if none) and its barycentric coordinates there.
+        The search starts from 'guess', a likely tet for each point (or
+        -1), else from a tet of the point's bin, and walks towards the
+        point, up to 'maxWalk' tets; the points that walk off the mesh or
+        don't get there are tested against every tet of their bin.
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        tets = numpy.full(len(points), -1, dtype=numpy.int64)
+        weights = numpy.zeros((len(points), 4))
+
+        if guess is None:
+            start, count = self.getBinTets(points)
+            guess = numpy.where(count > 0, self.binTets[numpy.minimum(start, len(self.binTets) - 1)], -1)
+
+        walking = numpy.flatnonzero(guess >= 0)
+        current = guess[walking]
+        for step in range(self.maxWalk + 1):
+            w, inside = self.getWeights(points[walking], current)
+            found = walking[inside]
+            tets[found] = current[inside]
+            weights[found] = w[inside]
+            if step == self.maxWalk:
+                break
+            # Cross the face the point is farthest outside of.
+            w, current = w[~inside], current[~inside]
+            current = self.mesh.neighbors[current, numpy.argmin(w, axis=1)]
+            current[numpy.isnan(w).any(axis=1)] = -1
+            walking = walking[~inside][current >= 0]
+            current = current[current >= 0]
+            if len(walking) == 0:
+                break
+
+        remaining = numpy.flatnonzero(tets < 0)
+        start, count = self.getBinTets(points[remaining])
+        remaining, start, count = remaining[count > 0], start[count > 0], count[count > 0]
+
+        # Test every (point, tet of its bin) pair at once, up to
+        # 'maxPairs' pairs at a time, and keep each point's first hit.
+        ends = numpy.cumsum(count)
+        first = 0
+        while first < len(remaining):
+            last = max(first + 1, int(numpy.searchsorted(ends, ends[first] - count[first] + self.maxPairs,
+                                                         side="right")))
+            chunkCount = count[first:last]
+            pairPoints = numpy.repeat(numpy.arange(first, last), chunkCount)
+            offsets = numpy.arange(len(pairPoints)) - numpy.repeat(numpy.cumsum(chunkCount) - chunkCount, chunkCount)
+            candidates = self.binTets[start[pairPoints] + offsets]
+            w, inside = self.getWeights(points[remaining[pairPoints]], candidates)
+            hits = numpy.flatnonzero(inside)
+            firstHit = numpy.ones(len(hits), dtype=bool)
+            firstHit[1:] = pairPoints[hits[1:]] != pairPoints[hits[:-1]]
+            hits = hits[firstHit]
+            found = remaining[pairPoints[hits]]
+            tets[found] = candidates[hits]
+            weights[found] = w[hits]
+            first = last
+        return tets, weights
+
+
+def buildUniformBins(mesh, tetsPerBin=32.0, maxEntriesPerTet=16):
+    """
+    Bins shaped like the bounds, fine enough that the bins the mesh is
+    in list about 'tetsPerBin' tets each, as far as the lists stay under
+    'maxEntriesPerTet' entries per tet.  The bins are where walks start
+    and where the walks that fail fall back to, so they need not be
+    much finer than the few tets whose bounding boxes overlap any point.
+    """
+    bounds = numpy.array(mesh.getBounds()).reshape(3, 2)
+    low = bounds[:, 0]
+    extent = numpy.maximum(bounds[:, 1] - bounds[:, 0], 1e-30)
+    maxEntries = maxEntriesPerTet * mesh.getNumberOfTets()
+    # Flat tets have NaN inverses and no volume.
+    meshVolume = max(numpy.nansum(1.0 / numpy.abs(numpy.linalg.det(mesh.inverse))) / 6, 1e-300)
+
+    def countEntries(dimensions):
+        # The bins each tet overlaps, as ranges along each axis.
+        binSize = extent / dimensions
+        first = numpy.clip(numpy.floor((mesh.tetLow - low) / binSize).astype(numpy.int64), 0, dimensions - 1)
+        last = numpy.clip(numpy.floor((mesh.tetHigh - low) / binSize).astype(numpy.int64), 0, dimensions - 1)
+        spans = last - first + 1
+        return binSize, first, spans, spans.prod(axis=1)
+
+    # Start from bins the volume of a few tets.  Tets much bigger than
+    # the bins (badly graded meshes) would make the lists huge, so the
+    # bins grow until the lists fit.
+    binVolume = tetsPerBin * numpy.prod(extent) / mesh.getNumberOfTets()
+    dimensions = numpy.clip(numpy.ceil(extent / binVolume ** (1.0 / 3)), 1, 1024).astype(numpy.int64)
+    binSize, first, spans, counts = countEntries(dimensions)
+    while counts.sum() > maxEntries and not (dimensions == 1).all():
+        dimensions = numpy.maximum(dimensions // 2, 1)
+        binSize, first, spans, counts = countEntries(dimensions)
+
+    # The tets' bounding boxes overlap, and the mesh need not fill its
+    # bounds, so the bins the mesh is in list more tets than their volume
+    # holds: refine them towards 'tetsPerBin' while the lists fit.
+    for attempt in range(8):
+        perBin = counts.sum() * numpy.prod(binSize) / meshVolume
+        if perBin <= 1.25 * tetsPerBin:
+            break
+        finer = numpy.clip(numpy.ceil(dimensions * (perBin / tetsPerBin) ** (1.0 / 3)), 1, 1024).astype(numpy.int64)
+        if (finer == dimensions).all():
+            break
+        refined = countEntries(finer)
+        if refined[3].sum() > maxEntries:
+            break
+        dimensions = finer
+        binSize, first, spans, counts = refined
+
+    # One entry per (tet, bin) pair, sorted by bin.
+    tetIds = numpy.repeat(numpy.arange(len(counts)), counts)
+    local = numpy.arange(len(tetIds)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    spans = spans[tetIds]
+    x = first[tetIds, 0] + local % spans[:, 0]
+    y = first[tetIds, 1] + (local // spans[:, 0]) % spans[:, 1]
+    z = first[tetIds, 2] + local // (spans[:, 0] * spans[:, 1])
+    bins = x + dimensions[0] * (y + dimensions[1] * z)
+    order = numpy.argsort(bins, kind="stable")
+
+    return AMSUniformBins(mesh, {
+        "low": low,
+        "binSize": binSize,
+        "dimensions": dimensions,
+        "binTets": tetIds[order],
+        "binStart": numpy.searchsorted(bins[order], numpy.arange(dimensions.prod() + 1)),
+    })
+
+
+# =============================================================================
+#
+# k-d tree: the closest node to a point
+#
+# =============================================================================
+
+class AMSKdTree(object):
+    """
+    A balanced k-d tree over a set of points, stored as arrays: node k
+    has children 2k+1 and 2k+2, the leaves are the last 2^depth nodes,
+    and leaf i holds the points order[leafStart[i]:leafStart[i+1]].
+    Every node keeps its bounding box, so the search can skip the ones
+    farther away than the closest point found so far.  'arrays' is what
+    buildKdTree() computes.
+    """
+    def __init__(self, points, arrays):
+        self.points = points
+        self.arrays = arrays
+        self.order = arrays["order"]
+        self.leafStart = arrays["leafStart"]
+        self.splitAxis = arrays["splitAxis"]
+        self.splitValue = arrays["splitValue"]
+        self.nodeLow = arrays["nodeLow"]
+        self.nodeHigh = arrays["nodeHigh"]
+        self.depth = int(arrays["depth"][0])
+
+        # The points of each leaf as a padded table (-1 for padding).
+        leafSizes = numpy.diff(self.leafStart)
+        self.leafPoints = numpy.full((len(leafSizes), max(1, int(leafSizes.max()))), -1, dtype=numpy.int64)
+        for column in range(self.leafPoints.shape[1]):
+            has = leafSizes > column
+            self.leafPoints[has, column] = self.order[self.leafStart[:-1][has] + column]
+
+    def getFirstLeaf(self):
+        return (1 << self.depth) - 1
+
+    def descend(self, queries):
+        """
+        Returns the leaf each query point falls in.
+        """
+        node = numpy.zeros(len(queries), dtype=numpy.int64)
+        for level in range(self.depth):
+            right = queries[numpy.arange(len(queries)), self.splitAxis[node]] >= self.splitValue[node]
+            node = 2 * node + 1 + right
+        return node - self.getFirstLeaf()
+
+    def searchLeaves(self, queryPoints, queries, leaves, best, bestIds):
+        """
+        Updates the best distances and ids of queries from the points of
+        the given leaves (one leaf per entry of 'queries', which index
+        'queryPoints').
+        """
+        candidates = self.leafPoints[leaves]
+        valid = candidates >= 0
+        d = numpy.linalg.norm(self.points[numpy.where(valid, candidates, 0)] -
+                              queryPoints[queries][:, None, :], axis=2)
+        d[~valid] = numpy.inf
+        rows = numpy.arange(len(queries))
+        column = d.argmin(axis=1)
+        distance = d[rows, column]
+        ids = candidates[rows, column]
+
+        # A query can come with several leaves; keep the closest.
+        order = numpy.lexsort((distance, queries))
+        queries, distance, ids = queries[order], distance[order], ids[order]
+        first = numpy.ones(len(queries), dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+        queries, distance, ids = queries[first], distance[first], ids[first]
+        better = distance < best[queries]
+        best[queries[better]] = distance[better]
+        bestIds[queries[better]] = ids[better]
+
+    def findClosest(self, queryPoints, chunkSize=65536):
+        """
+        Returns (ids, distances) of the closest point to each of an (n, 3)
+        array of query points.
+        """
+        queryPoints = numpy.asarray(queryPoints, dtype=numpy.float64).reshape(-1, 3)
+        best = numpy.full(len(queryPoints), numpy.inf)
+        bestIds = numpy.full(len(queryPoints), -1, dtype=numpy.int64)
+        for start in range(0, len(queryPoints), chunkSize):
+            chunk = slice(start, start + chunkSize)
+            self.searchTree(queryPoints[chunk], best[chunk], bestIds[chunk])
+        return bestIds, best
+
+    def searchTree(self, queryPoints, best, bestIds):
+        # A first guess from the leaf each query falls in...
+        queries = numpy.arange(len(queryPoints))
+        self.searchLeaves(queryPoints, queries, self.descend(queryPoints), best, bestIds)
+
+        # ... then down the tree again, level by level, following only
+        # the nodes whose box is closer than the best so far.
+        nodes = numpy.zeros(len(queries), dtype=numpy.int64)
+        for level in range(self.depth + 1):
+            gap = numpy.maximum(self.nodeLow[nodes] - queryPoints[queries], 0.0) + \
+                  numpy.maximum(queryPoints[queries] - self.nodeHigh[nodes], 0.0)
+            near = numpy.linalg.norm(gap, axis=1) < best[queries]
+            queries, nodes = queries[near], nodes[near]
+            if level == self.depth:
+                self.searchLeaves(queryPoints, queries, nodes - self.getFirstLeaf(), best, bestIds)
+            else:
+                queries = numpy.repeat(queries, 2)
+                nodes = numpy.repeat(2 * nodes + 1, 2) + numpy.tile([0, 1], len(nodes))
+
+
+def buildKdTree(points, leafSize=32):
+    points = numpy.asarray(points, dtype=numpy.float64)
+    n = len(points)
+    depth = 0
+    while (n >> depth) > leafSize:
+        depth += 1
+
+    # Level by level, split every node's range of 'order' at its middle
+    # along its widest axis.  The ranges of level d are [i n / 2^d,
+    # (i + 1) n / 2^d).
+    order = numpy.arange(n)
+    numberOfInternal = (1 << depth) - 1
+    splitAxis = numpy.zeros(max(numberOfInternal, 1), dtype=numpy.int64)
+    splitValue = numpy.zeros(max(numberOfInternal, 1))
+    for level in range(depth):
+        for i in range(1 << level):
+            start = (i * n) >> level
+            end = ((i + 1) * n) >> level
+            middle = ((2 * i + 1) * n) >> (level + 1)
+            segment = order[start:end]
+            coordinates = points[segment]
+            axis = int((coordinates.max(axis=0) - coordinates.min(axis=0)).argmax())
+            part = numpy.argpartition(coordinates[:, axis], middle - start)
+            order[start:end] = segment[part]
+            node = (1 << level) - 1 + i
+            splitAxis[node] = axis
+            splitValue[node] = points[order[middle], axis]
+
+    # Boxes of the leaves, then of their parents.
+    leaves = 1 << depth
+    leafStart = (numpy.arange(leaves + 1) * n) >> depth
+    ordered = points[order]
+    nodeLow = numpy.empty((2 * leaves - 1, 3))
+    nodeHigh = numpy.empty((2 * leaves - 1, 3))
+    empty = leafStart[:-1] == leafStart[1:]
+    starts = numpy.minimum(leafStart[:-1], n - 1)
+    nodeLow[leaves - 1:] = numpy.minimum.reduceat(ordered, starts)
+    nodeHigh[leaves - 1:] = numpy.maximum.reduceat(ordered, starts)
+    nodeLow[leaves - 1:][empty] = numpy.inf
+    nodeHigh[leaves - 1:][empty] = -numpy.inf
+    for node in range(leaves - 2, -1, -1):
+        nodeLow[node] = numpy.minimum(nodeLow[2 * node + 1], nodeLow[2 * node + 2])
+        nodeHigh[node] = numpy.maximum(nodeHigh[2 * node + 1], nodeHigh[2 * node + 2])
+
+    return AMSKdTree(points, {
+        "order": order,
+        "leafStart": leafStart,
+        "splitAxis": splitAxis,
+        "splitValue": splitValue,
+        "nodeLow": nodeLow,
+        "nodeHigh": nodeHigh,
+        "depth": numpy.array([depth]),
+    })
+
+
+# =============================================================================
+#
+# The index
+#
+# =============================================================================
+
+class AMSSpatialIndex(object):
+    """
+    The tet mesh, bins and k-d tree of one case, and the batched queries
+    over them.
+    """
+    def __init__(self, mesh, bins, tree):
+        self.mesh = mesh
+        self.bins = bins
+        self.tree = tree
+
+    def getBounds(self):
+        return self.mesh.getBounds()
+
+    def locate(self, points, guess=None):
+        """
+        Returns (tets, barycentric weights) of an (n, 3) array of points;
+        see AMSUniformBins.locate().
+        """
+        return self.bins.locate(points, guess)
+
+    def findCells(self, points):
+        """
+        Returns (cells, tets, weights) for an (n, 3) array of points: the
+        cell of the dataset each point is in (-1 if none), and the tet
+        and weights to interpolate there.
+        """
+        tets, weights = self.bins.locate(points)
+        cells = numpy.where(tets >= 0, self.mesh.tetCells[numpy.maximum(tets, 0)], -1)
+        return cells, tets, weights
+
+    def interpolate(self, values, points, outside=numpy.nan):
+        """
+        Returns per-node values (scalars or vectors) interpolated at an
+        (n, 3) array of points, with 'outside' for points not in the mesh.
+        """
+        tets, weights = self.bins.locate(points)
+        inside = tets >= 0
+        result = self.mesh.interpolate(self.mesh.extendField(values), numpy.maximum(tets, 0), weights)
+        result[~inside] = outside
+        return result
+
+    def findClosestPoints(self, points):
+        """
+        Returns (node ids, distances) of the mesh node closest to each of
+        an (n, 3) array of points.
+        """
+        return self.tree.findClosest(points)
+
+    def getArrays(self):
+        arrays = {}
+        for prefix, part in (("mesh", self.mesh), ("bins", self.bins), ("tree", self.tree)):
+            for name, array in part.arrays.items():
+                if name not in ("tetLow", "tetHigh"):
+                    arrays[prefix + "." + name] = array
+        return arrays
+
+
+def resampleToImage(index, pointArrays, resolution):
+    """
+    Samples per-node arrays ({name: values}) onto an image over the mesh
+    bounds, 'resolution' points along its longest side, like
+    ResampleToImage: points outside the mesh get 0 and are marked 0 in
+    a vtkValidPointMask array.
+    """
+    if numpy_support is None:
+        raise ImportError("resampleToImage() requires VTK")
+
+    bounds = index.getBounds()
+    dimensions = AMSPyramid.levelDimensions(bounds, resolution)
+    axes = [numpy.linspace(bounds[2 * i], bounds[2 * i + 1], dimensions[i]) for i in range(3)]
+    grid = numpy.meshgrid(*axes, indexing="ij")
+    # VTK images run x fastest.
+    points = numpy.stack([g.ravel(order="F") for g in grid], axis=1)
+    tets, weights = index.locate(points)
+    valid = tets >= 0
+
+    image = vtkImageData()
+    image.SetDimensions(*dimensions)
+    image.SetOrigin(bounds[0], bounds[2], bounds[4])
+    image.SetSpacing(*[(bounds[2 * i + 1] - bounds[2 * i]) / max(dimensions[i] - 1, 1) for i in range(3)])
+
+    def addArray(name, values):
+        array = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(values), deep=1)
+        array.SetName(name)
+        image.GetPointData().AddArray(array)
+
+    for name, values in pointArrays.items():
+        sampled = index.mesh.interpolate(index.mesh.extendField(values), numpy.maximum(tets, 0), weights)
+        sampled[~valid] = 0.0
+        addArray(name, sampled.astype(numpy.float32))
+    addArray("vtkValidPointMask", valid.astype(numpy.int8))
+    return image
+
+
+def buildSpatialIndex(geometry):
+    mesh = buildTetMesh(geometry)
+    bins = buildUniformBins(mesh)
+    tree = buildKdTree(mesh.points[:mesh.numberOfNodes])
+    return AMSSpatialIndex(mesh, bins, tree)
+
+
+# =============================================================================
+#
+# Persistence
+#
+# =============================================================================
+
+def getSpatialIndexDir(caseFile):
+    return caseFile + SPATIAL_INDEX_SUFFIX
+
+
+def saveSpatialIndex(caseFile, index, geometryFile):
+    """
+    Writes the index next to the case.  The arrays go into a fresh
+    directory that replaces the old one, and index.json is written
+    last, so a half-written index is never picked up.
+    """
+    directory = getSpatialIndexDir(caseFile)
+    building = directory + ".tmp%d" % os.getpid()
+    os.makedirs(building)
+    try:
+        arrays = index.getArrays()
+        for name, array in arrays.items():
+            numpy.save(os.path.join(building, name + ".npy"), numpy.ascontiguousarray(array))
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.rename(building, directory)
+    except Exception:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+    info = {
+        "version": SPATIAL_INDEX_VERSION,
+        "caseFile": caseFile,
+        "signature": AMSCatalog.fileSignature([geometryFile]),
+        "arrays": sorted(arrays.keys()),
+        "numberOfTets": index.mesh.getNumberOfTets(),
+        "numberOfNodes": index.mesh.numberOfNodes,
+        "bins": [int(d) for d in index.bins.dimensions],
+    }
+    indexFile = os.path.join(directory, INDEX_FILE)
+    with open(indexFile + ".tmp", "w") as fp:
+        json.dump(info, fp, indent=1)
+    os.rename(indexFile + ".tmp", indexFile)
+
+
+def loadSpatialIndex(caseFile):
+    """
+    Returns the saved index of a case, mapped rather than read, or None
+    if it has none or its geometry changed since it was built.
+    """
+    directory = getSpatialIndexDir(caseFile)
+    try:
+        with open(os.path.join(directory, INDEX_FILE)) as fp:
+            info = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if info.get("version") != SPATIAL_INDEX_VERSION:
+        return None
+    if AMSCatalog.fileSignature(info["signature"].keys()) != info["signature"]:
+        return None
+
+    parts = {"mesh": {}, "bins": {}, "tree": {}}
+    try:
+        for name in info["arrays"]:
+            prefix, arrayName = name.split(".", 1)
+            parts[prefix][arrayName] = numpy.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+    except (IOError, OSError, ValueError):
+        return None
+    mesh = AMSTetMesh(parts["mesh"])
+    return AMSSpatialIndex(mesh, AMSUniformBins(mesh, parts["bins"]),
+                           AMSKdTree(mesh.points[:mesh.numberOfNodes], parts["tree"]))
+
+
+def getSpatialIndex(caseFile, case=None, force=False):
+    """
+    Returns the index of a case: the saved one if it is up to date, else
+    a new one, which is saved for next time if the case's directory can
+    be written to.
+    """
+    if not force:
+        index = loadSpatialIndex(caseFile)
+        if index is not None:
+            return index
+
+    if case is None:
+        case = AMSStore.openCase(caseFile)
+    geometry = case.getGeometry()
+    start = time.time()
+    index = buildSpatialIndex(geometry)
+    print("built spatial index of %s in %.1f s (%d tets)" % (caseFile, time.time() - start,
+                                                              index.mesh.getNumberOfTets()))
+    try:
+        saveSpatialIndex(caseFile, index, geometry.fileName)
+    except (IOError, OSError) as e:
+        print("could not save the spatial index of %s: %s" % (caseFile, e))
+    return index
+
+
+# =============================================================================
+# Main: build the indices of the cases in a data config file
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the spatial indices of the dataCatalog cases")
+    parser.add_argument("--dataConfigFile", required=True, help="Path to a data config file")
+    parser.add_argument("--force", action="store_true", help="Rebuild indices that are up to date")
+    args = parser.parse_args()
+
+    with open(args.dataConfigFile) as fp:
+        dataCatalog = json.load(fp)["dataCatalog"]
+
+    for name in sorted(dataCatalog.keys()):
+        # Differences have no files of their own.
+        if "difference" in dataCatalog[name]:
+            continue
+        print("building spatial index for " + name)
+        getSpatialIndex(dataCatalog[name]["fileName"], force=args.force)
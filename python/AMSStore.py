@@ -0,0 +1,677 @@
+r"""
+A compact columnar store for EnSight cases.
+
+An EnSight export keeps every variable in its own float32 file, next to
+a geometry file that every variant of the same tank repeats.  The store
+puts one time step of a case into a single file (.amss):
+
+    magic | geometry blobs | variable chunks ... | footer (JSON) | trailer
+
+The geometry block (coordinates and connectivity of every part) is
+written once, and a store may refer to the geometry block of another
+store instead of repeating it, if the meshes are identical.  Each
+variable is split, part by part, into chunks of nodes.  Every chunk
+records the min/max of each component, and may be
+
+    float32   as exported (lossless)
+    float16   half precision
+    q16, q8   16 or 8-bit integers over the variable's range
+
+and, independently, zlib compressed (after a byte shuffle, which makes
+float data compress much better).  The largest quantization error of
+every variable is measured while converting and kept in the footer.
+
+    $ python AMSStore.py mat-viz-...-100rpm.case 100rpm.amss --encoding auto --max-error 1e-4 --compress
+
+AMSStoreCase reads a store with the same interface as
+AMSEnSight.AMSEnSightCase, so everything that takes a case (the VTK
+conversion, span-space indices, the catalog) takes a store as well; use
+openCase() to open either.  Uncompressed float32 chunks are handed out
+as zero-copy views of the mapped file, like the EnSight reader does.
+"""
+
+import os, json, zlib, struct, hashlib
+
+import numpy
+
+import AMSEnSight
+
+MAGIC = b"AMSSTOR1"
+TRAILER = struct.Struct("<QQ8s")       # footer offset, footer size, magic
+
+STORE_VERSION = 1
+STORE_SUFFIX = ".amss"
+
+ENCODINGS = ("float32", "float16", "q16", "q8")
+
+# Nodes per chunk.  Small enough that the chunk statistics are useful,
+# big enough that zlib has something to work with.
+DEFAULT_CHUNK_SIZE = 65536
+
+# Blobs start on this boundary, so uncompressed ones can be viewed as
+# arrays straight from the mapped file.
+ALIGNMENT = 16
+
+# =============================================================================
+#
+# Encoding
+#
+# =============================================================================
+
+def shuffle(raw, itemSize):
+    """
+    Regroups the bytes of an array so that all first bytes come first,
+    then all second bytes, etc.  Neighbouring floats share their high
+    bytes, so this gives zlib long runs to work with.
+    """
+    if itemSize == 1:
+        return raw
+    return numpy.frombuffer(raw, dtype=numpy.uint8).reshape(-1, itemSize).T.tobytes()
+
+
+def unshuffle(raw, itemSize):
+    if itemSize == 1:
+        return raw
+    return numpy.frombuffer(raw, dtype=numpy.uint8).reshape(itemSize, -1).T.tobytes()
+
+
+def quantize(values, encoding, low, high):
+    """
+    Encodes float values (components along the first axis) as the
+    given encoding.  'low' and 'high' are per-component ranges, used by
+    the integer encodings.
+    """
+    if encoding == "float32":
+        return numpy.ascontiguousarray(values, dtype="<f4")
+    if encoding == "float16":
+        return numpy.ascontiguousarray(values, dtype="<f2")
+    levels = 255 if encoding == "q8" else 65535
+    dtype = "<u1" if encoding == "q8" else "<u2"
+    low = numpy.asarray(low, dtype=numpy.float64).reshape(-1, 1)
+    span = numpy.asarray(high, dtype=numpy.float64).reshape(-1, 1) - low
+    span[span == 0] = 1.0
+    scaled = numpy.rint((values - low) / span * levels)
+    return numpy.clip(scaled, 0, levels).astype(dtype)
+
+
+def dequantize(encoded, encoding, low, high):
+    """
+    The inverse of quantize(), as float32.
+    """
+    if encoding in ("float32", "float16"):
+        return encoded.astype(numpy.float32, copy=False)
+    levels = 255.0 if encoding == "q8" else 65535.0
+    low = numpy.asarray(low, dtype=numpy.float32).reshape(-1, 1)
+    span = numpy.asarray(high, dtype=numpy.float32).reshape(-1, 1) - low
+    return (encoded.astype(numpy.float32) * (span / numpy.float32(levels)) + low).astype(numpy.float32)
+
+
+def chooseEncoding(values, low, high, maxError):
+    """
+    Returns the most compact encoding whose error stays within
+    'maxError' (a fraction of each component's range), and that error.
+    """
+    span = max(float(numpy.max(numpy.asarray(high) - numpy.asarray(low))), 1e-30)
+    for encoding in ("q8", "q16", "float16"):
+        error = measureError(values, encoding, low, high)
+        if error <= maxError * span:
+            return encoding, error
+    return "float32", 0.0
+
+
+def measureError(values, encoding, low, high):
+    if encoding == "float32" or values.size == 0:
+        return 0.0
+    decoded = dequantize(quantize(values, encoding, low, high), encoding, low, high)
+    with numpy.errstate(invalid="ignore", over="ignore"):
+        error = numpy.abs(decoded.astype(numpy.float64) - values)
+    return float(numpy.nanmax(error)) if numpy.isfinite(error).any() else float("inf")
+
+
+# =============================================================================
+#
+# Writing
+#
+# =============================================================================
+
+class AMSStoreWriter(object):
+    """
+    Appends blobs to a store file and builds its footer.
+    """
+    def __init__(self, fileName, compress=False, level=6):
+        self.fileName = fileName
+        self.compress = compress
+        self.level = level
+        self.fp = open(fileName + ".tmp", "wb")
+        self.fp.write(MAGIC)
+        self.offset = len(MAGIC)
+
+    def align(self):
+        padding = (-self.offset) % ALIGNMENT
+        if padding:
+            self.fp.write(b"\0" * padding)
+            self.offset += padding
+
+    def writeArray(self, array, compress=None):
+        """
+        Writes an array and returns its descriptor for the footer.
+        """
+        array = numpy.ascontiguousarray(array)
+        if array.dtype.byteorder == ">":
+            array = array.astype(array.dtype.newbyteorder("<"))
+        raw = array.tobytes()
+        compression = None
+        if self.compress if compress is None else compress:
+            raw = zlib.compress(shuffle(raw, array.dtype.itemsize), self.level)
+            compression = "zlib"
+
+        self.align()
+        descriptor = {
+            "offset": self.offset,
+            "size": len(raw),
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "compression": compression,
+        }
+        self.fp.write(raw)
+        self.offset += len(raw)
+        return descriptor
+
+    def close(self, footer):
+        """
+        Writes the footer and trailer, and moves the file into place.
+        """
+        raw = json.dumps(footer).encode("utf-8")
+        footerOffset = self.offset
+        self.fp.write(raw)
+        self.fp.write(TRAILER.pack(footerOffset, len(raw), MAGIC))
+        self.fp.close()
+        os.rename(self.fileName + ".tmp", self.fileName)
+
+
+def geometryDigest(geometry):
+    """
+    A hash of the coordinates and connectivity, to tell whether two
+    cases share their mesh.
+    """
+    digest = hashlib.sha1()
+    for part in geometry.parts:
+        digest.update(str((part.partId, part.numberOfNodes)).encode("ascii"))
+        digest.update(numpy.ascontiguousarray(part.coordinates, dtype="<f4").tobytes())
+        for block in part.blocks:
+            digest.update(block.elementType.encode("ascii"))
+            for array in (block.nodeCounts, block.faceCounts, block.connectivity):
+                if array is not None:
+                    digest.update(numpy.ascontiguousarray(array, dtype="<i4").tobytes())
+    return digest.hexdigest()
+
+
+def writeGeometry(writer, geometry):
+    parts = []
+    for part in geometry.parts:
+        blocks = []
+        for block in part.blocks:
+            entry = {"elementType": block.elementType, "count": block.count}
+            for name in ("connectivity", "nodeCounts", "faceCounts"):
+                array = getattr(block, name)
+                entry[name] = writer.writeArray(array.astype("<i4")) if array is not None else None
+            blocks.append(entry)
+        parts.append({
+            "id": part.partId,
+            "description": part.description,
+            "numberOfNodes": part.numberOfNodes,
+            "coordinates": writer.writeArray(part.coordinates.astype("<f4")),
+            "blocks": blocks,
+        })
+    return parts
+
+
+def variableRange(case, name, components, timeStep=0):
+    """
+    Returns (magnitude range, per-component ranges) over the whole case,
+    at one time step.
+    """
+    ranges = [list(case.getRange(name, i, timeStep)) for i in range(components)] if components > 1 \
+        else [list(case.getRange(name, 0, timeStep))]
+    magnitude = list(case.getRange(name, -1, timeStep))
+    return magnitude, ranges
+
+
+def writeVariable(writer, case, name, encoding, maxError, chunkSize, timeStep=0):
+    """
+    Writes one variable in chunks and returns its footer entry.  With
+    encoding 'auto' the encoding is picked per variable to meet
+    'maxError'.
+    """
+    info = case.getVariableInfo(name)
+    components = info["components"]
+    variable = case.getVariable(name, timeStep)
+    magnitude, ranges = variableRange(case, name, components, timeStep)
+    low = [r[0] for r in ranges]
+    high = [r[1] for r in ranges]
+
+    # Component-major, like EnSight: (components, count).
+    def columns(values):
+        return values.reshape(1, -1) if components == 1 else values.T
+
+    if encoding == "auto":
+        sample = [columns(values) for values in variable.values.values() if len(values)]
+        sample = numpy.concatenate(sample, axis=1) if sample else numpy.zeros((components, 0), numpy.float32)
+        encoding, error = chooseEncoding(sample, low, high, maxError)
+    else:
+        error = 0.0
+
+    entry = {
+        "type": info["type"],
+        "location": info["location"],
+        "components": components,
+        "encoding": encoding,
+        "range": magnitude if magnitude[0] <= magnitude[1] else None,
+        "componentRanges": ranges,
+        "low": low,
+        "high": high,
+        "maxError": error,
+        "values": {},
+    }
+
+    for key, values in sorted(variable.values.items(), key=lambda item: str(item[0])):
+        data = columns(values)
+        chunks = []
+        for start in range(0, max(data.shape[1], 1), chunkSize):
+            piece = data[:, start:start + chunkSize].astype(numpy.float64)
+            encoded = quantize(piece, encoding, low, high)
+            chunk = writer.writeArray(encoded)
+            chunk["start"] = start
+            chunk["min"] = [float(v) for v in piece.min(axis=1)] if piece.size else None
+            chunk["max"] = [float(v) for v in piece.max(axis=1)] if piece.size else None
+            if encoding != "float32" and piece.size:
+                decoded = dequantize(encoded, encoding, low, high)
+                entry["maxError"] = max(entry["maxError"], float(numpy.abs(decoded - piece).max()))
+            chunks.append(chunk)
+        storeKey = str(key) if not isinstance(key, tuple) else "%d/%d" % key
+        entry["values"][storeKey] = {"count": data.shape[1], "chunks": chunks}
+    return entry
+
+
+def convert(caseFile, storeFile, encoding="float32", maxError=1e-4, compress=False,
+            chunkSize=DEFAULT_CHUNK_SIZE, geometryFrom=None, variables=None, timeStep=0,
+            level=6):
+    """
+    Writes one time step of an EnSight case as a store.  If 'geometryFrom'
+    names a store with the same mesh, the new store refers to its
+    geometry block instead of repeating it.
+    """
+    if encoding != "auto" and encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding " + encoding)
+
+    case = AMSEnSight.AMSEnSightCase(caseFile)
+    writer = AMSStoreWriter(storeFile, compress, level)
+    try:
+        geometry = case.getGeometry(timeStep)
+        digest = geometryDigest(geometry)
+
+        footer = {
+            "version": STORE_VERSION,
+            "source": os.path.abspath(caseFile),
+            "timeValues": [case.getTimeValues()[timeStep]] if case.getTimeValues() else [0.0],
+            "geometry": {"digest": digest},
+            "numberOfPoints": geometry.getNumberOfPoints(),
+            "numberOfCells": geometry.getNumberOfCells(),
+            "chunkSize": chunkSize,
+            "variableNames": [],
+            "variables": {},
+        }
+
+        shared = None
+        if geometryFrom is not None:
+            shared = AMSStoreFile(geometryFrom)
+            if shared.footer["geometry"]["digest"] != digest:
+                print("geometry of " + geometryFrom + " differs, writing our own")
+                shared = None
+        if shared is not None:
+            footer["geometry"]["file"] = os.path.relpath(os.path.abspath(shared.fileName),
+                                                         os.path.dirname(os.path.abspath(storeFile)))
+            shared.close()
+        else:
+            footer["geometry"]["parts"] = writeGeometry(writer, geometry)
+
+        for name in variables or case.getVariableNames():
+            footer["variables"][name] = writeVariable(writer, case, name, encoding,
+                                                      maxError, chunkSize, timeStep)
+            footer["variableNames"].append(name)
+            # Don't keep 100 files mapped at once.
+            case.release(name)
+
+        writer.close(footer)
+        return footer
+    except Exception:
+        writer.fp.close()
+        os.remove(storeFile + ".tmp")
+        raise
+    finally:
+        case.close()
+
+
+# =============================================================================
+#
+# Reading
+#
+# =============================================================================
+
+class AMSStoreFile(object):
+    """
+    A store file, mapped into memory, and its footer.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.file = AMSEnSight.AMSMappedFile(fileName)
+        buffer = self.file.buffer
+        if self.file.size < len(MAGIC) + TRAILER.size or buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a case store: " + fileName)
+        footerOffset, footerSize, magic = TRAILER.unpack(buffer[self.file.size - TRAILER.size:])
+        if magic != MAGIC:
+            raise ValueError("Truncated case store: " + fileName)
+        self.footer = json.loads(buffer[footerOffset:footerOffset + footerSize].decode("utf-8"))
+        if self.footer.get("version") != STORE_VERSION:
+            raise ValueError("Unsupported case store version in " + fileName)
+
+    def readArray(self, descriptor):
+        """
+        Returns the array for a blob descriptor: a view of the mapped file
+        if the blob isn't compressed, else a decompressed copy.
+        """
+        dtype = numpy.dtype(descriptor["dtype"])
+        count = int(numpy.prod(descriptor["shape"]))
+        if descriptor["compression"] is None:
+            values = numpy.frombuffer(self.file.buffer, dtype=dtype, count=count,
+                                      offset=descriptor["offset"])
+        else:
+            raw = self.file.buffer[descriptor["offset"]:descriptor["offset"] + descriptor["size"]]
+            raw = unshuffle(zlib.decompress(raw), dtype.itemsize)
+            values = numpy.frombuffer(raw, dtype=dtype, count=count)
+        return values.reshape(descriptor["shape"])
+
+    def close(self):
+        self.file.close()
+
+
+class AMSStoreGeometry(object):
+    """
+    The geometry block of a store, as the same part and block objects
+    AMSEnSightGeometry has.
+    """
+    def __init__(self, store, parts):
+        self.fileName = store.fileName
+        self.store = store
+        self.parts = []
+        self.partIndex = {}
+        self.byteOrder = "<"
+
+        for entry in parts:
+            part = AMSEnSight.AMSEnSightPart(entry["id"], entry["description"])
+            part.numberOfNodes = entry["numberOfNodes"]
+            part.coordinates = store.readArray(entry["coordinates"])
+            for blockEntry in entry["blocks"]:
+                block = AMSEnSight.AMSEnSightElementBlock(blockEntry["elementType"], blockEntry["count"])
+                for name in ("connectivity", "nodeCounts", "faceCounts"):
+                    if blockEntry[name] is not None:
+                        setattr(block, name, store.readArray(blockEntry[name]))
+                part.blocks.append(block)
+            self.parts.append(part)
+            self.partIndex[part.partId] = part
+
+    def getPart(self, partId):
+        return self.partIndex[partId]
+
+    def getPartIds(self):
+        return [part.partId for part in self.parts]
+
+    def getNumberOfPoints(self):
+        return sum(part.numberOfNodes for part in self.parts)
+
+    def getNumberOfCells(self):
+        return sum(part.getNumberOfElements() for part in self.parts)
+
+    def close(self):
+        self.parts = []
+        self.partIndex = {}
+
+
+class AMSStoreVariable(object):
+    """
+    One variable of a store, decoded.  Like AMSEnSightVariable, 'values'
+    holds per-node values by part id and per-element values by (part id,
+    block index), (count, components) for multi-component variables.
+    """
+    def __init__(self, store, entry):
+        self.entry = entry
+        self.components = entry["components"]
+        self.location = entry["location"]
+        self.values = {}
+
+        low, high = entry["low"], entry["high"]
+        for key, stored in entry["values"].items():
+            chunks = stored["chunks"]
+            if self.isContiguous(entry, chunks):
+                # Plain float32 chunks back to back: one view of the file
+                # for the whole part, no copy.
+                data = store.readArray({
+                    "offset": chunks[0]["offset"],
+                    "size": sum(chunk["size"] for chunk in chunks),
+                    "dtype": chunks[0]["dtype"],
+                    "shape": [1, stored["count"]],
+                    "compression": None,
+                })
+            else:
+                pieces = [dequantize(store.readArray(chunk), entry["encoding"], low, high)
+                          for chunk in chunks]
+                data = pieces[0] if len(pieces) == 1 else numpy.concatenate(pieces, axis=1)
+            values = data[0] if self.components == 1 else data.T
+            if "/" in key:
+                key = tuple(int(k) for k in key.split("/"))
+            else:
+                key = int(key)
+            self.values[key] = values
+
+    @staticmethod
+    def isContiguous(entry, chunks):
+        if entry["encoding"] != "float32" or entry["components"] != 1:
+            return False
+        for previous, chunk in zip(chunks, chunks[1:]):
+            if chunk["offset"] != previous["offset"] + previous["size"]:
+                return False
+        return all(chunk["compression"] is None for chunk in chunks)
+
+    def getRange(self, component=-1):
+        """
+        The range recorded when the store was written, of the original
+        values.
+        """
+        if self.components == 1 or component < 0:
+            value = self.entry["range"]
+        else:
+            value = self.entry["componentRanges"][component]
+        if value is None:
+            return (numpy.inf, -numpy.inf)
+        return tuple(value)
+
+    def close(self):
+        self.values = {}
+
+
+class AMSStoreCase(object):
+    """
+    A case store, read through the same interface as AMSEnSightCase.  The
+    geometry is read the first time it is needed, and each variable is
+    decoded the first time it is asked for.
+    """
+    def __init__(self, storeFile):
+        self.caseFile = os.path.abspath(storeFile)
+        self.store = AMSStoreFile(self.caseFile)
+        self.footer = self.store.footer
+        self.variableNames = list(self.footer["variableNames"])
+        self.timeValues = self.footer["timeValues"]
+
+        self.geometryStore = None
+        self.geometry = None
+        self.variables = {}         # (name, time step) -> AMSStoreVariable
+
+    def getGeometryFile(self):
+        """
+        The store that holds our geometry block: ours, or a shared one.
+        """
+        shared = self.footer["geometry"].get("file")
+        if shared is None:
+            return self.caseFile
+        return os.path.join(os.path.dirname(self.caseFile), shared)
+
+    def getFiles(self, timeStep=0):
+        files = [self.caseFile]
+        if self.getGeometryFile() != self.caseFile:
+            files.append(self.getGeometryFile())
+        return files
+
+    def getVariableNames(self):
+        return list(self.variableNames)
+
+    def getVariableInfo(self, name):
+        entry = self.footer["variables"][name]
+        return {
+            "type": entry["type"],
+            "location": entry["location"],
+            "components": entry["components"],
+            "encoding": entry["encoding"],
+            "maxError": entry["maxError"],
+        }
+
+    def getNumberOfComponents(self, name):
+        return self.footer["variables"][name]["components"]
+
+    def getTimeValues(self):
+        return list(self.timeValues)
+
+    def getGeometry(self, timeStep=0):
+        if self.geometry is None:
+            fileName = self.getGeometryFile()
+            if fileName == self.caseFile:
+                store = self.store
+            else:
+                store = self.geometryStore = AMSStoreFile(fileName)
+                if store.footer["geometry"]["digest"] != self.footer["geometry"]["digest"]:
+                    raise ValueError("Shared geometry " + fileName + " changed since " +
+                                     self.caseFile + " was written")
+            self.geometry = AMSStoreGeometry(store, store.footer["geometry"]["parts"])
+        return self.geometry
+
+    def getVariable(self, name, timeStep=0):
+        key = (name, timeStep)
+        if key not in self.variables:
+            if name not in self.footer["variables"]:
+                raise KeyError("No variable named " + name + " in " + self.caseFile)
+            self.variables[key] = AMSStoreVariable(self.store, self.footer["variables"][name])
+        return self.variables[key]
+
+    def getPartArray(self, name, partId, timeStep=0):
+        return self.getVariable(name, timeStep).values.get(partId)
+
+    def getPointArray(self, name, timeStep=0):
+        variable = self.getVariable(name, timeStep)
+        pieces = []
+        for part in self.getGeometry(timeStep).parts:
+            values = variable.values.get(part.partId)
+            if values is None:
+                shape = (part.numberOfNodes,) if variable.components == 1 else (part.numberOfNodes, variable.components)
+                values = numpy.full(shape, numpy.nan, dtype=numpy.float32)
+            pieces.append(values)
+        return numpy.concatenate(pieces)
+
+    def getRange(self, name, component=-1, timeStep=0):
+        """
+        Comes from the footer, so nothing has to be decoded.
+        """
+        entry = self.footer["variables"][name]
+        if entry["components"] == 1 or component < 0:
+            value = entry["range"]
+        else:
+            value = entry["componentRanges"][component]
+        if value is None:
+            return (numpy.inf, -numpy.inf)
+        return tuple(value)
+
+    def getChunkStats(self, name, partId):
+        """
+        Returns [(first node, node count, min per component, max per
+        component)] for the chunks of a variable on a part, without
+        decoding anything.
+        """
+        stored = self.footer["variables"][name]["values"].get(str(partId))
+        if stored is None:
+            return []
+        return [(chunk["start"], chunk["shape"][-1], chunk["min"], chunk["max"])
+                for chunk in stored["chunks"]]
+
+    def isLoaded(self, name, timeStep=0):
+        return (name, timeStep) in self.variables
+
+    def getLoadedVariables(self):
+        return sorted(set(name for name, timeStep in self.variables.keys()))
+
+    def release(self, name=None):
+        for key in list(self.variables.keys()):
+            if name is None or key[0] == name:
+                self.variables.pop(key).close()
+
+    def close(self):
+        self.release()
+        if self.geometry is not None:
+            self.geometry.close()
+            self.geometry = None
+        if self.geometryStore is not None:
+            self.geometryStore.close()
+            self.geometryStore = None
+        self.store.close()
+
+
+def isStore(fileName):
+    return fileName.endswith(STORE_SUFFIX)
+
+
+def openCase(fileName):
+    """
+    Opens an EnSight case or a case store, by its file name.
+    """
+    if isStore(fileName):
+        return AMSStoreCase(fileName)
+    return AMSEnSight.AMSEnSightCase(fileName)
+
+
+# =============================================================================
+# Main: convert an EnSight case
+# =============================================================================
+
+if __name__ == "__main__":
+    import argparse, time
+
+    parser = argparse.ArgumentParser(description="Convert an EnSight Gold case to a case store")
+    parser.add_argument("caseFile", help="EnSight .case file")
+    parser.add_argument("storeFile", help="Store to write (" + STORE_SUFFIX + ")")
+    parser.add_argument("--encoding", default="float32", choices=ENCODINGS + ("auto",),
+                        help="How to store the values; 'auto' picks the smallest that meets --max-error")
+    parser.add_argument("--max-error", type=float, default=1e-4, dest="maxError",
+                        help="Largest error for 'auto', as a fraction of each variable's range")
+    parser.add_argument("--compress", action="store_true", help="zlib-compress the chunks")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, dest="chunkSize",
+                        help="Nodes per chunk")
+    parser.add_argument("--geometry-from", default=None, dest="geometryFrom",
+                        help="Refer to the geometry of this store if it is the same mesh")
+    parser.add_argument("--time-step", type=int, default=0, dest="timeStep")
+    args = parser.parse_args()
+
+    start = time.time()
+    footer = convert(args.caseFile, args.storeFile, args.encoding, args.maxError, args.compress,
+                     args.chunkSize, args.geometryFrom, timeStep=args.timeStep)
+    print("wrote %s (%.1f MB) in %.1f s" % (args.storeFile, os.path.getsize(args.storeFile) / 1048576.0,
+                                             time.time() - start))
+    for name in footer["variableNames"]:
+        entry = footer["variables"][name]
+        print("  %-30s %-8s max error %g" % (name, entry["encoding"], entry["maxError"]))
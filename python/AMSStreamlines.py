@@ -0,0 +1,299 @@
+r"""
+Streamlines traced with NumPy, all seeds at once.
+
+StreamTracer integrates one seed after another, and every change of a
+seed or step setting traces all of them again.  Here the seeds advance
+together: each integration step is a handful of array operations over
+every streamline still going, and each streamline stops on its own
+(leaving the domain, standing still, running out of steps or length)
+by dropping out of the active mask.
+
+Points are located in the case's spatial index (AMSSpatialIndex),
+whose tets give the interpolation weights, after trying the tet the
+streamline was last in.
+
+The integrators and their defaults follow StreamTracer's: Runge-Kutta
+4-5 (Cash-Karp) with an adaptive step measured in cell lengths, or
+Runge-Kutta 4 with a fixed step, in both directions from each seed.
+
+    >>> index = AMSSpatialIndex.getSpatialIndex(caseFile, case)
+    >>> tracer = AMSStreamlineTracer(index, case.getPointArray("velocity"))
+    >>> lines = tracer.trace(lineSeeds(index.getBounds(), 200), maxSteps=600)
+    >>> polyData = lines.makeVTKPolyData({"pressure": case.getPointArray("pressure")})
+"""
+
+import numpy
+
+try:
+    from vtk.util import numpy_support
+    from vtk.vtkCommonCore import vtkPoints
+    from vtk.vtkCommonDataModel import vtkPolyData, vtkCellArray
+except ImportError:
+    # Tracing only needs NumPy.
+    numpy_support = None
+
+# =============================================================================
+#
+# Integration
+#
+# =============================================================================
+
+# Butcher tableaux: stage coefficients, solution weights, and for the
+# adaptive scheme the difference between its 5th and 4th order weights.
+RUNGE_KUTTA_4 = {
+    "stages": [[], [0.5], [0.0, 0.5], [0.0, 0.0, 1.0]],
+    "weights": [1.0 / 6, 1.0 / 3, 1.0 / 3, 1.0 / 6],
+    "error": None,
+}
+
+CASH_KARP_45 = {
+    "stages": [[],
+               [1.0 / 5],
+               [3.0 / 40, 9.0 / 40],
+               [3.0 / 10, -9.0 / 10, 6.0 / 5],
+               [-11.0 / 54, 5.0 / 2, -70.0 / 27, 35.0 / 27],
+               [1631.0 / 55296, 175.0 / 512, 575.0 / 13824, 44275.0 / 110592, 253.0 / 4096]],
+    "weights": [37.0 / 378, 0.0, 250.0 / 621, 125.0 / 594, 0.0, 512.0 / 1771],
+    "error": [37.0 / 378 - 2825.0 / 27648, 0.0, 250.0 / 621 - 18575.0 / 48384,
+              125.0 / 594 - 13525.0 / 55296, -277.0 / 14336, 512.0 / 1771 - 0.25],
+}
+
+INTEGRATORS = {
+    "rk4": RUNGE_KUTTA_4,
+    "rk45": CASH_KARP_45,
+}
+
+# Why a streamline stopped, as in StreamTracer's ReasonForTermination.
+OUT_OF_DOMAIN = 1
+OUT_OF_LENGTH = 4
+OUT_OF_STEPS = 5
+STAGNATION = 6
+
+
+def lineSeeds(bounds, resolution):
+    """
+    Returns resolution + 1 seeds along the diagonal of the bounds, like
+    StreamTracer's default High Resolution Line Source.
+    """
+    low = numpy.array(bounds[0::2], dtype=numpy.float64)
+    high = numpy.array(bounds[1::2], dtype=numpy.float64)
+    t = numpy.linspace(0.0, 1.0, int(resolution) + 1)[:, None]
+    return low + t * (high - low)
+
+
+class AMSStreamlineTracer(object):
+    """
+    Traces streamlines in a velocity field over the tet mesh of a
+    spatial index.
+    """
+    def __init__(self, index, velocity):
+        self.index = index
+        self.mesh = index.mesh
+        self.velocity = self.mesh.extendField(velocity)
+        bounds = numpy.array(self.mesh.getBounds()).reshape(3, 2)
+        self.diagonal = numpy.linalg.norm(bounds[:, 1] - bounds[:, 0])
+
+    def trace(self, seeds, maxSteps=2000, direction="both", integrator="rk45",
+              initialStep=0.2, minimumStep=0.01, maximumStep=0.5, maximumError=1e-6,
+              maximumLength=None, terminalSpeed=1e-12):
+        """
+        Traces a streamline from each seed ((n, 3) array) and returns them
+        as an AMSStreamlines.  Steps are in cell lengths, and with 'rk4'
+        the initial step is used throughout.  'direction' is 'forward',
+        'backward' or 'both'.
+        """
+        seeds = numpy.asarray(seeds, dtype=numpy.float64).reshape(-1, 3)
+        if maximumLength is None:
+            maximumLength = self.diagonal
+        signs = {"forward": [1.0], "backward": [-1.0], "both": [-1.0, 1.0]}[direction]
+
+        # One integration per seed and direction.
+        seedIds = numpy.tile(numpy.arange(len(seeds)), len(signs))
+        sign = numpy.repeat(signs, len(seeds))
+        n = len(seedIds)
+
+        tableau = INTEGRATORS[integrator]
+        adaptive = tableau["error"] is not None
+
+        position = seeds[seedIds].copy()
+        tet, weight = self.index.locate(position)
+        step = numpy.full(n, float(initialStep))
+        length = numpy.zeros(n)
+        time = numpy.zeros(n)
+        steps = numpy.zeros(n, dtype=numpy.int64)
+        reason = numpy.zeros(n, dtype=numpy.int64)
+        reason[tet < 0] = OUT_OF_DOMAIN
+
+        # What each streamline went through, point by point.
+        pathTets = numpy.full((n, maxSteps + 1), -1, dtype=numpy.int64)
+        pathWeights = numpy.zeros((n, maxSteps + 1, 4))
+        pathPoints = numpy.zeros((n, maxSteps + 1, 3))
+        pathTimes = numpy.zeros((n, maxSteps + 1))
+        pathTets[:, 0] = tet
+        pathWeights[:, 0] = weight
+        pathPoints[:, 0] = position
+
+        active = numpy.flatnonzero(reason == 0)
+        # Rejected steps don't count, but a streamline shouldn't be able
+        # to reject forever.
+        attempts = 0
+        while len(active) and attempts < 10 * maxSteps:
+            attempts += 1
+            x = position[active]
+            h = step[active]
+            velocity = self.mesh.interpolate(self.velocity, tet[active], weight[active])
+            speed = numpy.linalg.norm(velocity, axis=1)
+
+            stopped = speed <= terminalSpeed
+            reason[active[stopped]] = STAGNATION
+
+            cellLength = self.mesh.cellLength[tet[active]]
+            dt = sign[active] * h * cellLength / numpy.maximum(speed, terminalSpeed)
+
+            # The stages; a stage outside the mesh spoils the step.
+            k = [velocity]
+            inside = ~stopped
+            for coefficients in tableau["stages"][1:]:
+                stage = x + dt[:, None] * sum(c * kj for c, kj in zip(coefficients, k) if c)
+                stageTet, stageWeight = self.index.locate(stage, tet[active])
+                inside &= stageTet >= 0
+                stageTet[stageTet < 0] = 0
+                k.append(self.mesh.interpolate(self.velocity, stageTet, stageWeight))
+
+            change = dt[:, None] * sum(c * kj for c, kj in zip(tableau["weights"], k) if c)
+            newPosition = x + change
+            newTet, newWeight = self.index.locate(newPosition, tet[active])
+            inside &= newTet >= 0
+
+            if adaptive:
+                error = numpy.linalg.norm(dt[:, None] * sum(c * kj for c, kj in zip(tableau["error"], k) if c), axis=1)
+                error /= h * cellLength
+            else:
+                error = numpy.zeros(len(active))
+
+            # Steps that left the mesh or were too inaccurate are tried
+            # again with a smaller step, until the step can't get smaller.
+            canShrink = h > minimumStep * (1.0 + 1e-9)
+            retry = ~stopped & canShrink & (~inside | (error > maximumError))
+            leaving = ~stopped & ~inside & ~canShrink
+            reason[active[leaving]] = OUT_OF_DOMAIN
+            shrink = numpy.where(inside & (error > 0),
+                                 0.9 * (maximumError / numpy.maximum(error, 1e-300)) ** 0.25, 0.5)
+            step[active[retry]] = numpy.maximum(h[retry] * numpy.clip(shrink[retry], 0.1, 0.5), minimumStep)
+
+            accepted = ~stopped & inside & ~retry
+            ids = active[accepted]
+            position[ids] = newPosition[accepted]
+            tet[ids] = newTet[accepted]
+            weight[ids] = newWeight[accepted]
+            length[ids] += numpy.linalg.norm(change[accepted], axis=1)
+            time[ids] += numpy.abs(dt[accepted])
+            steps[ids] += 1
+            pathTets[ids, steps[ids]] = tet[ids]
+            pathWeights[ids, steps[ids]] = weight[ids]
+            pathPoints[ids, steps[ids]] = position[ids]
+            pathTimes[ids, steps[ids]] = sign[ids] * time[ids]
+            if adaptive:
+                grow = 0.9 * (maximumError / numpy.maximum(error[accepted], 1e-300)) ** 0.2
+                step[ids] = numpy.clip(h[accepted] * numpy.clip(grow, 0.1, 5.0), minimumStep, maximumStep)
+
+            reason[ids[length[ids] >= maximumLength]] = OUT_OF_LENGTH
+            reason[ids[(steps[ids] >= maxSteps) & (reason[ids] == 0)]] = OUT_OF_STEPS
+            active = active[reason[active] == 0]
+
+        reason[reason == 0] = OUT_OF_STEPS
+        return AMSStreamlines(self.mesh, seedIds, sign, steps + 1, pathPoints, pathTets,
+                              pathWeights, pathTimes, reason, len(seeds))
+
+
+class AMSStreamlines(object):
+    """
+    The result of a trace: one polyline per seed (the backward part
+    reversed, then the forward part), the tets and weights of their
+    points, and why each direction stopped.
+    """
+    def __init__(self, mesh, seedIds, sign, counts, points, tets, weights, times, reasons, numberOfSeeds):
+        self.mesh = mesh
+
+        # Put the two directions of each seed together, dropping the
+        # second copy of the seed point.
+        pieces = [[] for i in range(numberOfSeeds)]
+        for i in numpy.argsort(sign, kind="stable"):
+            count = counts[i]
+            if sign[i] < 0:
+                order = numpy.arange(count - 1, -1, -1)
+            else:
+                order = numpy.arange(1 if pieces[seedIds[i]] else 0, count)
+            pieces[seedIds[i]].append((i, order))
+
+        lines = []
+        self.seedIds = []
+        self.reasons = []
+        for seed, parts in enumerate(pieces):
+            rows = numpy.concatenate([numpy.full(len(order), i) for i, order in parts])
+            columns = numpy.concatenate([order for i, order in parts])
+            if len(rows) < 2 or tets[rows[0], columns[0]] < 0:
+                continue
+            lines.append((rows, columns))
+            self.seedIds.append(seed)
+            self.reasons.append(max(reasons[i] for i, order in parts))
+
+        rows = numpy.concatenate([r for r, c in lines]) if lines else numpy.zeros(0, dtype=numpy.int64)
+        columns = numpy.concatenate([c for r, c in lines]) if lines else numpy.zeros(0, dtype=numpy.int64)
+        self.points = points[rows, columns]
+        self.tets = tets[rows, columns]
+        self.weights = weights[rows, columns]
+        self.times = times[rows, columns]
+        self.offsets = numpy.cumsum([0] + [len(r) for r, c in lines])
+        self.seedIds = numpy.array(self.seedIds, dtype=numpy.int64)
+        self.reasons = numpy.array(self.reasons, dtype=numpy.int64)
+
+    def getNumberOfLines(self):
+        return len(self.offsets) - 1
+
+    def getNumberOfPoints(self):
+        return len(self.points)
+
+    def getLine(self, i):
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def interpolate(self, values):
+        """
+        Interpolates per-node values (scalars or vectors) at the points of
+        the streamlines.
+        """
+        return self.mesh.interpolate(self.mesh.extendField(values), self.tets, self.weights)
+
+    def makeVTKPolyData(self, pointArrays=None):
+        """
+        Returns the streamlines as a vtkPolyData of polylines, with the
+        given per-node arrays ({name: values}) interpolated onto them, and
+        StreamTracer's IntegrationTime, SeedIds and ReasonForTermination.
+        """
+        polyData = vtkPolyData()
+        points = vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(self.points.astype(numpy.float32), deep=1))
+        polyData.SetPoints(points)
+
+        counts = numpy.diff(self.offsets)
+        connectivity = numpy.empty(len(self.points) + len(counts), dtype=numpy.int64)
+        starts = self.offsets[:-1] + numpy.arange(len(counts))
+        connectivity[starts] = counts
+        mask = numpy.ones(len(connectivity), dtype=bool)
+        mask[starts] = False
+        connectivity[mask] = numpy.arange(len(self.points))
+        lines = vtkCellArray()
+        lines.SetCells(len(counts), numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=1))
+        polyData.SetLines(lines)
+
+        def addArray(data, name, values):
+            array = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(values), deep=1)
+            array.SetName(name)
+            data.AddArray(array)
+
+        for name, values in (pointArrays or {}).items():
+            addArray(polyData.GetPointData(), name, self.interpolate(values).astype(numpy.float32))
+        addArray(polyData.GetPointData(), "IntegrationTime", self.times)
+        addArray(polyData.GetCellData(), "SeedIds", self.seedIds.astype(numpy.int32))
+        addArray(polyData.GetCellData(), "ReasonForTermination", self.reasons.astype(numpy.int32))
+        return polyData
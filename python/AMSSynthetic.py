@@ -0,0 +1,489 @@
+r"""
+Synthetic EnSight Gold cases of any size, for scale testing.
+
+The two cases we ship have 448k points; production meshes run to tens
+of millions of cells.  This writes a 'C Binary' EnSight Gold case of a
+stirred tank (.case, .geo, .sclN per scalar and .vel), with as many
+cells, scalars, parts and time steps as asked for:
+
+    $ python AMSSynthetic.py --cells 10M --scalars 20 --parts 4 --steps 3 \
+          --output /scratch/synthetic [--name tank-10M] [--catalog files.json]
+
+The mesh is a hexahedral O-grid of the annulus between the impeller
+shaft and the tank wall, split into parts by height, like the zones of
+a Fluent export.  The fields are analytic and physically plausible:
+
+    velocity        a smoothed Rankine vortex around the shaft, damped at
+                    the wall, with the blade passing of a six-bladed
+                    impeller at mid-height, plus the two circulation
+                    loops of a radial impeller (from a Stokes stream
+                    function, so they are divergence free)
+    pressure        hydrostatic plus the radial equilibrium of the swirl
+    uds_0_scalar    a tracer fed near the top, drawn out along the swirl
+                    and mixing towards a uniform 100 over time (up to
+                    1000, so the default contour at 400 finds it)
+
+and the rest of the usual names (velocity components, magnitude,
+turb_kinetic_energy, vorticity_mag, coordinates), then scalar_N
+harmonics for as many more scalars as are wanted.  The impeller turns
+at --rpm, and each time step moves it on by --dt seconds.
+
+The files are written a chunk of grid layers at a time, so a 50M-cell
+case needs a few hundred MB of memory, not tens of GB.  The result
+reads with both ParaView's reader and AMSEnSight; --catalog adds an
+entry for it to a data config file.  bench/benchScale.py sweeps the
+server over a range of sizes of these.
+"""
+
+import os, json, math, time, argparse
+
+import numpy
+
+import AMSEnSight
+
+# A 90 L vessel about as tall as it is wide, in meters.
+TANK_RADIUS = 0.25
+TANK_HEIGHT = 0.5
+SHAFT_RADIUS = 0.0125
+IMPELLER_RADIUS = TANK_RADIUS / 3
+IMPELLER_HEIGHT = TANK_HEIGHT / 2
+BLADES = 6
+
+DENSITY = 998.0
+GRAVITY = 9.81
+
+# Where the tracer is fed, and how it spreads.
+FEED_RADIUS = 0.6 * TANK_RADIUS
+FEED_HEIGHT = 0.85 * TANK_HEIGHT
+FEED_WIDTH = 0.03
+FEED_STRETCH = 4.0          # along the swirl
+MIXING_TIME = 2.0
+MIXED_LEVEL = 100.0
+FEED_LEVEL = 1000.0
+
+# Scalars with names of their own, in .case order.  Beyond these they
+# are scalar_N.
+NAMED_SCALARS = [
+    "pressure", "uds_0_scalar", "velocity_magnitude", "axial_velocity",
+    "radial_velocity", "tangential_velocity", "x_velocity", "y_velocity",
+    "z_velocity", "turb_kinetic_energy", "vorticity_mag", "x_coordinate",
+    "y_coordinate", "z_coordinate", "radial_coordinate",
+]
+
+# Roughly how many nodes to generate at a time.
+CHUNK_NODES = 1 << 20
+
+
+def parseCount(text):
+    """
+    '448k', '10M', '2.5M' or '1000' -> an int.
+    """
+    text = str(text).strip()
+    scale = {"k": 1e3, "m": 1e6, "g": 1e9}.get(text[-1:].lower())
+    return int(float(text[:-1]) * scale) if scale else int(text)
+
+
+def formatCount(count):
+    for suffix, scale in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if count >= scale:
+            return ("%.1f" % (count / scale)).replace(".0", "") + suffix
+    return str(count)
+
+
+def scalarNames(count):
+    return (NAMED_SCALARS + ["scalar_%d" % i for i in range(len(NAMED_SCALARS), count)])[:count]
+
+
+def gridShape(cells):
+    """
+    Returns the number of nodes (radial, around, along the axis) of a grid
+    with about 'cells' cells, which are then about as wide as they are
+    deep and tall.
+    """
+    s = max(2, int(round((cells / 8.0) ** (1.0 / 3))))
+    return s + 1, 4 * s, 2 * s + 1
+
+
+# =============================================================================
+#
+# The flow
+#
+# =============================================================================
+
+class AMSStirredTank(object):
+    """
+    The analytic flow of a tank stirred at 'rpm'.  Everything takes
+    cylindrical coordinates (r, theta, z) and the time, as arrays.
+    """
+    def __init__(self, rpm=100.0):
+        self.rpm = rpm
+        self.omega = 2 * math.pi * rpm / 60.0
+        self.tipSpeed = self.omega * IMPELLER_RADIUS
+
+        # The swirl peaks at half the tip speed at the impeller radius;
+        # the circulation loops at 0.3 of the tip speed.  0.286 is the
+        # peak of rho (1 - rho^2)^2.
+        self.swirlSpeed = 0.5 * self.tipSpeed
+        self.loopSpeed = 0.3 * self.tipSpeed / 0.286
+
+    def swirl(self, r):
+        c = r / IMPELLER_RADIUS
+        return self.swirlSpeed * 2 * c / (1 + c * c)
+
+    def velocity(self, r, theta, z, t):
+        """
+        Returns the radial, tangential and axial velocity.
+        """
+        rho = r / TANK_RADIUS
+        zeta = z / TANK_HEIGHT
+
+        # The wall slows the swirl, and the blades push it around in
+        # waves near the impeller plane.
+        blades = 0.15 * numpy.cos(BLADES * (theta - self.omega * t)) * \
+            numpy.exp(-((z - IMPELLER_HEIGHT) / (0.1 * TANK_HEIGHT)) ** 2)
+        tangential = self.swirl(r) * (1 - rho ** 8) * (1 + blades)
+
+        # u_r = -(1/r) dpsi/dz and u_z = (1/r) dpsi/dr, for the stream
+        # function psi ~ rho^2 (1 - rho^2)^2 sin(2 pi zeta): a jet out of
+        # the impeller plane, up and down the wall, and back to the shaft.
+        radial = -self.loopSpeed * rho * (1 - rho * rho) ** 2 * numpy.cos(2 * math.pi * zeta)
+        axial = self.loopSpeed * TANK_HEIGHT / (math.pi * TANK_RADIUS) * \
+            (1 - rho * rho) * (1 - 3 * rho * rho) * numpy.sin(2 * math.pi * zeta)
+        return radial, tangential, axial
+
+    def pressure(self, r, z):
+        """
+        Hydrostatic, plus the integral of rho u^2 / r of the swirl (without
+        the wall and the blades).
+        """
+        c = r / IMPELLER_RADIUS
+        return DENSITY * (GRAVITY * (TANK_HEIGHT - z) + 2 * self.swirlSpeed ** 2 * c * c / (1 + c * c))
+
+    def axialVorticity(self, r):
+        c = r / IMPELLER_RADIUS
+        return 4 * self.swirlSpeed / (IMPELLER_RADIUS * (1 + c * c) ** 2)
+
+    def tracer(self, r, theta, z, t):
+        """
+        The tracer fed at the top, carried around by the swirl at the feed
+        radius, spreading and fading towards the mixed level.
+        """
+        angle = self.swirl(FEED_RADIUS) / FEED_RADIUS * t
+        width = FEED_WIDTH * math.sqrt(1 + t / MIXING_TIME)
+        peak = (FEED_WIDTH / width) ** 3
+        around = numpy.angle(numpy.exp(1j * (theta - angle)))
+        distance2 = (r - FEED_RADIUS) ** 2 + (z - FEED_HEIGHT) ** 2 + \
+            (FEED_RADIUS * around / FEED_STRETCH) ** 2
+        return MIXED_LEVEL + (FEED_LEVEL - MIXED_LEVEL) * peak * numpy.exp(-distance2 / (2 * width * width))
+
+    def fields(self, names, r, theta, z, t):
+        """
+        Returns {name: values} for the scalars, and "velocity" as its
+        (x, y, z) components, at the given points.
+        """
+        radial, tangential, axial = self.velocity(r, theta, z, t)
+        cos, sin = numpy.cos(theta), numpy.sin(theta)
+        vx = radial * cos - tangential * sin
+        vy = radial * sin + tangential * cos
+        speed = numpy.sqrt(radial ** 2 + tangential ** 2 + axial ** 2)
+
+        values = {"velocity": (vx, vy, axial)}
+        for i, name in enumerate(names):
+            if name == "pressure":
+                value = self.pressure(r, z)
+            elif name == "uds_0_scalar":
+                value = self.tracer(r, theta, z, t)
+            elif name == "velocity_magnitude":
+                value = speed
+            elif name == "axial_velocity" or name == "z_velocity":
+                value = axial
+            elif name == "radial_velocity":
+                value = radial
+            elif name == "tangential_velocity":
+                value = tangential
+            elif name == "x_velocity":
+                value = vx
+            elif name == "y_velocity":
+                value = vy
+            elif name == "turb_kinetic_energy":
+                # Highest in the impeller's discharge.
+                discharge = numpy.exp(-((z - IMPELLER_HEIGHT) / (0.08 * TANK_HEIGHT)) ** 2 -
+                                      ((r - IMPELLER_RADIUS) / (0.3 * IMPELLER_RADIUS)) ** 2)
+                value = 0.05 * speed ** 2 * (1 + 4 * discharge)
+            elif name == "vorticity_mag":
+                value = self.axialVorticity(r)
+            elif name == "x_coordinate":
+                value = r * cos
+            elif name == "y_coordinate":
+                value = r * sin
+            elif name == "z_coordinate":
+                value = z
+            elif name == "radial_coordinate":
+                value = r
+            else:
+                # Smooth harmonics, different for each one.
+                value = numpy.cos(math.pi * (i % 5 + 1) * r / TANK_RADIUS) * \
+                    numpy.sin(math.pi * (i % 3 + 1) * z / TANK_HEIGHT) * numpy.cos((i % 4) * theta)
+            values[name] = value
+        return values
+
+
+# =============================================================================
+#
+# The case
+#
+# =============================================================================
+
+def writeString(fp, text):
+    fp.write(text.encode("ascii")[:AMSEnSight.STRING_LENGTH].ljust(AMSEnSight.STRING_LENGTH, b"\0"))
+
+
+def writeInts(fp, values):
+    fp.write(numpy.ascontiguousarray(values, dtype="<i4").tobytes())
+
+
+def writeFloats(fp, values):
+    fp.write(numpy.ascontiguousarray(values, dtype="<f4").tobytes())
+
+
+class AMSSyntheticCase(object):
+    """
+    The layout of a synthetic case, and the writing of it.
+    """
+    def __init__(self, cells=1000000, scalars=10, parts=1, steps=1, rpm=100.0, dt=0.1):
+        self.nr, self.ntheta, self.nz = gridShape(cells)
+        if parts > self.nz - 1:
+            raise ValueError("%d parts, but only %d layers of cells" % (parts, self.nz - 1))
+        self.scalarNames = scalarNames(scalars)
+        self.steps = steps
+        self.timeValues = [round(i * dt, 6) for i in range(steps)]
+        self.flow = AMSStirredTank(rpm)
+
+        # Each part is a range of cell layers; the nodes of the layers in
+        # between belong to both parts, as they do in a Fluent export.
+        layers = numpy.array_split(numpy.arange(self.nz - 1), parts)
+        self.parts = [(int(layer[0]), int(layer[-1]) + 1) for layer in layers]
+
+        self.radii = numpy.linspace(SHAFT_RADIUS, TANK_RADIUS, self.nr)
+        self.angles = numpy.linspace(0, 2 * math.pi, self.ntheta, endpoint=False)
+        self.heights = numpy.linspace(0, TANK_HEIGHT, self.nz)
+
+    def getNumberOfCells(self):
+        return (self.nr - 1) * self.ntheta * (self.nz - 1)
+
+    def getNumberOfPoints(self):
+        return sum(self.getPartNodes(part) for part in self.parts)
+
+    def getPartNodes(self, part):
+        return self.nr * self.ntheta * (part[1] - part[0] + 1)
+
+    def getChunkLayers(self):
+        return max(1, CHUNK_NODES // (self.nr * self.ntheta))
+
+    def nodeChunks(self, part):
+        """
+        Yields (first node, r, theta, z) for the nodes of a part, a few
+        layers at a time.  Nodes are numbered layer by layer, then around,
+        then outwards.
+        """
+        layerNodes = self.nr * self.ntheta
+        for k in range(part[0], part[1] + 1, self.getChunkLayers()):
+            heights = self.heights[k:min(k + self.getChunkLayers(), part[1] + 1)]
+            z, theta, r = numpy.meshgrid(heights, self.angles, self.radii, indexing="ij")
+            yield (k - part[0]) * layerNodes, r.ravel(), theta.ravel(), z.ravel()
+
+    def cellChunks(self, part):
+        """
+        Yields the hexa8 connectivity (1-based) of the cells of a part, a
+        few layers at a time.
+        """
+        nr, ntheta = self.nr, self.ntheta
+        i = numpy.arange(nr - 1)[None, None, :]
+        j = numpy.arange(ntheta)[None, :, None]
+        nextJ = (j + 1) % ntheta
+        for k0 in range(0, part[1] - part[0], self.getChunkLayers()):
+            k = numpy.arange(k0, min(k0 + self.getChunkLayers(), part[1] - part[0]))[:, None, None]
+
+            def node(k, j, i):
+                return (k * ntheta + j) * nr + i + 1
+
+            corners = [node(k, j, i), node(k, j, i + 1), node(k, nextJ, i + 1), node(k, nextJ, i),
+                       node(k + 1, j, i), node(k + 1, j, i + 1), node(k + 1, nextJ, i + 1), node(k + 1, nextJ, i)]
+            shape = (len(k), ntheta, nr - 1)
+            yield numpy.stack([numpy.broadcast_to(c, shape) for c in corners], axis=-1).reshape(-1, 8)
+
+    def getFileNames(self, name):
+        """
+        Returns the file name patterns of the geometry and the variables.
+        """
+        suffix = ""
+        if self.steps > 1:
+            suffix = "." + "*" * max(4, len(str(self.steps - 1)))
+        names = {"geometry": name + ".geo", "velocity": name + ".vel" + suffix}
+        for i, scalar in enumerate(self.scalarNames):
+            names[scalar] = "%s.scl%d%s" % (name, i + 1, suffix)
+        return names
+
+    def write(self, directory, name, verbose=False):
+        """
+        Writes the case to 'directory' and returns the .case file name.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        start = time.time()
+        fileNames = self.getFileNames(name)
+
+        self.writeGeometry(os.path.join(directory, fileNames["geometry"]))
+        if verbose:
+            print("geometry: %s cells, %s points, %.1f s"
+                  % (formatCount(self.getNumberOfCells()), formatCount(self.getNumberOfPoints()),
+                     time.time() - start))
+
+        for step, t in enumerate(self.timeValues):
+            files = {}
+            for variable in ["velocity"] + self.scalarNames:
+                fileName = fileNames[variable]
+                stars = fileName.count("*")
+                if stars:
+                    fileName = fileName.replace("*" * stars, str(step).zfill(stars))
+                files[variable] = fileName
+            self.writeVariables(directory, files, t)
+            if verbose:
+                print("time step %d (t = %g): %.1f s" % (step, t, time.time() - start))
+
+        caseFile = os.path.join(directory, name + ".case")
+        self.writeCaseFile(caseFile, fileNames)
+        return caseFile
+
+    def writeGeometry(self, fileName):
+        with open(fileName, "wb") as fp:
+            writeString(fp, "C Binary")
+            writeString(fp, "AMS synthetic stirred tank, %d rpm" % self.flow.rpm)
+            writeString(fp, "%d x %d x %d nodes" % (self.nr, self.ntheta, self.nz))
+            writeString(fp, "node id off")
+            writeString(fp, "element id off")
+            writeString(fp, "extents")
+            writeFloats(fp, [-TANK_RADIUS, TANK_RADIUS, -TANK_RADIUS, TANK_RADIUS, 0.0, TANK_HEIGHT])
+
+            for partId, part in enumerate(self.parts, 1):
+                writeString(fp, "part")
+                writeInts(fp, [partId])
+                writeString(fp, "fluid" if len(self.parts) == 1 else "fluid section %d" % partId)
+                writeString(fp, "coordinates")
+                nodes = self.getPartNodes(part)
+                writeInts(fp, [nodes])
+
+                # All x, then all y, then all z: each chunk goes to its
+                # place in each of the three.
+                base = fp.tell()
+                for first, r, theta, z in self.nodeChunks(part):
+                    for component, values in enumerate((r * numpy.cos(theta), r * numpy.sin(theta), z)):
+                        fp.seek(base + 4 * (component * nodes + first))
+                        writeFloats(fp, values)
+                fp.seek(base + 12 * nodes)
+
+                writeString(fp, "hexa8")
+                writeInts(fp, [(self.nr - 1) * self.ntheta * (part[1] - part[0])])
+                for connectivity in self.cellChunks(part):
+                    writeInts(fp, connectivity)
+
+    def writeVariables(self, directory, files, t):
+        """
+        Writes every variable of a time step, computing the fields a chunk
+        at a time for all of them.
+        """
+        handles = dict((variable, open(os.path.join(directory, fileName), "wb"))
+                       for variable, fileName in files.items())
+        try:
+            for variable, fp in handles.items():
+                writeString(fp, variable)
+
+            for partId, part in enumerate(self.parts, 1):
+                nodes = self.getPartNodes(part)
+                bases = {}
+                for variable, fp in handles.items():
+                    writeString(fp, "part")
+                    writeInts(fp, [partId])
+                    writeString(fp, "coordinates")
+                    bases[variable] = fp.tell()
+
+                for first, r, theta, z in self.nodeChunks(part):
+                    values = self.flow.fields(self.scalarNames, r, theta, z, t)
+                    for variable, fp in handles.items():
+                        components = values[variable] if variable == "velocity" else (values[variable],)
+                        for component, array in enumerate(components):
+                            fp.seek(bases[variable] + 4 * (component * nodes + first))
+                            writeFloats(fp, array)
+
+                for variable, fp in handles.items():
+                    fp.seek(bases[variable] + 4 * nodes * (3 if variable == "velocity" else 1))
+        finally:
+            for fp in handles.values():
+                fp.close()
+
+    def writeCaseFile(self, caseFile, fileNames):
+        timeSet = " 1" if self.steps > 1 else ""
+        lines = ["FORMAT", "type:  ensight gold", "",
+                 "GEOMETRY", "model: " + fileNames["geometry"], "",
+                 "VARIABLE"]
+        for scalar in self.scalarNames:
+            lines.append("scalar per node:%s %-40s %s" % (timeSet, scalar, fileNames[scalar]))
+        lines.append("vector per node:%s %-40s %s" % (timeSet, "velocity", fileNames["velocity"]))
+
+        if self.steps > 1:
+            lines += ["", "TIME",
+                      "time set: 1",
+                      "number of steps: %d" % self.steps,
+                      "filename start number: 0",
+                      "filename increment: 1",
+                      "time values:"]
+            for i in range(0, self.steps, 6):
+                lines.append(" ".join("%g" % t for t in self.timeValues[i:i + 6]))
+
+        with open(caseFile, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+
+
+def addToCatalog(catalogFile, name, caseFile, description):
+    """
+    Adds (or replaces) an entry for the case in a data config file, as
+    AMSServer's --dataConfigFile reads it.
+    """
+    config = {"dataCatalog": {}}
+    if os.path.exists(catalogFile):
+        with open(catalogFile) as fp:
+            config = json.load(fp)
+    config.setdefault("dataCatalog", {})[name] = {
+        "fileName": os.path.abspath(caseFile),
+        "description": description,
+        "variables": {},
+    }
+    with open(catalogFile, "w") as fp:
+        json.dump(config, fp, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic stirred-tank EnSight Gold case")
+    parser.add_argument("--cells", default="1M", help="Number of cells, e.g. 500k or 20M")
+    parser.add_argument("--scalars", type=int, default=10, help="Number of scalar variables")
+    parser.add_argument("--parts", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=1, help="Number of time steps")
+    parser.add_argument("--dt", type=float, default=0.1, help="Seconds between time steps")
+    parser.add_argument("--rpm", type=float, default=100.0)
+    parser.add_argument("--output", required=True, help="Directory to write the case to")
+    parser.add_argument("--name", default=None, help="Base name of the files (default tank-<cells>)")
+    parser.add_argument("--catalog", default=None, help="Data config file to add the case to")
+    args = parser.parse_args()
+
+    case = AMSSyntheticCase(parseCount(args.cells), args.scalars, args.parts, args.steps, args.rpm, args.dt)
+    name = args.name or "tank-" + formatCount(case.getNumberOfCells())
+    caseFile = case.write(args.output, name, verbose=True)
+    print("wrote " + caseFile)
+
+    if args.catalog:
+        addToCatalog(args.catalog, name, caseFile,
+                     "Synthetic stirred tank, %s cells, %d rpm" % (formatCount(case.getNumberOfCells()), args.rpm))
+
+
+if __name__ == "__main__":
+    main()
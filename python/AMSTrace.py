@@ -0,0 +1,160 @@
+r"""
+Session traces: the amsprotocol.* RPCs a client made, with their
+arguments and times, for bench/benchReplay.py to replay.
+
+The server records one with --record-trace, a line of JSON per call:
+
+    $ pvpython AMSServer.py --dataConfigFile files.json --record-trace session.jsonl ...
+
+    {"t": 0.0, "rpc": "amsprotocol.get.data.catalog", "args": []}
+    {"t": 2.31, "rpc": "amsprotocol.execute.plot", "args": [{"visualization": ...}]}
+
+Traces can also be written by hand, as one JSON document:
+
+    {
+      "name": "slider-sweep",
+      "recipes": {"contour": {"EnumPlotType": "contour", ...}},
+      "calls": [
+        {"t": 0.0, "rpc": "amsprotocol.get.data.catalog"},
+        {"t": 0.5, "rpc": "amsprotocol.execute.plot",
+         "args": [{"visualization": "contour", "data": "$data0"}]},
+        {"t": 1.0, "rpc": "amsprotocol.change.surface", "args": ["0.35"]}
+      ]
+    }
+
+"t" is in seconds from the start of the session.  In the arguments,
+"$data0", "$data1", ... stand for the entries of the data catalog the
+trace is replayed against, in sorted order, and an execute.plot
+without a "vizCatalog" gets the trace's "recipes", so the same trace
+works with any catalog.
+
+The heartbeat and the metrics RPCs are not recorded: they say nothing
+about the session.
+"""
+
+import os, re, json, time, threading, functools
+
+SKIPPED = ("amsprotocol.heartbeat.update", "amsprotocol.metrics.get", "amsprotocol.metrics.prometheus")
+
+DATA_REFERENCE = re.compile(r"^\$data(\d+)$")
+
+try:
+    STRING_TYPES = basestring
+except NameError:
+    STRING_TYPES = str
+
+
+class AMSTraceRecorder(object):
+    """
+    Appends the calls to a trace file as they are made.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.fp = open(fileName, "w")
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, uri, args):
+        entry = {"t": round(time.time() - self.started, 4), "rpc": uri, "args": list(args)}
+        try:
+            line = json.dumps(entry)
+        except (TypeError, ValueError):
+            # Not JSON: not from a client, then.
+            return
+        with self.lock:
+            self.fp.write(line + "\n")
+            self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+
+# The server's recorder, if it is recording.
+recorder = None
+
+
+def startRecording(fileName):
+    global recorder
+    recorder = AMSTraceRecorder(fileName)
+    return recorder
+
+
+def recordRPCs(cls, prefix="amsprotocol."):
+    """
+    Wraps the RPC methods of a protocol class, as AMSMetrics.instrumentRPCs
+    does, so that their calls go to the recorder once there is one.
+    """
+    for attribute, method in list(vars(cls).items()):
+        uris = [entry["uri"] for entry in getattr(method, "_wslinkuris", [])]
+        uris = [uri for uri in uris if uri.startswith(prefix) and uri not in SKIPPED]
+        if uris:
+            setattr(cls, attribute, recordRPC(method, uris[0]))
+    return cls
+
+
+def recordRPC(method, uri):
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if recorder is not None:
+            recorder.record(uri, args)
+        return method(self, *args)
+    return wrapper
+
+
+# =============================================================================
+#
+# Reading traces
+#
+# =============================================================================
+
+def loadTrace(fileName):
+    """
+    Returns a trace as a dict with name, recipes and calls (sorted by
+    time), from either kind of file.
+    """
+    with open(fileName) as fp:
+        text = fp.read()
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    try:
+        trace = json.loads(text)
+    except ValueError:
+        trace = [json.loads(line) for line in text.splitlines() if line.strip()]
+    # A recording of one call is a single line, which parses as that call.
+    if isinstance(trace, dict) and "calls" not in trace and "rpc" in trace:
+        trace = [trace]
+    if isinstance(trace, list):
+        trace = {"calls": trace}
+
+    trace.setdefault("name", name)
+    trace.setdefault("recipes", {})
+    for call in trace["calls"]:
+        call.setdefault("t", 0.0)
+        call.setdefault("args", [])
+    trace["calls"].sort(key=lambda call: call["t"])
+    return trace
+
+
+def resolveArguments(trace, call, dataNames):
+    """
+    Returns the arguments of a call with the data references replaced by
+    names from 'dataNames', and the recipes filled in.
+    """
+    def resolve(value):
+        if isinstance(value, dict):
+            return dict((key, resolve(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        match = DATA_REFERENCE.match(value) if isinstance(value, STRING_TYPES) else None
+        if match:
+            index = int(match.group(1))
+            if index >= len(dataNames):
+                raise ValueError("the trace uses $data%d, and the catalog has %d entries"
+                                 % (index, len(dataNames)))
+            return dataNames[index]
+        return value
+
+    args = resolve(call["args"])
+    if call["rpc"] == "amsprotocol.execute.plot" and args and "vizCatalog" not in args[0]:
+        args[0]["vizCatalog"] = trace["recipes"]
+    return args
@@ -0,0 +1,72 @@
+r"""
+Benchmark of recipe-driven array selection: reader update time and
+resident memory when the EnSight reader loads every point array, versus
+only the arrays a plot recipe uses.
+
+    $ pvpython bench/benchArraySelection.py /path/to/case.case [color] [contour]
+
+Each configuration runs in its own process so the memory numbers don't
+bleed into each other:
+
+    all        ParaView reader, every point array (the old default)
+    selected   ParaView reader, only the recipe's arrays
+    native     native reader (AMSEnSight), only the recipe's arrays
+"""
+
+import os, sys, json
+
+import benchUtil
+
+
+def runConfiguration(mode, caseFile, arrays):
+    from paraview import simple
+    import AMS2Protocols
+
+    entry = {"fileName": caseFile, "description": mode}
+    if mode == "native":
+        entry["reader"] = "native"
+
+    baseline = benchUtil.residentMemory()
+    with benchUtil.Timer() as opening:
+        dataObject = AMS2Protocols.AMSDataObject(entry)
+
+    with benchUtil.Timer() as updating:
+        if mode == "all":
+            dataObject.caseData.PointArrays = dataObject.getNodeVariableNames()
+        else:
+            dataObject.useArrays(arrays)
+        dataObject.caseData.UpdatePipeline()
+
+    return {
+        "mode": mode,
+        "open": opening.elapsed,
+        "update": updating.elapsed,
+        "rss": benchUtil.residentMemory() - baseline,
+        "arrays": len(dataObject.caseData.PointData.keys()),
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        mode, caseFile = sys.argv[2], sys.argv[3]
+        print(json.dumps(runConfiguration(mode, caseFile, sys.argv[4:])))
+        return
+
+    caseFile = os.path.abspath(sys.argv[1])
+    color = sys.argv[2] if len(sys.argv) > 2 else "pressure"
+    contour = sys.argv[3] if len(sys.argv) > 3 else "uds_0_scalar"
+
+    results = [benchUtil.runChild(__file__, ["--child", mode, caseFile, color, contour])
+               for mode in ("all", "selected", "native")]
+
+    print("Case: " + caseFile)
+    print("Recipe arrays: " + color + ", " + contour)
+    benchUtil.printTable(
+        ["mode", "arrays", "open (s)", "update (s)", "RSS (MB)", "update speedup"],
+        [[r["mode"], r["arrays"], "%.2f" % r["open"], "%.2f" % r["update"],
+          "%.1f" % (r["rss"] / 1048576.0),
+          "%.1fx" % (results[0]["update"] / max(r["update"], 1e-6))] for r in results])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+r"""
+Benchmark of the host cache (AMSHostCache): total memory on the host as
+the number of server processes looking at the same case grows.
+
+    $ python bench/benchHostCache.py /path/to/case.case [variable ...]
+
+For each process count, that many processes start at once, and each
+decodes the case the way the native reader does for VTK (contiguous
+points, cell arrays, the given variables; by default pressure,
+uds_0_scalar and velocity), then waits.  We add up their proportional
+set sizes (PSS), which split shared pages evenly between the processes
+that map them, so the sum is what the host really spends.
+
+    private    every process decodes its own copy
+    shared     every process maps the arrays from the host cache
+
+The interpreter itself (measured with processes that load nothing) is
+subtracted, so the numbers are what the data costs.
+
+Needs Linux (/proc/<pid>/smaps_rollup or smaps).
+"""
+
+import os, sys, json, shutil, tempfile, subprocess
+
+import benchUtil
+
+import AMSEnSight
+import AMSHostCache
+
+COUNTS = (1, 2, 5, 10, 20)
+
+
+def proportionalMemory(pid):
+    """
+    Returns the PSS of a process in bytes.
+    """
+    for name in ("smaps_rollup", "smaps"):
+        try:
+            with open("/proc/%d/%s" % (pid, name)) as fp:
+                return sum(int(line.split()[1]) * 1024 for line in fp if line.startswith("Pss:"))
+        except IOError:
+            continue
+    return 0
+
+
+def runProcess(mode, caseFile, cacheRoot, variables):
+    """
+    Decodes the case and holds on to the arrays until stdin closes.
+    """
+    case = AMSEnSight.AMSEnSightCase(caseFile)
+    geometry = case.getGeometry()
+    arrays = []
+    with benchUtil.Timer() as loading:
+        if mode == "baseline":
+            pass
+        elif mode == "shared":
+            entry = AMSHostCache.AMSHostCache(cacheRoot).attach(case)
+            for i in range(len(geometry.parts)):
+                arrays.extend(entry.getPartArrays(i))
+                arrays.extend(entry.getPointArray(name, i) for name in variables)
+        else:
+            for part in geometry.parts:
+                arrays.append(part.getCoordinates().astype("float32"))
+                arrays.extend(AMSEnSight.makeVTKCells(part))
+                arrays.extend(case.getPartArray(name, part.partId).astype("float32") for name in variables)
+        # Touch every page, as VTK would.
+        for array in arrays:
+            if array is not None:
+                array.sum()
+
+    print(json.dumps({"load": loading.elapsed}))
+    sys.stdout.flush()
+    sys.stdin.read()
+    if mode == "shared":
+        entry.detach()
+
+
+def measure(mode, count, caseFile, cacheRoot, variables):
+    processes = [subprocess.Popen([sys.executable, __file__, "--child", mode, caseFile, cacheRoot] + variables,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                 for i in range(count)]
+    try:
+        loads = [json.loads(p.stdout.readline().decode("utf-8"))["load"] for p in processes]
+        total = sum(proportionalMemory(p.pid) for p in processes)
+    finally:
+        for p in processes:
+            p.stdin.close()
+            p.wait()
+    return total, max(loads)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        runProcess(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+        return
+
+    caseFile = os.path.abspath(sys.argv[1])
+    case = AMSEnSight.AMSEnSightCase(caseFile)
+    variables = [name for name in (sys.argv[2:] or ["pressure", "uds_0_scalar", "velocity"])
+                 if name in case.getVariableNames()]
+    case.close()
+
+    cacheRoot = tempfile.mkdtemp(prefix="benchHostCache", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+        rows = []
+        for count in COUNTS:
+            baseline = measure("baseline", count, caseFile, cacheRoot, variables)[0]
+            private, privateLoad = measure("private", count, caseFile, cacheRoot, variables)
+            shared, sharedLoad = measure("shared", count, caseFile, cacheRoot, variables)
+            rows.append([count, "%.1f" % ((private - baseline) / 1048576.0),
+                         "%.1f" % ((shared - baseline) / 1048576.0),
+                         "%.2f" % privateLoad, "%.2f" % sharedLoad])
+
+        print("Case: " + caseFile)
+        print("Variables: " + ", ".join(variables))
+        benchUtil.printTable(["processes", "private PSS (MB)", "shared PSS (MB)",
+                              "private load (s)", "shared load (s)"], rows)
+    finally:
+        shutil.rmtree(cacheRoot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+r"""
+Benchmark of image delivery over a scripted interaction: bandwidth and
+frames per second with every frame at full quality (the old fixed
+encoding) and with the quality tiers of AMSImageDelivery, over a few
+simulated links.
+
+    $ pvpython bench/benchImageDelivery.py [--frames 90] [--size 1280x800] [case.case]
+
+The interaction is an orbit of the camera, a frame per step, followed
+by the release of the mouse and the still frame.  The frames are really
+rendered and encoded; the link is simulated: each frame costs its render
+time, a round trip (the client asks for the next frame once it has the
+last) and its size over the link's bandwidth.  The adaptive runs are
+told the link's numbers as the client would report them.  Without a
+case, the scene is a contour of ParaView's Wavelet source.
+"""
+
+import argparse
+
+import benchUtil
+
+from paraview import simple
+
+try:
+    from vtkmodules.vtkPVClientWeb import vtkPVWebApplication
+except ImportError:
+    from vtk.vtkPVClientWeb import vtkPVWebApplication
+
+import AMSImageDelivery
+
+# name, round trip (s), bytes per second
+LINKS = [
+    ("lan", 0.001, 100e6),
+    ("wifi", 0.02, 5e6),
+    ("wan", 0.08, 1e6),
+]
+
+
+def makeScene(caseFile):
+    if caseFile:
+        source = simple.OpenDataFile(caseFile)
+    else:
+        source = simple.Contour(Input=simple.Wavelet(WholeExtent=[-50, 50, -50, 50, -50, 50]),
+                                ContourBy=['POINTS', 'RTData'], Isosurfaces=[150.0])
+    view = simple.GetActiveViewOrCreate('RenderView')
+    simple.Show(source, view)
+    view.ResetCamera()
+    return view
+
+
+def runInteraction(view, application, size, frames, link, fixedQuality):
+    """
+    Orbits the camera 'frames' times and releases the mouse.  Returns the
+    simulated seconds, the bytes sent and the tiers used, for the orbit,
+    and the size and time of the still frame.
+    """
+    name, rtt, bytesPerSecond = link
+    controller = AMSImageDelivery.AMSQualityController(fixedQuality=fixedQuality)
+    controller.setLink(rtt, bytesPerSecond)
+    delivery = AMSImageDelivery.AMSImageDelivery(decode=True, controller=controller,
+                                                 callLater=lambda *args: None)
+    delivery.getApplication = lambda: application
+
+    def frame():
+        with benchUtil.Timer() as rendering:
+            reply = delivery.stillRender({"view": -1, "size": size, "mtime": 0})
+        nbytes = AMSImageDelivery.frameBytes(reply)
+        return rendering.elapsed + rtt + nbytes / bytesPerSecond, nbytes, reply.get("tier")
+
+    seconds, sent, tiers = 0.0, 0, {}
+    camera = simple.GetActiveCamera()
+    for i in range(frames):
+        delivery.onInteraction("move")
+        camera.Azimuth(360.0 / frames)
+        elapsed, nbytes, tier = frame()
+        seconds += elapsed
+        sent += nbytes
+        tiers[tier] = tiers.get(tier, 0) + 1
+
+    delivery.onInteraction("up")
+    stillTime, stillBytes, stillTier = frame()
+    return {
+        "seconds": seconds,
+        "bytes": sent,
+        "tiers": tiers,
+        "stillTime": stillTime,
+        "stillBytes": stillBytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed against adaptive image quality over a scripted orbit")
+    parser.add_argument("--frames", type=int, default=90)
+    parser.add_argument("--size", default="1280x800")
+    parser.add_argument("--fixed-quality", type=int, default=100, dest="fixedQuality")
+    parser.add_argument("caseFile", nargs="?")
+    args = parser.parse_args()
+
+    size = [int(n) for n in args.size.lower().split("x")]
+    view = makeScene(args.caseFile)
+    application = vtkPVWebApplication()
+    application.SetImageEncoding(0)
+
+    rows = []
+    for link in LINKS:
+        for mode, fixedQuality in (("fixed %d" % args.fixedQuality, args.fixedQuality), ("adaptive", None)):
+            result = runInteraction(view, application, size, args.frames, link, fixedQuality)
+            rows.append([link[0], mode,
+                         "%.1f" % (args.frames / result["seconds"]),
+                         "%.2f" % (result["bytes"] / result["seconds"] / 1e6),
+                         "%.1f" % (result["bytes"] / 1e3 / args.frames),
+                         "%.0f" % (1000 * result["stillTime"]),
+                         ", ".join("%s %d" % item for item in sorted(result["tiers"].items()))])
+
+    print("Orbit of %d frames at %dx%d" % (args.frames, size[0], size[1]))
+    benchUtil.printTable(["link", "mode", "fps", "MB/s", "kB/frame", "still frame (ms)", "tiers"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+r"""
+Replays recorded sessions against AMSTest, without a browser, and
+reports the latency of each RPC, the peak memory and the proxies left
+behind; compared with a baseline, a regression fails the run.
+
+    $ pvpython bench/benchReplay.py --dataConfigFile files.json [--speed 1] \
+          [--baseline baseline.json] [--save-baseline baseline.json] \
+          bench/traces/sweep.json bench/traces/session.json ...
+
+A trace is a list of RPC calls with their times (see AMSTrace.py); the
+server records them with --record-trace, and bench/traces has a few
+written by hand.  Each trace is replayed in a fresh process, so that
+its peak RSS is its own.
+
+The replay runs AMSTest as the server does, with its jobs and scene
+updates on an event loop of our own.  Every frame the scene pushes is
+rendered and encoded by AMSImageDelivery as it would be for a client
+watching the view.  --speed 1 sends the calls at their recorded times,
+--speed 2 twice as fast, and --speed 0 as fast as the server takes
+them (one turn of the event loop between calls).
+
+The latency of an RPC that starts a job (execute.plot, change.surface)
+runs until the job is done and its frame pushed; jobs dropped because
+a newer one came in are counted, not timed.  For the others it is the
+time of the call.  The proxy counts are taken after the trace, once
+everything has run: the sources and representations that are still
+registered, which is how leaks show up.
+
+With --baseline, each trace's numbers are compared with the baseline's
+(saved by --save-baseline from an earlier run): a percentile more than
+--tolerance (a fraction) and --slack (seconds) over the baseline's, a
+peak RSS more than --tolerance over, more proxies or more failures is
+a regression, and the run exits with status 1.
+"""
+
+import os, sys, json, time, heapq, argparse, traceback
+
+import benchUtil
+
+import AMSTrace
+
+# Percentiles compared with the baseline.
+PERCENTILES = ("p50", "p95", "p99")
+
+
+class ReplayLoop(object):
+    """
+    The event loop of the replay: the callLater of the job scheduler,
+    the scene and the image delivery, run in real time from here.
+    """
+    def __init__(self):
+        self.timers = []
+        self.sequence = 0
+
+    def callLater(self, delay, function, *args):
+        self.sequence += 1
+        heapq.heappush(self.timers, (time.time() + delay, self.sequence, function, args))
+
+    def runOnce(self):
+        """
+        Runs the timers that are due; the ones they set go to the next
+        turn, as they would on the server.
+        """
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            due, sequence, function, args = heapq.heappop(self.timers)
+            function(*args)
+
+    def runUntil(self, deadline):
+        while True:
+            self.runOnce()
+            now = time.time()
+            if now >= deadline:
+                return
+            wait = deadline - now
+            if self.timers:
+                wait = min(wait, self.timers[0][0] - now)
+            if wait > 0:
+                time.sleep(wait)
+
+    def runUntilIdle(self, timeout=600.0):
+        deadline = time.time() + timeout
+        while self.timers and time.time() < deadline:
+            self.runUntil(min(self.timers[0][0], deadline))
+        return not self.timers
+
+
+def countProxies(servermanager):
+    pxm = servermanager.ProxyManager()
+    return dict((group, len(pxm.GetProxiesInGroup(group)))
+                for group in ("sources", "representations", "lookup_tables"))
+
+
+# =============================================================================
+#
+# The replay, in a child process
+#
+# =============================================================================
+
+def replay(traceFile, dataConfigFile, speed, size):
+    """
+    Replays a trace and returns its numbers.
+    """
+    from paraview import simple, servermanager
+    try:
+        from vtkmodules.vtkPVClientWeb import vtkPVWebApplication
+    except ImportError:
+        from vtk.vtkPVClientWeb import vtkPVWebApplication
+
+    import AMSProtocols
+    import AMSImageDelivery
+
+    trace = AMSTrace.loadTrace(traceFile)
+    with open(dataConfigFile) as fp:
+        dataCatalog = json.load(fp)["dataCatalog"]
+    dataNames = sorted(dataCatalog.keys())
+
+    loop = ReplayLoop()
+    application = vtkPVWebApplication()
+    application.SetImageEncoding(0)
+
+    # The server, with what the websocket would have given it.
+    amstest = AMSProtocols.AMSTest({}, "default", callLater=loop.callLater)
+    amstest.getApplication = lambda: application
+    pending = {}                # job id -> the call that started it
+    latencies = {}              # rpc -> [seconds]
+    counts = {}                 # rpc -> {"dropped": n, "failed": n}
+
+    def publish(topic, event):
+        if topic != amstest.JOB_TOPIC or event["state"] not in ("done", "failed", "cancelled"):
+            return
+        call = pending.pop(event["id"], None)
+        if call is None:
+            return
+        if event["state"] == "done":
+            latencies.setdefault(call["rpc"], []).append(time.time() - call["sent"])
+        else:
+            key = "dropped" if event["state"] == "cancelled" else "failed"
+            counts.setdefault(call["rpc"], {"dropped": 0, "failed": 0})[key] += 1
+
+    amstest.publish = publish
+
+    # A client watching the view: every frame the scene pushes gets
+    # rendered and encoded.
+    view = simple.GetActiveViewOrCreate('RenderView')
+    view.ViewSize = size
+    delivery = AMSImageDelivery.AMSImageDelivery(decode=True, callLater=loop.callLater)
+    delivery.getApplication = lambda: application
+    frames = []
+
+    def pushFrame(caller, event):
+        with benchUtil.Timer() as rendering:
+            delivery.stillRender({"view": -1, "size": size, "mtime": 0})
+        frames.append(rendering.elapsed)
+
+    application.AddObserver('UpdateEvent', pushFrame)
+    amstest.watchScene(view)
+
+    rpcs = {}
+    for attribute in dir(type(amstest)):
+        for entry in getattr(getattr(type(amstest), attribute), "_wslinkuris", []):
+            rpcs[entry["uri"]] = getattr(amstest, attribute)
+
+    with benchUtil.Timer() as startup:
+        amstest.initializeData(dataCatalog)
+        loop.runUntilIdle()
+
+    proxies = countProxies(servermanager)
+    maxSources = proxies["sources"]
+    start = time.time()
+    for call in trace["calls"]:
+        if call["rpc"] not in rpcs:
+            raise ValueError("%s: no such RPC" % call["rpc"])
+        if speed > 0:
+            loop.runUntil(start + call["t"] / speed)
+        else:
+            loop.runOnce()
+
+        args = AMSTrace.resolveArguments(trace, call, dataNames)
+        record = {"rpc": call["rpc"], "sent": time.time()}
+        try:
+            result = rpcs[call["rpc"]](*args)
+        except Exception:
+            traceback.print_exc()
+            counts.setdefault(call["rpc"], {"dropped": 0, "failed": 0})["failed"] += 1
+            continue
+        if isinstance(result, dict) and "job" in result:
+            pending[result["job"]] = record
+        else:
+            latencies.setdefault(call["rpc"], []).append(time.time() - record["sent"])
+        maxSources = max(maxSources, countProxies(servermanager)["sources"])
+
+    loop.runUntilIdle()
+    seconds = time.time() - start
+
+    results = {}
+    for rpc in set(latencies.keys()) | set(counts.keys()):
+        results[rpc] = benchUtil.latencyStats(latencies.get(rpc, []))
+        results[rpc].update(counts.get(rpc, {"dropped": 0, "failed": 0}))
+
+    proxies = countProxies(servermanager)
+    proxies["maxSources"] = maxSources
+    return {
+        "trace": trace["name"],
+        "calls": len(trace["calls"]),
+        "speed": speed,
+        "startup": startup.elapsed,
+        "seconds": seconds,
+        "rpcs": results,
+        "frames": benchUtil.latencyStats(frames),
+        "peakRSS": benchUtil.peakMemory(),
+        "proxies": proxies,
+    }
+
+
+# =============================================================================
+#
+# Reports and the baseline
+#
+# =============================================================================
+
+def milliseconds(seconds):
+    return "-" if seconds is None else "%.0f" % (1000 * seconds)
+
+
+def printResult(result):
+    print("")
+    print("%s: %d calls in %.1f s (startup %.1f s), peak RSS %.0f MB, proxies %s"
+          % (result["trace"], result["calls"], result["seconds"], result["startup"],
+             result["peakRSS"] / 1048576.0,
+             ", ".join("%s %d" % item for item in sorted(result["proxies"].items()))))
+    rows = []
+    for rpc in sorted(result["rpcs"].keys()):
+        stats = result["rpcs"][rpc]
+        rows.append([rpc.replace("amsprotocol.", ""), stats["count"], milliseconds(stats["p50"]),
+                     milliseconds(stats["p95"]), milliseconds(stats["p99"]), milliseconds(stats["max"]),
+                     stats["dropped"], stats["failed"]])
+    frames = result["frames"]
+    rows.append(["(frames)", frames["count"], milliseconds(frames["p50"]), milliseconds(frames["p95"]),
+                 milliseconds(frames["p99"]), milliseconds(frames["max"]), "-", "-"])
+    benchUtil.printTable(["rpc", "calls", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)", "dropped", "failed"],
+                         rows)
+
+
+def compare(result, baseline, tolerance, slack):
+    """
+    Returns the regressions of a trace's result against its baseline, as
+    messages.
+    """
+    regressions = []
+
+    def compareLatencies(label, current, base):
+        for p in PERCENTILES:
+            if current.get(p) is None or base.get(p) is None:
+                continue
+            if current[p] > base[p] * (1 + tolerance) + slack:
+                regressions.append("%s %s %s ms, baseline %s ms"
+                                   % (label, p, milliseconds(current[p]), milliseconds(base[p])))
+
+    for rpc, base in sorted(baseline["rpcs"].items()):
+        current = result["rpcs"].get(rpc)
+        if current is None:
+            continue
+        compareLatencies(rpc, current, base)
+        if current["failed"] > base["failed"]:
+            regressions.append("%s failed %d times, baseline %d" % (rpc, current["failed"], base["failed"]))
+    compareLatencies("frames", result["frames"], baseline["frames"])
+
+    if result["peakRSS"] > baseline["peakRSS"] * (1 + tolerance):
+        regressions.append("peak RSS %.0f MB, baseline %.0f MB"
+                           % (result["peakRSS"] / 1048576.0, baseline["peakRSS"] / 1048576.0))
+    for group, count in sorted(result["proxies"].items()):
+        if count > baseline["proxies"].get(group, count):
+            regressions.append("%s proxies %d, baseline %d" % (group, count, baseline["proxies"][group]))
+    return ["%s: %s" % (result["trace"], message) for message in regressions]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        traceFile, dataConfigFile, speed, size = sys.argv[2:6]
+        size = [int(n) for n in size.split("x")]
+        print(json.dumps(replay(traceFile, dataConfigFile, float(speed), size)))
+        return
+
+    parser = argparse.ArgumentParser(description="Replay session traces against AMSTest")
+    parser.add_argument("traces", nargs="+")
+    parser.add_argument("--dataConfigFile", required=True, help="Data catalog to replay against, as for AMSServer.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 for the recorded times, 0 for as fast as possible")
+    parser.add_argument("--size", default="1280x800")
+    parser.add_argument("--baseline", default=None, help="Results to compare with; regressions fail the run")
+    parser.add_argument("--save-baseline", default=None, dest="saveBaseline", help="Write the results here")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown and growth, as a fraction")
+    parser.add_argument("--slack", type=float, default=0.02, help="Allowed slowdown in seconds, for the fast calls")
+    args = parser.parse_args()
+
+    results = {}
+    for traceFile in args.traces:
+        result = benchUtil.runChild(__file__, ["--child", os.path.abspath(traceFile),
+                                               os.path.abspath(args.dataConfigFile),
+                                               str(args.speed), args.size.lower()])
+        results[result["trace"]] = result
+        printResult(result)
+
+    if args.saveBaseline:
+        with open(args.saveBaseline, "w") as fp:
+            json.dump({"speed": args.speed, "size": args.size, "traces": results}, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get("speed") != args.speed or baseline.get("size") != args.size:
+            print("warning: the baseline was run at speed %s, size %s"
+                  % (baseline.get("speed"), baseline.get("size")))
+        regressions = []
+        for name, result in sorted(results.items()):
+            if name in baseline["traces"]:
+                regressions += compare(result, baseline["traces"][name], args.tolerance, args.slack)
+            else:
+                print("warning: %s is not in the baseline" % name)
+        print("")
+        if regressions:
+            for message in regressions:
+                print("REGRESSION " + message)
+            sys.exit(1)
+        print("No regressions against %s" % args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+r"""
+Benchmark of how the server scales with the size of a case: synthetic
+stirred-tank cases (AMSSynthetic) from half a million to tens of
+millions of cells, each indexed, opened and plotted with the usual
+recipes.
+
+    $ pvpython bench/benchScale.py [--cells 500k,2M,10M,50M] [--scalars 10] \
+          [--parts 1] [--steps 1] [--reader paraview|native] [--numpyCells 2M] \
+          [--work /scratch/bench]
+
+For each size the case is written to the work directory (a temporary
+one by default, removed at the end), then a fresh process:
+
+    catalog     indexes it as getDataCatalog() does the first time
+                (AMSCatalog.computeMetadata: every variable's range)
+    open        opens it as AMSDataObject (the reader and the first
+                update)
+    contour     draws a contour of uds_0_scalar at 400
+    streams     draws streamlines with StreamTracer
+    numpy       draws streamlines with the NumPy engine, building the
+                spatial index on the way
+
+each drawn and saved as the batch renderer does (AMSBatch), and reports
+its peak RSS.  Cases of 10M cells and more take several GB of disk.
+
+The spatial index takes about 2 KB per hexahedral cell (6.5 tets of
+about 300 bytes each), more while it is built, so the numpy column is
+only run on cases of up to --numpyCells cells: a 10M cell case would
+need some 20 GB.
+"""
+
+import os, sys, json, shutil, tempfile, argparse
+
+import benchUtil
+
+import AMSSynthetic
+
+RECIPES = {
+    "contour": {"EnumPlotType": "contour", "EnumContourVariable": "uds_0_scalar",
+                "DoubleContourValue": 400, "EnumColorVariable": "pressure", "CellPlotName": "contour"},
+    "streams": {"EnumPlotType": "streamlines", "EnumColorVariable": "pressure", "CellPlotName": "streams"},
+    "numpy": {"EnumPlotType": "streamlines", "EnumStreamEngine": "numpy", "EnumColorVariable": "pressure",
+              "CellPlotName": "numpy"},
+}
+ORDER = ["contour", "streams", "numpy"]
+
+
+def runConfiguration(caseFile, reader, outputDir, names):
+    import AMSBatch
+    import AMSCatalog
+
+    with benchUtil.Timer() as indexing:
+        metadata = AMSCatalog.computeMetadata(caseFile)
+
+    dataCatalog = {"tank": {"fileName": caseFile, "description": "", "variables": {}, "reader": reader}}
+    renderer = AMSBatch.AMSBatchRenderer(dataCatalog, RECIPES)
+    result = {"catalog": indexing.elapsed, "points": metadata["numberOfPoints"],
+              "cells": metadata["numberOfCells"], "errors": []}
+    for name in names:
+        job = {"data": "tank", "recipe": name, "camera": "standard", "cameraName": "standard",
+               "file": name + ".png"}
+        timings = renderer.render(job, outputDir)
+        if timings["error"]:
+            result["errors"].append("%s: %s" % (name, timings["error"]))
+            continue
+        if timings["load"]:
+            result["open"] = timings["load"]
+        result[name] = timings["plot"] + timings["save"]
+    result["peakRSS"] = benchUtil.peakMemory()
+    return result
+
+
+def seconds(result, key):
+    return "%.2f" % result[key] if key in result else "-"
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(runConfiguration(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5].split(","))))
+        return
+
+    parser = argparse.ArgumentParser(description="Server scaling over synthetic cases")
+    parser.add_argument("--cells", default="500k,2M,10M", help="Comma-separated sizes, e.g. 500k,2M,10M,50M")
+    parser.add_argument("--scalars", type=int, default=10)
+    parser.add_argument("--parts", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=1)
+    parser.add_argument("--reader", default="paraview", choices=["paraview", "native"])
+    parser.add_argument("--numpyCells", default="2M", help="Largest case to run the numpy column on")
+    parser.add_argument("--work", default=None, help="Directory for the cases (kept); default a temporary one")
+    args = parser.parse_args()
+
+    work = args.work or tempfile.mkdtemp(prefix="benchScale")
+    rows = []
+    try:
+        for cells in [AMSSynthetic.parseCount(size) for size in args.cells.split(",")]:
+            case = AMSSynthetic.AMSSyntheticCase(cells, args.scalars, args.parts, args.steps)
+            name = "tank-" + AMSSynthetic.formatCount(case.getNumberOfCells())
+            directory = os.path.join(work, name)
+            with benchUtil.Timer() as generating:
+                caseFile = case.write(directory, name)
+            disk = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+            outputDir = os.path.join(directory, "images")
+            os.makedirs(outputDir)
+            recipes = [recipe for recipe in ORDER
+                       if recipe != "numpy" or case.getNumberOfCells() <= AMSSynthetic.parseCount(args.numpyCells)]
+            result = benchUtil.runChild(__file__, ["--child", caseFile, args.reader, outputDir, ",".join(recipes)])
+            for error in result["errors"]:
+                print("%s: %s" % (name, error))
+            rows.append([AMSSynthetic.formatCount(result["cells"]), AMSSynthetic.formatCount(result["points"]),
+                         "%.0f" % (disk / 1048576.0), "%.1f" % generating.elapsed,
+                         seconds(result, "catalog"), seconds(result, "open"),
+                         seconds(result, "contour"), seconds(result, "streams"), seconds(result, "numpy"),
+                         "%.0f" % (result["peakRSS"] / 1048576.0)])
+            if not args.work:
+                shutil.rmtree(directory)
+    finally:
+        if not args.work:
+            shutil.rmtree(work)
+
+    print("%d scalars, %d part(s), %d step(s), %s reader" % (args.scalars, args.parts, args.steps, args.reader))
+    benchUtil.printTable(["cells", "points", "disk (MB)", "generate (s)", "catalog (s)", "open (s)",
+                          "contour (s)", "streams (s)", "numpy (s)", "peak RSS (MB)"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+r"""
+Benchmark of isosurface extraction time versus isovalue, for the stock
+Contour filter and the span-space contour engine, on one or more cases.
+
+    $ pvpython bench/benchSpanSpace.py [--variable uds_0_scalar] [--values 10] case.case ...
+
+For every isovalue it also checks that both engines produce the same
+surface: the same number of triangles and bounds that agree to within
+the tolerance.
+"""
+
+import os, sys, argparse
+
+import benchUtil
+
+import numpy
+from paraview import simple
+
+import AMS2Protocols
+import AMSSpanSpace
+
+
+def surfaceSummary(dataObject):
+    """
+    Returns (number of cells, bounds) of a (composite) surface.
+    """
+    cells = 0
+    bounds = numpy.array([numpy.inf, -numpy.inf] * 3)
+    iterator = dataObject.NewIterator()
+    iterator.InitTraversal()
+    while not iterator.IsDoneWithTraversal():
+        leaf = iterator.GetCurrentDataObject()
+        if leaf.GetNumberOfCells() > 0:
+            cells += leaf.GetNumberOfCells()
+            b = numpy.array(leaf.GetBounds())
+            bounds[0::2] = numpy.minimum(bounds[0::2], b[0::2])
+            bounds[1::2] = numpy.maximum(bounds[1::2], b[1::2])
+        iterator.GoToNextItem()
+    return cells, bounds
+
+
+def benchCase(caseFile, variable, numberOfValues, tolerance):
+    dataObject = AMS2Protocols.AMSDataObject({"fileName": caseFile, "description": "",
+                                              "reader": "native", "pointArrays": [variable]})
+    dataset = dataObject.getDataSet()
+    low, high = dataObject.getEnSightCase().getRange(variable)
+
+    with benchUtil.Timer() as building:
+        index = dataObject.getSpanSpaceIndex(variable)
+    print("%s: %d cells, index built in %.2f s" % (os.path.basename(caseFile), index.numberOfCells, building.elapsed))
+
+    contour = simple.Contour(Input=dataObject.getData())
+    contour.ContourBy = ['POINTS', variable]
+
+    rows = []
+    failures = 0
+    for value in numpy.linspace(low, high, numberOfValues + 2)[1:-1]:
+        contour.Isosurfaces = [value]
+        with benchUtil.Timer() as stock:
+            contour.UpdatePipeline()
+        stockSurface = contour.GetClientSideObject().GetOutputDataObject(0)
+
+        with benchUtil.Timer() as spanSpace:
+            candidates = len(index.query(value))
+            surface = AMSSpanSpace.extractIsosurface(dataset, index, variable, [value])
+
+        stockCells, stockBounds = surfaceSummary(stockSurface)
+        cells, bounds = surfaceSummary(surface)
+        same = stockCells == cells and (cells == 0 or numpy.allclose(bounds, stockBounds, atol=tolerance))
+        failures += 0 if same else 1
+        rows.append(["%.4g" % value, candidates, cells, "%.3f" % stock.elapsed,
+                     "%.3f" % spanSpace.elapsed, "%.1fx" % (stock.elapsed / max(spanSpace.elapsed, 1e-6)),
+                     "ok" if same else "MISMATCH"])
+
+    benchUtil.printTable(["isovalue", "candidates", "triangles", "stock (s)", "span (s)", "speedup", "match"], rows)
+    simple.Delete(contour)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Span-space contour benchmark")
+    parser.add_argument("cases", nargs="+")
+    parser.add_argument("--variable", default="uds_0_scalar")
+    parser.add_argument("--values", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    failures = sum(benchCase(os.path.abspath(caseFile), args.variable, args.values, args.tolerance)
+                   for caseFile in args.cases)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
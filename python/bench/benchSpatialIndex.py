@@ -0,0 +1,112 @@
+r"""
+Benchmark of the spatial index (AMSSpatialIndex): build, save and load
+time, and batched query time against VTK's locators.
+
+    $ pvpython bench/benchSpatialIndex.py [--queries 100000] case.case
+
+First it checks that the index finds the mesh's own nodes, all of
+them, including the ones on the faces of the bounds; if it misses any,
+the run fails.
+
+The queries are random points in the bounds of the mesh.  'cells'
+finds the cell containing each point (vtkCellLocator's FindCell, one
+call per point); 'closest' finds the closest mesh node
+(vtkStaticPointLocator's FindClosestPoint).  The VTK locators are
+built for the run, as the filters do on every call.  Without VTK only
+our side is timed.  The index is saved to a temporary directory.
+"""
+
+import os, sys, shutil, argparse, tempfile
+
+import benchUtil
+
+import numpy
+
+import AMSStore
+import AMSSpatialIndex
+
+try:
+    from vtk.vtkCommonDataModel import vtkCellLocator, vtkStaticPointLocator
+    from vtk.vtkFiltersCore import vtkAppendFilter
+    import AMSEnSight
+except ImportError:
+    vtkCellLocator = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spatial index against VTK's locators")
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("caseFile")
+    args = parser.parse_args()
+
+    case = AMSStore.openCase(args.caseFile)
+    geometry = case.getGeometry()
+
+    with benchUtil.Timer() as building:
+        index = AMSSpatialIndex.buildSpatialIndex(geometry)
+    directory = tempfile.mkdtemp(prefix="benchSpatialIndex")
+    caseFile = os.path.join(directory, os.path.basename(args.caseFile))
+    try:
+        with benchUtil.Timer() as saving:
+            AMSSpatialIndex.saveSpatialIndex(caseFile, index, geometry.fileName)
+        with benchUtil.Timer() as loading:
+            index = AMSSpatialIndex.loadSpatialIndex(caseFile)
+        size = sum(os.path.getsize(os.path.join(dirpath, f))
+                   for dirpath, dirnames, files in os.walk(AMSSpatialIndex.getSpatialIndexDir(caseFile))
+                   for f in files)
+
+        # Every node of the mesh is in one of its tets.
+        nodes = index.mesh.points[:index.mesh.numberOfNodes]
+        tets, weights = index.locate(nodes)
+        missed = int((tets < 0).sum())
+        if missed:
+            print("FAILED: the index missed %d of the %d mesh nodes" % (missed, len(nodes)))
+            sys.exit(1)
+
+        bounds = numpy.array(index.getBounds()).reshape(3, 2)
+        points = numpy.random.RandomState(0).uniform(bounds[:, 0], bounds[:, 1], (args.queries, 3))
+
+        with benchUtil.Timer() as cellQueries:
+            cells, tets, weights = index.findCells(points)
+        with benchUtil.Timer() as closestQueries:
+            nodes, distances = index.findClosestPoints(points)
+
+        print("Case: %s  (%d tets, %d nodes, index %.1f MB)" % (args.caseFile, index.mesh.getNumberOfTets(),
+                                                                 index.mesh.numberOfNodes, size / 1048576.0))
+        print("index: build %.2f s, save %.2f s, load %.3f s" % (building.elapsed, saving.elapsed, loading.elapsed))
+        rows = [["cells", "%.2f" % cellQueries.elapsed, "%d" % (cells >= 0).sum()],
+                ["closest", "%.2f" % closestQueries.elapsed, "%d" % len(nodes)]]
+
+        if vtkCellLocator is not None:
+            # The locators take one dataset, so the parts go together.
+            append = vtkAppendFilter()
+            for part in geometry.parts:
+                append.AddInputData(AMSEnSight.makeVTKPart(part))
+            append.Update()
+            dataset = append.GetOutput()
+
+            with benchUtil.Timer() as vtkCellBuild:
+                cellLocator = vtkCellLocator()
+                cellLocator.SetDataSet(dataset)
+                cellLocator.BuildLocator()
+            with benchUtil.Timer() as vtkCellQueries:
+                found = sum(1 for p in points if cellLocator.FindCell(p) >= 0)
+            with benchUtil.Timer() as vtkPointBuild:
+                pointLocator = vtkStaticPointLocator()
+                pointLocator.SetDataSet(dataset)
+                pointLocator.BuildLocator()
+            with benchUtil.Timer() as vtkPointQueries:
+                for p in points:
+                    pointLocator.FindClosestPoint(p)
+            rows[0] += ["%.2f + %.2f" % (vtkCellBuild.elapsed, vtkCellQueries.elapsed), "%d" % found]
+            rows[1] += ["%.2f + %.2f" % (vtkPointBuild.elapsed, vtkPointQueries.elapsed), "%d" % len(points)]
+            header = ["%d queries" % len(points), "index (s)", "found", "VTK build + queries (s)", "found"]
+        else:
+            header = ["%d queries" % len(points), "index (s)", "found"]
+        benchUtil.printTable(header, rows)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
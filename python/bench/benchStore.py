@@ -0,0 +1,112 @@
+r"""
+Benchmark of the case store (AMSStore) against the raw EnSight files:
+disk footprint, cold load time and resident memory for a few encodings.
+
+    $ python bench/benchStore.py /path/to/case.case [variable ...]
+
+The case is converted into a temporary directory once per
+configuration.  Each load then runs in its own process, after asking
+the kernel to drop the files from the page cache (posix_fadvise), so
+that the times are for reading from disk rather than from memory.  The
+load opens the case, builds the geometry and touches every value of
+the given variables (by default pressure, uds_0_scalar and velocity).
+
+    ensight      the .case/.geo/.scl files, native reader
+    float32      store, as exported
+    float32+z    store, zlib
+    float16+z    store, half precision, zlib
+    q16+z        store, 16-bit quantized, zlib
+    q8+z         store, 8-bit quantized, zlib
+"""
+
+import os, sys, json, shutil, tempfile
+
+import benchUtil
+
+import AMSStore
+
+CONFIGURATIONS = [
+    ("float32", "float32", False),
+    ("float32+z", "float32", True),
+    ("float16+z", "float16", True),
+    ("q16+z", "q16", True),
+    ("q8+z", "q8", True),
+]
+
+
+def dropCache(fileNames):
+    """
+    Asks the kernel to forget the cached pages of the files.  Where that
+    isn't possible (not Linux), the loads are warm.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for fileName in fileNames:
+        fd = os.open(fileName, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def runLoad(fileName, variables):
+    baseline = benchUtil.residentMemory()
+    with benchUtil.Timer() as loading:
+        case = AMSStore.openCase(fileName)
+        geometry = case.getGeometry()
+        for part in geometry.parts:
+            part.getCoordinates().sum()
+            for block in part.blocks:
+                block.connectivity.sum()
+        for name in variables:
+            case.getPointArray(name).sum()
+    return {
+        "load": loading.elapsed,
+        "rss": benchUtil.residentMemory() - baseline,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(runLoad(sys.argv[2], sys.argv[3:])))
+        return
+
+    caseFile = os.path.abspath(sys.argv[1])
+    variables = sys.argv[2:] or ["pressure", "uds_0_scalar", "velocity"]
+
+    ensight = AMSStore.openCase(caseFile)
+    ensightFiles = ensight.getFiles()
+    variables = [name for name in variables if name in ensight.getVariableNames()]
+    ensight.close()
+
+    directory = tempfile.mkdtemp(prefix="benchStore")
+    try:
+        rows = []
+        cold = dropCache(ensightFiles)
+        result = benchUtil.runChild(__file__, ["--child", caseFile] + variables)
+        rawSize = sum(os.path.getsize(f) for f in ensightFiles if os.path.exists(f))
+        rows.append(["ensight", "%.1f" % (rawSize / 1048576.0), "-", "%.2f" % result["load"],
+                     "%.1f" % (result["rss"] / 1048576.0), "0"])
+
+        for label, encoding, compress in CONFIGURATIONS:
+            storeFile = os.path.join(directory, label + AMSStore.STORE_SUFFIX)
+            with benchUtil.Timer() as converting:
+                footer = AMSStore.convert(caseFile, storeFile, encoding, compress=compress)
+            dropCache([storeFile])
+            result = benchUtil.runChild(__file__, ["--child", storeFile] + variables)
+            error = max(footer["variables"][name]["maxError"] for name in footer["variableNames"])
+            rows.append([label, "%.1f" % (os.path.getsize(storeFile) / 1048576.0),
+                         "%.1f" % converting.elapsed, "%.2f" % result["load"],
+                         "%.1f" % (result["rss"] / 1048576.0), "%.3g" % error])
+            os.remove(storeFile)
+
+        print("Case: " + caseFile)
+        print("Variables loaded: " + ", ".join(variables) + ("" if cold else "  (warm cache)"))
+        benchUtil.printTable(["format", "disk (MB)", "convert (s)", "load (s)", "RSS (MB)", "max error"], rows)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+r"""
+Benchmark of streamline tracing time versus number of seeds, for
+ParaView's StreamTracer and the NumPy engine (AMSStreamlines), with a
+check of how far apart their streamlines are.
+
+    $ pvpython bench/benchStreamlines.py [--resolutions 30,100,200,450,1000] [--steps 600] case.case
+
+Both engines trace from the same High Resolution Line Source (the
+diagonal of the bounds) with StreamTracer's default settings, in both
+directions.  For each seed traced by both, the distance from every
+point of our streamline to the nearest point of StreamTracer's is
+averaged over the line; the table gives the mean and worst of those,
+relative to the diagonal of the bounds.  The NumPy engine's setup (the
+spatial index, built here and not saved) is paid once per case and
+reported separately.
+"""
+
+import os, sys, argparse
+
+import benchUtil
+
+import numpy
+from paraview import simple
+from vtk.util import numpy_support
+
+import AMSEnSight
+import AMSSpatialIndex
+import AMSStreamlines
+import AMS2Protocols
+
+
+def linesBySeed(polyData):
+    """
+    Returns {seed id: (n, 3) points} for a polyline output.
+    """
+    points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+    seeds = numpy_support.vtk_to_numpy(polyData.GetCellData().GetArray("SeedIds"))
+    lines = {}
+    for i in range(polyData.GetNumberOfCells()):
+        ids = polyData.GetCell(i).GetPointIds()
+        line = points[[ids.GetId(j) for j in range(ids.GetNumberOfIds())]]
+        seed = int(seeds[i])
+        lines[seed] = numpy.concatenate([lines[seed], line]) if seed in lines else line
+    return lines
+
+
+def lineDistance(line, reference):
+    """
+    Mean distance from the points of a line to the nearest point of the
+    reference line.
+    """
+    distances = []
+    for start in range(0, len(line), 256):
+        chunk = line[start:start + 256]
+        d = numpy.linalg.norm(chunk[:, None, :] - reference[None, :, :], axis=2)
+        distances.append(d.min(axis=1))
+    return numpy.concatenate(distances).mean()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StreamTracer against the NumPy streamline engine")
+    parser.add_argument("--resolutions", default="30,100,200,450,1000")
+    parser.add_argument("--steps", type=int, default=600)
+    parser.add_argument("caseFile")
+    args = parser.parse_args()
+
+    case = AMSEnSight.AMSEnSightCase(args.caseFile)
+    velocity = case.getPointArray("velocity")
+
+    with benchUtil.Timer() as setup:
+        index = AMSSpatialIndex.buildSpatialIndex(case.getGeometry())
+        tracer = AMSStreamlines.AMSStreamlineTracer(index, velocity)
+    bounds = index.getBounds()
+    diagonal = numpy.linalg.norm(numpy.array(bounds[1::2]) - numpy.array(bounds[0::2]))
+
+    producer = AMS2Protocols.makeTrivialProducer(AMSEnSight.makeVTKDataSet(case, ["velocity"]))
+    streamTracer = simple.StreamTracer(Input=producer, SeedType='High Resolution Line Source')
+    streamTracer.Vectors = ['POINTS', 'velocity']
+    streamTracer.MaximumSteps = args.steps
+    streamTracer.SeedType.Point1 = bounds[0::2]
+    streamTracer.SeedType.Point2 = bounds[1::2]
+
+    rows = []
+    for resolution in [int(r) for r in args.resolutions.split(",")]:
+        streamTracer.SeedType.Resolution = resolution
+        with benchUtil.Timer() as tracing:
+            streamTracer.UpdatePipeline()
+        reference = linesBySeed(streamTracer.GetClientSideObject().GetOutputDataObject(0))
+
+        seeds = AMSStreamlines.lineSeeds(bounds, resolution)
+        with benchUtil.Timer() as numpyTracing:
+            lines = tracer.trace(seeds, maxSteps=args.steps)
+            output = lines.makeVTKPolyData()
+        ours = linesBySeed(output)
+
+        common = sorted(set(ours) & set(reference))
+        distances = [lineDistance(ours[s], reference[s]) / diagonal for s in common]
+        rows.append([resolution + 1, "%.2f" % tracing.elapsed, "%.2f" % numpyTracing.elapsed,
+                     "%.1f" % (tracing.elapsed / max(numpyTracing.elapsed, 1e-9)),
+                     "%d/%d" % (len(ours), len(reference)),
+                     "%.2e" % (numpy.mean(distances) if distances else numpy.nan),
+                     "%.2e" % (numpy.max(distances) if distances else numpy.nan)])
+
+    print("Case: %s  (%d tets, NumPy engine setup %.2f s)" % (args.caseFile, index.mesh.getNumberOfTets(), setup.elapsed))
+    benchUtil.printTable(["seeds", "StreamTracer (s)", "numpy (s)", "speedup",
+                          "lines ours/theirs", "mean distance", "max distance"], rows)
+
+
+if __name__ == "__main__":
+    main()
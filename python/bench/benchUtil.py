@@ -0,0 +1,90 @@
+r"""
+Small helpers shared by the benchmark scripts in this directory.
+"""
+
+import os, sys, math, time, json, subprocess
+
+# The benchmarks import the server modules from the directory above.
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PYTHON_DIR not in sys.path:
+    sys.path.insert(0, PYTHON_DIR)
+
+
+def residentMemory():
+    """
+    Returns the current resident set size of this process in bytes.
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # No /proc (macOS): fall back to the peak, which ru_maxrss reports in
+    # bytes there.
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peakMemory():
+    """
+    Returns the peak resident set size of this process in bytes.
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform.startswith("linux"):
+        peak *= 1024
+    return peak
+
+
+class Timer(object):
+    """
+    Context manager that records the elapsed wall time in 'elapsed'.
+    """
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
+
+
+def runChild(script, args):
+    """
+    Runs a benchmark configuration in a fresh interpreter (the same one
+    running us, e.g. pvpython) and returns the JSON it prints on its last
+    line of output.
+    """
+    output = subprocess.check_output([sys.executable, script] + list(args))
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile (0 < p <= 1) of the values, by nearest
+    rank, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(p * len(ordered))) - 1)]
+
+
+def latencyStats(values):
+    """
+    Returns the count, p50, p95, p99 and max of a list of times.
+    """
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def printTable(header, rows):
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))